@@ -0,0 +1,516 @@
+"""Benchmarks
+- pipeline   : compares the per-element float32 pipeline with the batch-first uint8 pipeline of TFDatasets
+               in images/sec & resident memory.
+- train_step : compares the per-update WGAN train step (n_critics + 1 graph calls) with the fused one (1 call)
+               in ms/iteration, on CPU & synthetic batches, to see the dispatch overhead.
+- critic_step : compares the WGAN weight clipping, as layer constraints (within the optimizer update) or
+               as a per-variable loop after it, in critic steps/sec on CPU & synthetic batches.
+- precision  : compares the WGAN precisions (fp32, bf16, mixed_bf16) in steps/sec & the loss curves vs fp32,
+               on CPU & synthetic batches, with the same seed.
+- xla        : compares the WGAN train steps with & without --jit_compile on CPU, separating the first call
+               (trace + XLA compile, cold cache) from the steady-state step time (cached, no re-tracing).
+- scaling    : data-parallel WGAN training over 1..n replicas on one machine, in images/sec & scaling efficiency
+               (per-replica images/sec over the first run's). bs is the per-replica batch size (weak scaling).
+               multi_worker launches n worker processes on localhost ports (TF_CONFIG),
+               mirrored splits one process' CPU into n logical devices.
+- urbansound : the streaming waveform loader (UrbanSoundDataSet) on synthetic 22.05kHz stereo .wav files,
+               resampled to 16kHz, in frames/sec & resident memory.
+each case runs in a fresh process.
+
+$ python3 -m awesome_gans.benchmark --target pipeline --dataset cifar10 --bs 64 --n_batches 500
+$ python3 -m awesome_gans.benchmark --target train_step --bs 16 --n_feats 8 --z_dims 16 --n_batches 200
+$ python3 -m awesome_gans.benchmark --target critic_step --bs 16 --n_feats 8 --z_dims 16 --n_batches 500
+$ python3 -m awesome_gans.benchmark --target precision --bs 64 --n_batches 200
+$ python3 -m awesome_gans.benchmark --target xla --bs 64 --n_batches 200
+$ python3 -m awesome_gans.benchmark --target scaling --strategy multi_worker --n_workers 1,2,4 --bs 16 --n_batches 100
+$ python3 -m awesome_gans.benchmark --target urbansound --bs 64 --n_threads 8 --n_batches 200
+"""
+import json
+import multiprocessing as mp
+import os
+import queue
+import resource
+import socket
+import tempfile
+import time
+import wave
+
+from awesome_gans.wgan.config import build_parser
+
+
+def get_rss_mb() -> float:
+    """current resident memory (Linux), or the peak one on the other platforms."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def run_pipeline(config) -> dict:
+    import tensorflow as tf
+
+    from awesome_gans.data import TFDatasets
+
+    dataset = TFDatasets(config)
+    ds = dataset.load_dataset(use_label=False).repeat()
+
+    @tf.function
+    def consume(batch: tf.Tensor) -> tf.Tensor:
+        if batch.dtype == tf.uint8:
+            batch = TFDatasets.normalize_batch(batch)
+        return tf.reduce_mean(batch)
+
+    iterator = iter(ds)
+
+    # warm-up, fills the cache (& the shuffle buffer) at first
+    for _ in range(config.n_warmup):
+        consume(next(iterator)).numpy()
+
+    start_time = time.time()
+    for _ in range(config.n_batches):
+        consume(next(iterator)).numpy()
+    elapsed_time = time.time() - start_time
+
+    return {
+        'pipeline': config.pipeline,
+        'images/sec': config.n_batches * config.bs / elapsed_time,
+        'rss (MB)': get_rss_mb(),
+    }
+
+
+def run_train_step(config) -> dict:
+    import tensorflow as tf
+
+    tf.config.set_visible_devices([], 'GPU')  # dispatch overhead shows up the most on CPU
+
+    from awesome_gans.wgan.model import WGAN
+
+    model = WGAN(config)
+
+    x = tf.random.uniform((config.bs, config.height, config.width, config.n_channels), -1.0, 1.0)
+    iterator = iter(tf.data.Dataset.from_tensors(x).repeat())
+
+    def step():
+        if not config.fused_step:
+            for _ in range(config.n_critics):
+                d_loss = model.train_discriminator(x)
+            g_loss = model.train_generator()
+        elif config.fresh_critic_batches:
+            d_loss, g_loss = model.train_step_fresh(iterator)
+        else:
+            d_loss, g_loss = model.train_step(x)
+        return float(d_loss), float(g_loss)  # waits for the step
+
+    # warm-up, traces the functions at first
+    for _ in range(config.n_warmup):
+        step()
+
+    start_time = time.time()
+    for _ in range(config.n_batches):
+        step()
+    elapsed_time = time.time() - start_time
+
+    return {
+        'fused_step': config.fused_step,
+        'fresh_critic_batches': config.fresh_critic_batches,
+        'ms/iter': 1e3 * elapsed_time / config.n_batches,
+    }
+
+
+def run_critic_step(config) -> dict:
+    import tensorflow as tf
+
+    tf.config.set_visible_devices([], 'GPU')
+
+    from awesome_gans.wgan.model import WGAN
+
+    model = WGAN(config)
+
+    x = tf.random.uniform((config.bs, config.height, config.width, config.n_channels), -1.0, 1.0)
+
+    # warm-up, traces the function at first
+    for _ in range(config.n_warmup):
+        float(model.train_discriminator(x))
+
+    start_time = time.time()
+    for _ in range(config.n_batches):
+        d_loss = model.train_discriminator(x)
+    float(d_loss)  # waits for the last step
+    elapsed_time = time.time() - start_time
+
+    max_weight = max(float(tf.reduce_max(tf.abs(var))) for var in model.discriminator.trainable_variables)
+
+    return {
+        'clip_mode': config.clip_mode,
+        'steps/sec': config.n_batches / elapsed_time,
+        'max |w|': max_weight,
+    }
+
+
+def run_precision(config) -> dict:
+    import tensorflow as tf
+
+    tf.config.set_visible_devices([], 'GPU')
+    tf.random.set_seed(config.seed)  # the same initial weights for every precision
+
+    from awesome_gans.wgan.model import WGAN
+
+    model = WGAN(config)
+
+    x = tf.random.stateless_uniform(
+        (config.bs, config.height, config.width, config.n_channels), seed=(config.seed, 1), minval=-1.0, maxval=1.0
+    )
+
+    d_losses, g_losses = [], []
+
+    def step():
+        for _ in range(config.n_critics):
+            d_loss = model.train_discriminator(x)
+        g_loss = model.train_generator()
+        d_losses.append(float(d_loss))
+        g_losses.append(float(g_loss))
+
+    # warm-up, traces the functions at first
+    for _ in range(config.n_warmup):
+        step()
+
+    start_time = time.time()
+    for _ in range(config.n_batches):
+        step()
+    elapsed_time = time.time() - start_time
+
+    return {
+        'precision': config.precision,
+        'steps/sec': config.n_batches / elapsed_time,
+        'd_loss': d_losses,
+        'g_loss': g_losses,
+    }
+
+
+def run_xla(config) -> dict:
+    import tensorflow as tf
+
+    tf.config.set_visible_devices([], 'GPU')
+
+    from awesome_gans.wgan.model import WGAN
+
+    model = WGAN(config)
+
+    x = tf.random.uniform((config.bs, config.height, config.width, config.n_channels), -1.0, 1.0)
+    z = tf.random.uniform((config.n_samples, config.z_dims))
+
+    # the first calls : trace (+ XLA compile), measured one by one
+    first_call = {}
+    for name, call in (
+        ('train_discriminator', lambda: model.train_discriminator(x)),
+        ('train_generator', lambda: model.train_generator()),
+        ('generate_samples', lambda: model.generate_samples(z)),
+    ):
+        start_time = time.time()
+        float(tf.reduce_mean(call()))
+        first_call[name] = time.time() - start_time
+
+    # warm-up, then the steady state (n_critics D steps + 1 G step per iteration)
+    for _ in range(config.n_warmup):
+        for _ in range(config.n_critics):
+            model.train_discriminator(x)
+        float(model.train_generator())
+
+    n_traces = model.train_discriminator.experimental_get_tracing_count()
+
+    start_time = time.time()
+    for _ in range(config.n_batches):
+        for _ in range(config.n_critics):
+            model.train_discriminator(x)
+        g_loss = model.train_generator()
+    float(g_loss)  # waits for the last step
+    elapsed_time = time.time() - start_time
+
+    return {
+        'jit_compile': config.jit_compile,
+        'first_call': first_call,
+        'ms/iter': 1e3 * elapsed_time / config.n_batches,
+        're-traces': model.train_discriminator.experimental_get_tracing_count() - n_traces,
+    }
+
+
+def run_urbansound(config, result_queue):
+    """in a non-daemonic process, UrbanSoundDataSet starts its own worker pool."""
+    import numpy as np
+
+    from awesome_gans.datasets import UrbanSoundDataSet
+
+    sample_rate, n_seconds = 22050, 30
+    with tempfile.TemporaryDirectory() as ds_path:
+        rng = np.random.RandomState(config.seed)
+        for i in range(config.n_threads * 4):
+            data = rng.uniform(-0.5, 0.5, size=(sample_rate * n_seconds, 2))
+            with wave.open(os.path.join(ds_path, f'{i}.wav'), 'wb') as f:
+                f.setnchannels(2)
+                f.setsampwidth(2)
+                f.setframerate(sample_rate)
+                f.writeframes(np.round(data * 32767).astype('<i2').tobytes())
+
+        ds = UrbanSoundDataSet(
+            ds_path=ds_path, batch_size=config.bs, shuffle_buffer=config.bs * 4, n_threads=config.n_threads
+        )
+
+        # measured from the first batch, after the pool started & the shuffle buffer filled
+        batches = ds.iterate(n_epochs=None)
+        next(batches)
+
+        start_time = time.time()
+        for _ in range(config.n_batches):
+            next(batches)
+        elapsed_time = time.time() - start_time
+        batches.close()
+
+    result_queue.put(
+        {
+            'frames/sec': config.n_batches * config.bs / elapsed_time,
+            'rss (MB)': get_rss_mb(),
+        }
+    )
+
+
+def get_free_ports(n: int) -> list:
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_STREAM) for _ in range(n)]
+    for sock in sockets:
+        sock.bind(('localhost', 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def run_scaling(config, tf_config: str, result_queue):
+    """one worker (process) of the data-parallel run, the chief puts its result into the queue."""
+    if tf_config:
+        os.environ['TF_CONFIG'] = tf_config  # read when the strategy is created
+
+    import tensorflow as tf
+
+    from awesome_gans.utils import build_strategy
+
+    tf.config.set_visible_devices([], 'GPU')
+    if config.n_intra_threads > 0:  # the workers share the cores
+        tf.config.threading.set_intra_op_parallelism_threads(config.n_intra_threads)
+
+    strategy = build_strategy(config.strategy, config.n_cpu_devices)
+
+    from awesome_gans.wgan.model import WGAN
+
+    model = WGAN(config, strategy)
+
+    # synthetic global batches, every replica takes bs / n_replicas of them
+    x = tf.random.uniform((config.bs, config.height, config.width, config.n_channels), -1.0, 1.0)
+    ds = tf.data.Dataset.from_tensors(x).repeat()
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    iterator = iter(strategy.experimental_distribute_dataset(ds.with_options(options)))
+
+    # warm-up, traces the function at first
+    for _ in range(config.n_warmup):
+        float(model.train_step(next(iterator))[1])
+
+    start_time = time.time()
+    for _ in range(config.n_batches):
+        d_loss, g_loss = model.train_step(next(iterator))
+    float(g_loss)  # waits for the last step
+    elapsed_time = time.time() - start_time
+
+    if model.is_chief:
+        result_queue.put(
+            {
+                'n_replicas': model.n_replicas,
+                'images/sec': config.n_batches * config.bs / elapsed_time,
+                'ms/iter': 1e3 * elapsed_time / config.n_batches,
+            }
+        )
+
+
+def get_result(result_queue, processes: list, timeout: float = 1.0) -> dict:
+    """waits for the result of the processes, raises instead of hanging if they exit without putting one.
+
+    :param result_queue: the queue the processes put their result into
+    :param processes: the started processes
+    :param timeout: seconds between the liveness checks
+    :return: the result
+    """
+    while True:
+        try:
+            return result_queue.get(timeout=timeout)
+        except queue.Empty:  # the others would wait on the collectives forever
+            failed: bool = any(process.exitcode not in (None, 0) for process in processes)
+            if not failed and all(process.exitcode is not None for process in processes):
+                try:  # exited cleanly, the result may still be on its way through the pipe
+                    return result_queue.get(timeout=timeout)
+                except queue.Empty:
+                    pass
+            elif not failed:
+                continue
+
+            for process in processes:
+                process.terminate()
+            exit_codes = [process.exitcode for process in processes]
+            raise RuntimeError(f'[-] the benchmark processes exited without a result, exit codes : {exit_codes} :(')
+
+
+def main():
+    parser = build_parser()
+    parser.add_argument(
+        '--target',
+        default='pipeline',
+        type=str,
+        choices=['pipeline', 'train_step', 'critic_step', 'precision', 'xla', 'scaling', 'urbansound'],
+    )
+    parser.add_argument(
+        '--n_workers', default='1,2', type=str, help='numbers of replicas to scale over, comma-separated (scaling)'
+    )
+    parser.add_argument('--n_warmup', default=100, type=int, help='number of batches before measuring')
+    parser.add_argument('--n_batches', default=500, type=int, help='number of batches to measure')
+    config = parser.parse_args()
+    config.verbose = False
+
+    ctx = mp.get_context('spawn')
+    if config.target == 'pipeline':
+        for pipeline in ('element', 'batch'):
+            config.pipeline = pipeline
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_pipeline, (config,))
+
+            print(
+                "[*] pipeline : %-7s => %10.2f images/sec, rss : %8.2f MB"
+                % (result['pipeline'], result['images/sec'], result['rss (MB)'])
+            )
+    elif config.target == 'train_step':
+        for fused_step, fresh_critic_batches in ((False, False), (True, False), (True, True)):
+            config.fused_step, config.fresh_critic_batches = fused_step, fresh_critic_batches
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_train_step, (config,))
+
+            print(
+                "[*] fused step : %-5s fresh critic batches : %-5s => %8.3f ms/iter (%d critics)"
+                % (result['fused_step'], result['fresh_critic_batches'], result['ms/iter'], config.n_critics)
+            )
+    elif config.target == 'precision':
+        baseline = None
+        for precision in ('fp32', 'bf16', 'mixed_bf16'):
+            config.precision = precision
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_precision, (config,))
+
+            if baseline is None:
+                baseline = result
+
+            # the gap between the loss curves (per step) & the final losses (averaged over the last 10% steps)
+            n_tail = max(len(result['d_loss']) // 10, 1)
+            d_gap = max(abs(a - b) for a, b in zip(result['d_loss'], baseline['d_loss']))
+            g_gap = max(abs(a - b) for a, b in zip(result['g_loss'], baseline['g_loss']))
+            print(
+                "[*] precision : %-10s => %8.2f steps/sec (x%.2f), "
+                "final D/G loss : %.5f/%.5f, max gap to fp32 D/G : %.5f/%.5f"
+                % (
+                    result['precision'],
+                    result['steps/sec'],
+                    result['steps/sec'] / baseline['steps/sec'],
+                    sum(result['d_loss'][-n_tail:]) / n_tail,
+                    sum(result['g_loss'][-n_tail:]) / n_tail,
+                    d_gap,
+                    g_gap,
+                )
+            )
+    elif config.target == 'xla':
+        for jit_compile in (False, True):
+            config.jit_compile = jit_compile
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_xla, (config,))
+
+            print(
+                "[*] jit compile : %-5s => first call D/G/samples : %.3fs/%.3fs/%.3fs, "
+                "steady state : %8.3f ms/iter (%d critics), re-traces : %d"
+                % (
+                    result['jit_compile'],
+                    result['first_call']['train_discriminator'],
+                    result['first_call']['train_generator'],
+                    result['first_call']['generate_samples'],
+                    result['ms/iter'],
+                    config.n_critics,
+                    result['re-traces'],
+                )
+            )
+    elif config.target == 'scaling':
+        if config.strategy == 'none':
+            config.strategy = 'multi_worker'
+        per_replica_bs: int = config.bs
+        n_cpus: int = os.cpu_count() or 1
+
+        baseline = None
+        for n_workers in map(int, config.n_workers.split(',')):
+            config.bs = per_replica_bs * n_workers  # the global batch, weak scaling
+
+            result_queue = ctx.Queue()
+            if config.strategy == 'multi_worker':
+                config.n_cpu_devices, config.n_intra_threads = 1, max(n_cpus // n_workers, 1)
+
+                workers = [f'localhost:{port}' for port in get_free_ports(n_workers)]
+                processes = [
+                    ctx.Process(
+                        target=run_scaling,
+                        args=(
+                            config,
+                            json.dumps({'cluster': {'worker': workers}, 'task': {'type': 'worker', 'index': i}}),
+                            result_queue,
+                        ),
+                    )
+                    for i in range(n_workers)
+                ]
+            else:
+                config.n_cpu_devices, config.n_intra_threads = n_workers, 0
+                processes = [ctx.Process(target=run_scaling, args=(config, '', result_queue))]
+
+            for process in processes:
+                process.start()
+            result = get_result(result_queue, processes)
+            for process in processes:
+                process.join()
+
+            if baseline is None:
+                baseline = result
+
+            # per-replica throughput over the first run's, which doesn't have to be 1 replica
+            efficiency: float = (result['images/sec'] / result['n_replicas']) / (
+                baseline['images/sec'] / baseline['n_replicas']
+            )
+            print(
+                "[*] strategy : %-12s replicas : %2d => %10.2f images/sec, %8.3f ms/iter, scaling efficiency : %.2f"
+                % (config.strategy, result['n_replicas'], result['images/sec'], result['ms/iter'], efficiency)
+            )
+    elif config.target == 'urbansound':
+        result_queue = ctx.Queue()
+        process = ctx.Process(target=run_urbansound, args=(config, result_queue))
+        process.start()
+        result = get_result(result_queue, [process])
+        process.join()
+
+        print(
+            "[*] urbansound : %d threads => %10.2f frames/sec, rss : %8.2f MB"
+            % (config.n_threads, result['frames/sec'], result['rss (MB)'])
+        )
+    elif config.target == 'critic_step':
+        for clip_mode in ('loop', 'constraint'):
+            config.clip_mode = clip_mode
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_critic_step, (config,))
+
+            print(
+                "[*] clip mode : %-10s => %10.2f critic steps/sec, max |w| : %.4f"
+                % (result['clip_mode'], result['steps/sec'], result['max |w|'])
+            )
+    else:
+        raise ValueError(f'[-] unknown benchmark target {config.target} :(')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,15 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+
+
+def str2bool(value) -> bool:
+    """argparse type of the boolean flags, bool('False') is True."""
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ('true', 't', 'yes', 'y', '1'):
+        return True
+    if value.lower() in ('false', 'f', 'no', 'n', '0'):
+        return False
+    raise ArgumentTypeError(f'[-] boolean value expected, got {value} :(')
 
 
 def parse_args():
@@ -25,6 +36,23 @@ def parse_args():
     parser.add_argument('--div2k_path', type=str, default='DIV2K')
     parser.add_argument('--pix2pix_path', type=str, default='pix2pix')
     parser.add_argument('--use_crop', type=bool, default=False, help='use image center crop')
+    parser.add_argument(
+        '--cache_dir', type=str, default='', help='directory of the file-backed dataset cache, in-memory if empty'
+    )
+    parser.add_argument(
+        '--shuffle_buffer', type=int, default=0, help='size of the shuffle buffer, batch size * 16 if 0'
+    )
+    parser.add_argument(
+        '--num_parallel_calls', type=int, default=-1, help='number of parallel calls to preprocess, AUTOTUNE if -1'
+    )
+    parser.add_argument('--deterministic', type=str2bool, default=True, help='keep the order of the preprocessed data')
+    parser.add_argument(
+        '--pipeline',
+        type=str,
+        default='element',
+        choices=['element', 'batch'],
+        help='element: float32 per image, batch: uint8 cache & shuffle, normalized per batch in the train step',
+    )
     parser.add_argument('--model_path', type=str, default='model')
     parser.add_argument('--output_path', type=str, default='outputs')
 
@@ -37,5 +65,18 @@ def parse_args():
     parser.add_argument('--log_interval', default=1000, type=int, help='intervals to log')
     parser.add_argument('--save_interval', default=1000, type=int, help='intervals to save the model(s)')
     parser.add_argument('--verbose', type=bool, default=True)
+    parser.add_argument(
+        '--jit_compile', type=str2bool, default=False, help='XLA-compile the train steps of the TF2 trainers'
+    )
+    parser.add_argument(
+        '--strategy',
+        default='none',
+        type=str,
+        choices=['none', 'mirrored', 'multi_worker'],
+        help='data-parallel training of the TF2 trainers, multi_worker reads the cluster from TF_CONFIG',
+    )
+    parser.add_argument(
+        '--n_cpu_devices', default=1, type=int, help='split the CPU into n logical devices (replicas w/o GPU)'
+    )
 
     return parser
@@ -6,6 +6,7 @@ import tensorflow as tf
 import awesome_gans.cyclegan.cyclegan_model as cyclegan
 import awesome_gans.image_utils as iu
 from awesome_gans.datasets import Pix2PixDataSet as DataSet
+from awesome_gans.datasets import UnpairedDataIterator
 
 results = {'output': './gen_img/', 'model': './model/CycleGAN-model.ckpt'}
 
@@ -56,6 +57,16 @@ def main():
         # Initializing
         s.run(tf.global_variables_initializer())
 
+        # A & B are shuffled independently & prefetched, an epoch covers the larger domain
+        ds_iter = UnpairedDataIterator(
+            img_a,
+            img_b,
+            train_step['batch_size'],
+            x_shape=model.image_shape,
+            scale=ds.batch_img_scale,
+            dtype=ds.batch_img_dtype,
+        )
+
         global_step = 0
         for epoch in range(train_step['epochs']):
             # learning rate decay
@@ -63,30 +74,7 @@ def main():
             if epoch >= 100 and epoch % 10 == 0:
                 lr_decay = (train_step['epochs'] - epoch) / (train_step['epochs'] / 2.0)
 
-            # re-implement DataIterator for multi-input
-            pointer = 0
-            num_images = min(ds.n_images_a, ds.n_images_b)
-            for i in range(num_images // train_step['batch_size']):
-                start = pointer
-                pointer += train_step['batch_size']
-
-                if pointer > num_images:  # if ended 1 epoch
-                    # Shuffle training DataSet
-                    perm_a, perm_b = np.arange(ds.n_images_a), np.arange(ds.n_images_b)
-
-                    np.random.shuffle(perm_a)
-                    np.random.shuffle(perm_b)
-
-                    img_a, img_b = img_a[perm_a], img_a[perm_b]
-
-                    start = 0
-                    pointer = train_step['batch_size']
-
-                end = pointer
-
-                batch_a = np.reshape(img_a[start:end], model.image_shape)
-                batch_b = np.reshape(img_a[start:end], model.image_shape)
-
+            for batch_a, batch_b in ds_iter.iterate():
                 for _ in range(model.n_train_critic):
                     s.run(
                         model.d_op,
@@ -162,6 +150,9 @@ def main():
 
                 global_step += 1
 
+        print(ds_iter.stats())
+        ds_iter.close()
+
     end_time = time.time() - start_time  # Clocking end
 
     # Elapsed time
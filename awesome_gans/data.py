@@ -1,3 +1,6 @@
+import os
+from typing import Optional
+
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
@@ -24,6 +27,13 @@ class TFDatasets:
         self.width: int = config.width
         self.height: int = config.height
         self.use_crop: bool = config.use_crop
+        self.cache_dir: str = config.cache_dir
+        self.shuffle_buffer: int = config.shuffle_buffer if config.shuffle_buffer > 0 else self.bs * 16
+        self.num_parallel_calls: int = (
+            config.num_parallel_calls if config.num_parallel_calls > 0 else tf.data.experimental.AUTOTUNE
+        )
+        self.deterministic: bool = config.deterministic
+        self.pipeline: str = config.pipeline
 
     def preprocess_image(self, image: tf.Tensor) -> tf.Tensor:
         if self.use_crop:
@@ -32,11 +42,115 @@ class TFDatasets:
         image = (tf.cast(image, tf.float32) / 127.5) - 1.0
         return image
 
-    def load_dataset(self, use_label: bool = False):
-        ds = tfds.load(name=self.dataset, split='train', as_supervised=use_label, shuffle_files=True)
-        ds = ds.map(lambda x: self.preprocess_image(x['image']), tf.data.experimental.AUTOTUNE)
-        ds = ds.cache()
-        ds = ds.shuffle(self.bs * 16)
-        ds = ds.batch(self.bs, drop_remainder=True)
+    def preprocess_image_uint8(self, image: tf.Tensor) -> tf.Tensor:
+        """crop & resize only, the image stays uint8 at the target resolution (4x smaller than float32)."""
+        if self.use_crop:
+            image = tf.image.central_crop(image, 0.5)
+        image = tf.image.resize(image, (self.width, self.height), antialias=True)
+        image = tf.saturate_cast(tf.round(image), tf.uint8)
+        return image
+
+    @staticmethod
+    def normalize_batch(images: tf.Tensor) -> tf.Tensor:
+        """[0, 255] uint8 batch to [-1, 1] float32, in one vectorized op."""
+        return (tf.cast(images, tf.float32) / 127.5) - 1.0
+
+    def get_cache_filename(self, num_shards: int = 1, shard_index: int = 0) -> str:
+        """file-backed cache, keyed on the options which change the preprocessed images.
+        it's shared by the processes & runs instead of re-decoding the whole split into RAM.
+        """
+        if not self.cache_dir:
+            return ''
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        filename: str = f'{self.dataset}-{self.width}x{self.height}-crop{int(self.use_crop)}-{self.pipeline}'
+        if num_shards > 1:
+            filename += f'-shard{shard_index}of{num_shards}'
+        return os.path.join(self.cache_dir, filename)
+
+    def get_num_examples(self) -> int:
+        builder = tfds.builder(self.dataset)
+        builder.download_and_prepare()
+        return builder.info.splits['train'].num_examples
+
+    def get_steps_per_epoch(self) -> int:
+        """global steps (of bs images) per epoch, the same on every worker."""
+        return self.get_num_examples() // self.bs
+
+    def get_split(self, num_shards: int = 1, shard_index: int = 0) -> str:
+        """the records of the shard, as an absolute sub-split.
+        tfds reads only them (the rest is never decoded), & the shard sizes differ by 1 at most.
+        """
+        if num_shards == 1:
+            return 'train'
+
+        num_examples: int = self.get_num_examples()
+        start, stop = num_examples * shard_index // num_shards, num_examples * (shard_index + 1) // num_shards
+        return f'train[{start}:{stop}]'
+
+    def load_dataset(
+        self,
+        use_label: bool = False,
+        batch_size: Optional[int] = None,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        repeat: bool = False,
+    ):
+        """
+        pipeline
+            - element : float32 images in [-1, 1]
+            - batch   : uint8 images in [0, 255], normalize them with normalize_batch (in the train step)
+        :param batch_size: batch size, bs if None.
+        :param num_shards: number of the input pipelines (workers), each reads a disjoint 1/num_shards of the split.
+        :param shard_index: index of this input pipeline.
+        :param repeat: repeat endlessly, the epochs are counted in steps (get_steps_per_epoch).
+        """
+        if self.pipeline == 'element':
+            preprocess_image = self.preprocess_image
+        elif self.pipeline == 'batch':
+            preprocess_image = self.preprocess_image_uint8
+        else:
+            raise ValueError(f'[-] unknown pipeline {self.pipeline}')
+
+        ds = tfds.load(
+            name=self.dataset,
+            split=self.get_split(num_shards, shard_index),
+            as_supervised=use_label,
+            shuffle_files=True,
+        )
+        ds = ds.map(
+            lambda x: preprocess_image(x['image']),
+            num_parallel_calls=self.num_parallel_calls,
+            deterministic=self.deterministic,
+        )
+        ds = ds.cache(self.get_cache_filename(num_shards, shard_index))
+        ds = ds.shuffle(self.shuffle_buffer)
+        if repeat:
+            ds = ds.repeat()
+        ds = ds.batch(batch_size or self.bs, drop_remainder=True)
         ds = ds.prefetch(tf.data.experimental.AUTOTUNE)
         return ds
+
+    def load_distributed_dataset(self, strategy: tf.distribute.Strategy, use_label: bool = False):
+        """load_dataset split for the replicas of the strategy.
+        every worker reads its own shard, batched by bs / num_replicas, so a step still takes bs images in total.
+        the shards are repeated, so every worker runs the same get_steps_per_epoch steps per epoch
+        (uneven shards would run out at different steps, & hang the others on the collectives).
+        """
+        n_replicas: int = strategy.num_replicas_in_sync
+        if self.bs % n_replicas != 0:
+            raise ValueError(f'[-] batch size {self.bs} is not divisible by {n_replicas} replicas :(')
+
+        def dataset_fn(input_context: tf.distribute.InputContext) -> tf.data.Dataset:
+            return self.load_dataset(
+                use_label,
+                batch_size=input_context.get_per_replica_batch_size(self.bs),
+                num_shards=input_context.num_input_pipelines,
+                shard_index=input_context.input_pipeline_id,
+                repeat=True,
+            )
+
+        try:
+            return strategy.distribute_datasets_from_function(dataset_fn)
+        except AttributeError:  # tf < 2.4
+            return strategy.experimental_distribute_datasets_from_function(dataset_fn)
@@ -1,13 +1,23 @@
+import hashlib
+import json
+import mmap
 import os
+import queue
+import struct
 import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from glob import glob
-from multiprocessing import Pool
+from multiprocessing import Pool, get_context
 
 import cv2
 import h5py
 import numpy as np
 import tensorflow as tf
-from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 
 seed = 1337
@@ -21,23 +31,684 @@ def one_hot(labels_dense, num_classes: int = 10):
     return labels_one_hot
 
 
+def imread_rgb(path):
+    """reads an image as RGB uint8, IOError if it's unreadable (cv2.imread returns None)"""
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise IOError("[-] Can't read the image %s :(" % path)
+    return img[..., ::-1]  # BGR to RGB
+
+
+def user_cache_path(name, ds_path):
+    """a per-DataSet path in the user cache dir ($XDG_CACHE_HOME or ~/.cache), for read-only DataSet folders
+    :param name: prefix of the cache entry, like cifar-10
+    :param ds_path: DataSet's path, its absolute path is hashed into the entry's name
+    :return: <cache dir>/awesome_gans/<name>-<hash of ds_path>
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    key = hashlib.md5(os.path.abspath(ds_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'awesome_gans', '%s-%s' % (name, key))
+
+
+def load_celeba_attr(path):
+    """Parse CelebA's attribute list (list_attr_celeba.txt) into an int8 (N, n_attrs) matrix of -1/1.
+    The matrix is cached next to the source file as one .npz, along with the file's mtime & size it was parsed from.
+    :param path: path of list_attr_celeba.txt
+    :return: (the number of images, attribute names, int8 matrix)
+    """
+    stat = os.stat(path)
+    cache_path = path + '.npz'
+
+    with open(path, 'r') as f:
+        num_images = int(f.readline().strip())
+        attr_names = f.readline().split()
+
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cache:
+                if int(cache['mtime_ns']) == stat.st_mtime_ns and int(cache['size']) == stat.st_size:
+                    return num_images, attr_names, cache['table']
+
+        # drop the image names, then parse the whole table in one pass
+        table = ' '.join(row.split(None, 1)[1] for row in f if row.strip())
+
+    table = np.fromstring(table, dtype=np.int8, sep=' ').reshape(-1, len(attr_names))
+
+    # written aside & renamed, so a killed run never leaves a partial cache, the former one is overwritten
+    tmp_path = "%s.%d.tmp.npz" % (path, os.getpid())
+    try:
+        np.savez(tmp_path, table=table, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        print("[-] Can't cache the attributes at %s" % cache_path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return num_images, attr_names, table
+
+
+def split_indices(n_samples, split_rate=0.2, random_state=42):
+    """Shuffled (train, valid) index arrays, the same partition as sklearn's train_test_split."""
+    n_valid = int(np.ceil(split_rate * n_samples))
+    order = np.random.RandomState(random_state).permutation(n_samples)
+    return order[n_valid:], order[:n_valid]
+
+
+def train_valid_split(images, labels, split_rate=0.2, random_state=42, split_type='copy'):
+    """
+    :param split_type: 'copy' (sklearn train_test_split, copies of images) or
+        'index' (images are IndexedView over the original buffer, only the labels are copied)
+    :return: train_images, valid_images, train_labels, valid_labels
+    """
+    if split_type == 'copy':
+        from sklearn.model_selection import train_test_split
+
+        return train_test_split(images, labels, test_size=split_rate, random_state=random_state)
+    elif split_type == 'index':
+        train_indices, valid_indices = split_indices(len(images), split_rate, random_state)
+        return (
+            IndexedView(images, train_indices),
+            IndexedView(images, valid_indices),
+            np.asarray(labels)[train_indices],
+            np.asarray(labels)[valid_indices],
+        )
+    else:
+        raise ValueError("[-] Only 'copy' or 'index' split please - (%s)" % split_type)
+
+
+class MemmapShardStore:
+    """
+    On-disk uint8 DataSet, stored as fixed-shape shards & a small json index.
+        - each shard is opened with np.memmap, so batches are sliced from the page cache
+          & several training processes share the same copy of the data.
+        - opening the store is O(1), regardless of the size of the DataSet.
+
+    Expected layout
+    <path>/index.json, <path>/shard-00000.u8, <path>/shard-00001.u8, ...
+    """
+
+    index_name = 'index.json'
+
+    @staticmethod
+    def is_store(path):
+        return os.path.isdir(path) and os.path.isfile(os.path.join(path, MemmapShardStore.index_name))
+
+    @classmethod
+    def write(cls, path, data, shard_size=4096):
+        """
+        :param path: directory to save the store
+        :param data: (N, ...) array-like, the first axis is the sample axis
+            - non-uint8 data (like float images in [0, 255]) is rounded & clipped into [0, 255]
+        :param shard_size: the number of samples per shard
+        :return: the opened MemmapShardStore
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        # overwriting, the former index goes first, then its shards
+        index_path = os.path.join(path, cls.index_name)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        for stale in glob(os.path.join(path, 'shard-*.u8')):
+            os.remove(stale)
+
+        shards = []
+        for i, start in enumerate(range(0, len(data), shard_size)):
+            shard = np.asarray(data[start : start + shard_size])
+            if shard.dtype != np.uint8:  # no truncation & wrap-around of the cast
+                if np.issubdtype(shard.dtype, np.floating):
+                    shard = np.rint(shard)
+                shard = np.clip(shard, 0, 255)
+            shard = np.ascontiguousarray(shard, dtype=np.uint8)
+            shard_name = 'shard-%05d.u8' % i
+            shard.tofile(os.path.join(path, shard_name))
+            shards.append({'file': shard_name, 'n': len(shard)})
+
+        # the index is written at last, so a half-written store can't be opened
+        index = {'shape': list(data.shape[1:]), 'dtype': 'uint8', 'shard_size': shard_size, 'shards': shards}
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+
+        return cls(path)
+
+    def __init__(self, path, sample_shape=None):
+        """
+        :param path: directory of the store
+        :param sample_shape: shape to view each sample as, like (H, W, C) of flattened images, default as written
+        """
+        self.path = path
+
+        try:
+            assert self.is_store(self.path)
+        except AssertionError:
+            raise AssertionError("[-] There's no memmap store at %s :(" % self.path)
+
+        with open(os.path.join(self.path, self.index_name), 'r') as f:
+            index = json.load(f)
+
+        self.sample_shape = tuple(index['shape'])
+        if sample_shape is not None:  # zero-copy, the shards are raw bytes
+            try:
+                assert int(np.prod(sample_shape)) == int(np.prod(self.sample_shape))
+            except AssertionError:
+                raise AssertionError("[-] Can't view %s samples as %s :(" % (self.sample_shape, tuple(sample_shape)))
+            self.sample_shape = tuple(sample_shape)
+        self.dtype = np.dtype(index['dtype'])
+        self.shard_size = index['shard_size']
+        self.shards = [
+            np.memmap(
+                os.path.join(self.path, shard['file']),
+                dtype=self.dtype,
+                mode='r',
+                shape=(shard['n'],) + self.sample_shape,
+            )
+            for shard in index['shards']
+        ]
+
+        self.num_examples = sum(len(shard) for shard in self.shards)
+        self.shape = (self.num_examples,) + self.sample_shape
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.num_examples
+
+    def __array__(self, dtype=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            data = self[key[0]]
+            if isinstance(key[0], (int, np.integer)):
+                return data[key[1:]]
+            return data[(slice(None),) + key[1:]]
+
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self.num_examples
+            if not 0 <= key < self.num_examples:
+                raise IndexError("[-] index %d is out of range (%d) :(" % (key, self.num_examples))
+            return self.shards[key // self.shard_size][key % self.shard_size]
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.num_examples)
+            if step == 1 and start < stop and (start // self.shard_size) == ((stop - 1) // self.shard_size):
+                offset = (start // self.shard_size) * self.shard_size
+                return self.shards[start // self.shard_size][start - offset : stop - offset]  # zero-copy
+            return self.take(np.arange(start, stop, step))
+
+        return self.take(key)
+
+    def take(self, indices, out=None):
+        """Gather the samples at `indices` into `out` (allocated if None)."""
+        indices = np.asarray(indices)
+        if indices.dtype == np.bool_:
+            indices = np.flatnonzero(indices)
+        indices = np.where(indices < 0, indices + self.num_examples, indices)
+
+        if out is None:
+            out = np.empty((len(indices),) + self.sample_shape, dtype=self.dtype)
+
+        shard_ids = indices // self.shard_size
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            out[mask] = self.shards[shard_id][indices[mask] % self.shard_size]
+        return out
+
+
+class PackedImageStore:
+    """
+    On-disk uint8 DataSet of images with different shapes, packed back to back into one file.
+        - the file is opened with np.memmap, an image is a zero-copy view of it.
+        - used for full-resolution images which can't be stacked, like DIV2K.
+
+    Expected layout
+    <path>/index.json, <path>/images.u8
+    """
+
+    index_name = 'index.json'
+    data_name = 'images.u8'
+
+    @staticmethod
+    def is_store(path):
+        return os.path.isdir(path) and os.path.isfile(os.path.join(path, PackedImageStore.index_name))
+
+    @classmethod
+    def write_index(cls, path, shapes):
+        # the index is written at last, so a half-written store can't be opened
+        with open(os.path.join(path, cls.index_name), 'w') as f:
+            json.dump({'dtype': 'uint8', 'shapes': [[int(d) for d in shape] for shape in shapes]}, f)
+
+    @classmethod
+    def write(cls, path, images):
+        """
+        :param path: directory to save the store
+        :param images: iterable of uint8 (H, W, C) images, written one by one
+        :return: the opened PackedImageStore
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        shapes = []
+        with open(os.path.join(path, cls.data_name), 'wb') as f:
+            for img in images:
+                np.ascontiguousarray(img, dtype=np.uint8).tofile(f)
+                shapes.append(img.shape)
+
+        cls.write_index(path, shapes)
+        return cls(path)
+
+    @classmethod
+    def create(cls, path, shapes):
+        """allocates an empty (sparse) store of the given shapes, to be filled in place with mode='r+'"""
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        with open(os.path.join(path, cls.data_name), 'wb') as f:
+            f.truncate(int(sum(np.prod(shape) for shape in shapes)))
+
+        cls.write_index(path, shapes)
+        return cls(path, mode='r+')
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+
+        try:
+            assert self.is_store(self.path)
+        except AssertionError:
+            raise AssertionError("[-] There's no packed image store at %s :(" % self.path)
+
+        with open(os.path.join(self.path, self.index_name), 'r') as f:
+            index = json.load(f)
+
+        self.dtype = np.dtype(index['dtype'])
+        self.shapes = np.array(index['shapes'], dtype=np.int64).reshape(-1, 3)
+        self.offsets = np.concatenate([[0], np.cumsum(np.prod(self.shapes, axis=1))])
+        self.data = np.memmap(os.path.join(self.path, self.data_name), dtype=self.dtype, mode=mode)
+        self.num_examples = len(self.shapes)
+
+    def __len__(self):
+        return self.num_examples
+
+    def __getitem__(self, idx):
+        return self.data[self.offsets[idx] : self.offsets[idx + 1]].reshape(self.shapes[idx])
+
+
+class TFRecordNumpyReader:
+    """
+    numpy-side reader of (uncompressed) .tfrecords written by DataSetLoader.convert_to_tfr, without a tf.data graph.
+        - walks the record framing (length, crc, payload, crc) over the memory-mapped file(s) itself.
+        - payloads are np.frombuffer views, batches are gathered with a single np.take over them.
+        - CRCs are skipped, only the framing bounds are checked.
+
+    Usage
+    reader = TFRecordNumpyReader(glob('celeba-*.tfrecords'))
+    image = reader[0]  # (H, W, C) uint8 view
+    batch = reader.batch(np.arange(64))  # (64, H, W, C) uint8
+    """
+
+    @staticmethod
+    def read_varint(buf, pos):
+        result, shift = 0, 0
+        while True:
+            b = buf[pos]
+            pos += 1
+            result |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return result, pos
+            shift += 7
+
+    @staticmethod
+    def iter_fields(buf, start, end):
+        """yields (field number, wire type, value or start of the value, end of the value) of a protobuf message"""
+        pos = start
+        while pos < end:
+            key, pos = TFRecordNumpyReader.read_varint(buf, pos)
+            field, wire_type = key >> 3, key & 0x07
+            if wire_type == 0:  # varint
+                value, pos = TFRecordNumpyReader.read_varint(buf, pos)
+                yield field, wire_type, value, pos
+            elif wire_type == 2:  # length-delimited
+                length, pos = TFRecordNumpyReader.read_varint(buf, pos)
+                yield field, wire_type, pos, pos + length
+                pos += length
+            elif wire_type == 1:  # 64-bit
+                pos += 8
+            elif wire_type == 5:  # 32-bit
+                pos += 4
+            else:
+                raise ValueError("[-] Unsupported protobuf wire type (%d) :(" % wire_type)
+
+    @staticmethod
+    def parse_example(buf, start, end):
+        """
+        parses tf.train.Example {'shape': int64_list, 'data': bytes_list} in buf[start:end]
+        :return: (shape, start of the data, end of the data)
+        """
+        shape, data_start, data_end = None, None, None
+
+        for _, _, features_start, features_end in TFRecordNumpyReader.iter_fields(buf, start, end):  # Example
+            for _, _, entry_start, entry_end in TFRecordNumpyReader.iter_fields(buf, features_start, features_end):
+                key, value_start, value_end = None, None, None
+                for field, _, s, e in TFRecordNumpyReader.iter_fields(buf, entry_start, entry_end):  # map entry
+                    if field == 1:
+                        key = bytes(buf[s:e])
+                    elif field == 2:
+                        value_start, value_end = s, e
+
+                for kind, _, list_start, list_end in TFRecordNumpyReader.iter_fields(buf, value_start, value_end):
+                    if key == b'data' and kind == 1:  # bytes_list, the first value
+                        for _, _, s, e in TFRecordNumpyReader.iter_fields(buf, list_start, list_end):
+                            data_start, data_end = s, e
+                            break
+                    elif key == b'shape' and kind == 3:  # int64_list, packed or not
+                        shape = []
+                        for _, wire_type, s, e in TFRecordNumpyReader.iter_fields(buf, list_start, list_end):
+                            if wire_type == 0:
+                                shape.append(s)
+                                continue
+                            pos = s
+                            while pos < e:
+                                value, pos = TFRecordNumpyReader.read_varint(buf, pos)
+                                shape.append(value)
+
+        if shape is None or data_start is None:
+            raise ValueError("[-] There's no 'shape' or 'data' feature in the record :(")
+
+        return tuple(shape), data_start, data_end
+
+    def __init__(self, file_names):
+        self.file_names = sorted(file_names)
+
+        self.buffers = []
+        file_ids, offsets, lengths, shapes = [], [], [], []
+        for file_id, file_name in enumerate(self.file_names):
+            with open(file_name, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffers.append(buf)
+
+            # record : uint64 length, uint32 masked crc of length, payload, uint32 masked crc of payload
+            pos, size = 0, len(buf)
+            while pos < size:
+                length = int.from_bytes(buf[pos : pos + 8], 'little')
+                start, end = pos + 12, pos + 12 + length
+                if end + 4 > size:
+                    raise ValueError("[-] Broken (or compressed) record in %s at %d :(" % (file_name, pos))
+
+                shape, data_start, data_end = self.parse_example(buf, start, end)
+
+                file_ids.append(file_id)
+                offsets.append(data_start)
+                lengths.append(data_end - data_start)
+                shapes.append(shape)
+
+                pos = end + 4
+
+        self.file_ids = np.asarray(file_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.shapes = shapes
+        self.arrays = [np.frombuffer(buf, dtype=np.uint8) for buf in self.buffers]
+        self.windows = {}  # (file id, payload length) -> strided view, row i is array[i : i + length]
+
+        self.num_examples = len(self.offsets)
+
+    def __len__(self):
+        return self.num_examples
+
+    def __getitem__(self, idx):
+        array = self.arrays[self.file_ids[idx]]
+        return array[self.offsets[idx] : self.offsets[idx] + self.lengths[idx]].reshape(self.shapes[idx])
+
+    def batch(self, indices, out=None):
+        """gathers the records at `indices` into a (N, H, W, C) uint8 array, they must have the same shape."""
+        indices = np.asarray(indices)
+        shape = self.shapes[indices[0]]
+        length = self.lengths[indices[0]]
+
+        try:
+            assert np.all(self.lengths[indices] == length)
+        except AssertionError:
+            raise AssertionError("[-] Only the records with the same shape can be batched :(")
+
+        if out is None:
+            out = np.empty((len(indices), length), dtype=np.uint8)
+        out = out.reshape((len(indices), length))
+
+        file_ids = self.file_ids[indices]
+        for file_id in np.unique(file_ids):
+            mask = file_ids == file_id
+            out[mask] = np.take(self.get_window(file_id, length), self.offsets[indices[mask]], axis=0)
+        return out.reshape((len(indices),) + shape)
+
+    def get_window(self, file_id, length):
+        key = (file_id, length)
+        if key not in self.windows:
+            array = self.arrays[file_id]
+            self.windows[key] = np.lib.stride_tricks.as_strided(
+                array, shape=(len(array) - length + 1, length), strides=(1, 1), writeable=False
+            )
+        return self.windows[key]
+
+    def iterate(self, batch_size, drop_remainder=True):
+        n = self.num_examples - self.num_examples % batch_size if drop_remainder else self.num_examples
+        for start in range(0, n, batch_size):
+            yield self.batch(np.arange(start, min(start + batch_size, n)))
+
+
+class IndexedView:
+    """
+    Lazy view of `data` at `indices` (like a train/valid split), nothing is copied until it's indexed.
+        - works with DataIterator, np.asarray(view) materializes it.
+    """
+
+    def __init__(self, data, indices):
+        self.data = data
+        self.indices = np.asarray(indices)
+
+        self.num_examples = len(self.indices)
+        self.shape = (self.num_examples,) + tuple(self.data.shape[1:])
+        self.ndim = len(self.shape)
+        self.dtype = self.data.dtype
+
+    def __len__(self):
+        return self.num_examples
+
+    def __array__(self, dtype=None):
+        data = self.take(np.arange(self.num_examples))
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            data = self[key[0]]
+            if isinstance(key[0], (int, np.integer)):
+                return data[key[1:]]
+            return data[(slice(None),) + key[1:]]
+
+        if isinstance(key, (int, np.integer)):
+            return self.data[self.indices[key]]
+        return self.take(np.arange(self.num_examples)[key])
+
+    def take(self, indices, out=None):
+        indices = self.indices[np.asarray(indices)]
+        if isinstance(self.data, (MemmapShardStore, IndexedView)):
+            return self.data.take(indices, out=out)
+        return np.take(self.data, indices, axis=0, out=out)
+
+
+class DownsampledView:
+    """
+    Lazy box-downsampled (uint8) view of (N, H, W, C) `data`, computed per slice.
+        - used to write the levels of a PyramidDataSet shard by shard, each from the level above.
+    """
+
+    def __init__(self, data, scale=None, factor=2):
+        """
+        :param data: (N, H, W, C) array-like, H & W must be multiples of factor
+        :param scale: value range of data, None (uint8), '0,1' or '-1,1'
+        :param factor: downsampling factor, default 2 (1 only converts into uint8)
+        """
+        self.data = data
+        self.scale = scale
+        self.factor = factor
+
+        n, h, w, c = data.shape
+        self.shape = (n, h // factor, w // factor, c)
+        self.dtype = np.dtype(np.uint8)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        x = np.asarray(self.data[key], dtype=np.float32)
+        if self.scale == '0,1':
+            x *= 255.0
+        elif self.scale == '-1,1':
+            x = (x + 1.0) * 127.5
+
+        if self.factor > 1:
+            n, h, w, c = x.shape
+            f = self.factor
+            x = x.reshape(n, h // f, f, w // f, f, c).mean(axis=(2, 4))
+        return np.clip(np.round(x), 0, 255).astype(np.uint8)
+
+
+class PyramidDataSet:
+    """
+    Multi-resolution (level of detail) uint8 DataSet, for progressively growing models like PGGAN.
+        - every level is a MemmapShardStore, built once by 2x2 box-downsampling the level above.
+        - a fade-in batch is a vectorized lerp between a level & the (nearest-upsampled) level below,
+          gathered at the same indices, so no resizing happens in the training loop.
+
+    Expected layout
+    <path>/1024x1024/, <path>/512x512/, ..., <path>/4x4/
+    """
+
+    @staticmethod
+    def level_path(path, res):
+        return os.path.join(path, "%dx%d" % (res, res))
+
+    @classmethod
+    def write(cls, path, images, scale=None, min_res=4, shard_size=1024):
+        """
+        :param path: directory to save the levels
+        :param images: (N, H, W, C) array-like (like an h5 dataset or a MemmapShardStore), H == W, a power of 2
+        :param scale: value range of images, None (uint8), '0,1' or '-1,1'
+        :param min_res: the lowest resolution, default 4
+        :param shard_size: the number of images per shard, written (& downsampled) one at a time
+        :return: the opened PyramidDataSet
+        """
+        res = images.shape[1]
+
+        try:
+            assert res == images.shape[2] and res & (res - 1) == 0
+        except AssertionError:
+            raise AssertionError("[-] Only square images with a power-of-2 size please - %s :(" % (images.shape,))
+
+        # the top level : as it is, or re-scaled into uint8
+        level = images if scale is None else DownsampledView(images, scale, factor=1)
+        while res >= min_res:
+            start_time = time.time()
+            store = MemmapShardStore.write(cls.level_path(path, res), level, shard_size=shard_size)
+            print("[+] %dx%d level is written in %.2fs" % (res, res, time.time() - start_time))
+
+            level, res = DownsampledView(store), res // 2
+
+        return cls(path)
+
+    def __init__(self, path, batch_size=16, scale='-1,1', dtype=np.float32, random_state=42):
+        """
+        :param path: directory of the levels
+        :param batch_size: the number of images per batch, default 16
+        :param scale: '0,1' or '-1,1', default '-1,1'
+        :param dtype: dtype of the batch, float32 or float16
+        :param random_state: random seed for shuffling, default 42
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.scale = scale
+        self.dtype = dtype
+        self.rng = np.random.RandomState(random_state)
+
+        self.levels = {}
+        for name in os.listdir(self.path):
+            if MemmapShardStore.is_store(os.path.join(self.path, name)):
+                self.levels[int(name.split('x')[0])] = MemmapShardStore(os.path.join(self.path, name))
+
+        try:
+            assert self.levels
+        except AssertionError:
+            raise AssertionError("[-] There's no level at %s :(" % self.path)
+
+        self.resolutions = sorted(self.levels)
+        self.num_examples = len(self.levels[self.resolutions[0]])
+
+        self.order = self.rng.permutation(self.num_examples)
+        self.pointer = 0
+        self.buffers = {}
+
+        print("[*] the number of images : %d, levels : %s" % (self.num_examples, self.resolutions))
+
+    def next_indices(self):
+        start = self.pointer
+        self.pointer += self.batch_size
+
+        if self.pointer > self.num_examples:
+            self.rng.shuffle(self.order)
+
+            start = 0
+            self.pointer = self.batch_size
+
+        return np.sort(self.order[start : self.pointer])  # sorted, for the sequential reads
+
+    def gather(self, res, indices):
+        store = self.levels[res]
+        if res not in self.buffers:
+            self.buffers[res] = np.empty((self.batch_size,) + store.sample_shape, dtype=np.uint8)
+        return store.take(indices, out=self.buffers[res][: len(indices)])
+
+    def next_batch(self, res, alpha=None):
+        """
+        :param res: resolution of the batch, like model.output_size
+        :param alpha: fade-in weight of res over res // 2 in [0, 1], default None (no fade-in)
+        :return: (batch_size, res, res, C) batch
+        """
+        indices = self.next_indices()
+
+        x = DataSetLoader.img_scaling(self.gather(res, indices), '0,1', self.dtype)  # to [0, 1] at first
+        if alpha is not None and alpha < 1.0 and res // 2 in self.levels:
+            low = self.gather(res // 2, indices)
+            n, h, w, c = low.shape
+            low = np.broadcast_to(low[:, :, None, :, None, :], (n, h, 2, w, 2, c)).reshape(x.shape)
+
+            alpha = max(float(alpha), 0.0)
+            x *= alpha
+            x += (1.0 - alpha) / 255.0 * low  # lerp, in place
+
+        if self.scale == '-1,1':
+            x *= 2.0
+            x -= 1.0
+        return x
+
+
 class DataSetLoader:
     @staticmethod
     def get_extension(ext):
         if ext in ['jpg', 'png']:
             return 'img'
-        elif ext == 'tfr':
+        elif ext in ['tfr', 'tfrecords']:
             return 'tfr'
         elif ext == 'h5':
             return 'h5'
         elif ext == 'npy':
             return 'npy'
+        elif ext == 'mmap':
+            return 'mmap'
         else:
             raise ValueError("[-] There'is no supporting file... [%s] :(" % ext)
 
     @staticmethod
     def get_img(path, size=(64, 64), interp=cv2.INTER_CUBIC):
-        img = cv2.imread(path, cv2.IMREAD_COLOR)[..., ::-1]  # BGR to RGB
+        img = imread_rgb(path)
         if img.shape[0] == size[0]:
             return img
         else:
@@ -45,22 +716,62 @@ class DataSetLoader:
 
     @staticmethod
     def parse_tfr_tf(record):
-        features = tf.parse_single_example(
-            record, features={'shape': tf.FixedLenFeature([3], tf.int64), 'data': tf.FixedLenFeature([], tf.string)}
+        features = tf.io.parse_single_example(
+            record,
+            features={'shape': tf.io.FixedLenFeature([3], tf.int64), 'data': tf.io.FixedLenFeature([], tf.string)},
         )
-        data = tf.decode_raw(features['data'], tf.uint8)
+        data = tf.io.decode_raw(features['data'], tf.uint8)
         return tf.reshape(data, features['shape'])
 
+    @staticmethod
+    def serialize_tfr(data):
+        ex = tf.train.Example(
+            features=tf.train.Features(
+                feature={
+                    'shape': tf.train.Feature(int64_list=tf.train.Int64List(value=data.shape)),
+                    'data': tf.train.Feature(bytes_list=tf.train.BytesList(value=[data.tobytes()])),  # raw uint8
+                }
+            )
+        )
+        return ex.SerializeToString()
+
+    @staticmethod
+    def write_tfr_shard(args):
+        """writes the samples [start, stop) of the memmap store, which the worker opens & slices by itself"""
+        file_name, store_path, start, stop, sample_shape, compression_type = args
+        data = MemmapShardStore(store_path, sample_shape=sample_shape)
+
+        options = tf.io.TFRecordOptions(compression_type=compression_type)
+        with tf.io.TFRecordWriter(file_name, options) as writer:
+            for idx in range(start, stop):
+                writer.write(DataSetLoader.serialize_tfr(np.ascontiguousarray(data[idx])))
+        return file_name
+
+    @staticmethod
+    def read_tfr(file_names, compression_type='', buffer_size=4096, n_threads=8):
+        """
+        Reads (sharded) .tfrecords, interleaving the shards in parallel.
+        :return: tf.data.Dataset of (H, W, C) uint8 images
+        """
+        ds = tf.data.Dataset.from_tensor_slices(sorted(file_names))
+        ds = ds.interleave(
+            lambda fn: tf.data.TFRecordDataset(fn, compression_type=compression_type, buffer_size=buffer_size),
+            cycle_length=min(n_threads, len(file_names)),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+            deterministic=False,
+        )
+        return ds.map(DataSetLoader.parse_tfr_tf, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
     @staticmethod
     def parse_tfr_np(record):
-        ex = tf.train.Example()
-        ex.ParseFromString(record)
-        shape = ex.features.feature['shape'].int64_list.value
-        data = ex.features.feature['data'].bytes_list.value[0]
-        return np.fromstring(data, np.uint8).reshape(shape)
+        shape, start, end = TFRecordNumpyReader.parse_example(record, 0, len(record))
+        return np.frombuffer(record, np.uint8, count=end - start, offset=start).reshape(shape)
 
     @staticmethod
-    def img_scaling(img, scale='0,1'):
+    def img_scaling(img, scale='0,1', dtype=None):
+        if dtype is not None:  # scaling on a (copied) batch with the given dtype, like float32/float16
+            img = img.astype(dtype)
+
         if scale == '0,1':
             try:
                 img /= 255.0
@@ -76,6 +787,18 @@ class DataSetLoader:
 
         return img
 
+    @staticmethod
+    def img_scaling_tf(img, scale='0,1', dtype=tf.float32):
+        """img_scaling of a tf.data.Dataset element, in its map"""
+        img = tf.cast(img, dtype)
+
+        if scale == '0,1':
+            return img / 255.0
+        elif scale == '-1,1':
+            return img / 127.5 - 1.0
+        else:
+            raise ValueError("[-] Only '0,1' or '-1,1' please - (%s)" % scale)
+
     def __init__(
         self,
         path,
@@ -88,6 +811,11 @@ class DataSetLoader:
         use_image_scaling=True,
         image_scale='0,1',
         img_save_method=cv2.INTER_LINEAR,
+        shard_size=4096,
+        img_load_pool='thread',
+        image_dtype=np.float32,
+        tfr_shards=8,
+        tfr_compression='',
         debug=True,
     ):
 
@@ -121,8 +849,13 @@ class DataSetLoader:
 
         self.buffer_size = buffer_size
         self.n_threads = n_threads
+        self.shard_size = shard_size
 
-        if os.path.isfile(self.path):
+        if MemmapShardStore.is_store(self.path):
+            self.file_list = [self.path]
+            self.file_ext = 'mmap'
+            self.file_names = [self.path]
+        elif os.path.isfile(self.path):
             self.file_list = [self.path]
             self.file_ext = self.path.split('.')[-1]
             self.file_names = [self.path]
@@ -137,7 +870,7 @@ class DataSetLoader:
             print("[*] Detected File Extension  is [%s]" % self.file_ext)
             print("[*] Detected First File Name is [%s] (%d File(s))" % (self.file_names[0], len(self.file_names)))
 
-        self.types = ('img', 'tfr', 'h5', 'npy')  # Supporting Data Types
+        self.types = ('img', 'tfr', 'h5', 'npy', 'mmap')  # Supporting Data Types
         self.op_src = self.get_extension(self.file_ext)
         self.op_dst = self.op[1]
 
@@ -153,6 +886,9 @@ class DataSetLoader:
             raise AssertionError("[-] Invalid Operation Types (%s, %s) :(" % (self.op_src, self.op_dst))
 
         self.img_save_method = img_save_method
+        self.img_load_pool = img_load_pool  # 'thread' (cv2 releases the GIL) or 'process'
+        self.tfr_shards = tfr_shards
+        self.tfr_compression = tfr_compression  # '', 'GZIP' or 'ZLIB'
 
         if self.op_src == self.types[0]:
             self.load_img()
@@ -162,19 +898,26 @@ class DataSetLoader:
             self.load_h5()
         elif self.op_src == self.types[3]:
             self.load_npy()
+        elif self.op_src == self.types[4]:
+            self.load_mmap()
         else:
             raise NotImplementedError("[-] Not Supported Type :(")
 
-        # Random Shuffle
-        order = np.arange(self.raw_data.shape[0])
-        np.random.RandomState(seed).shuffle(order)
-        self.raw_data = self.raw_data[order]
+        # streaming sources (tfr, memmap store) are already shuffled & uint8 when they're written
+        self.is_streaming = self.op_src in (self.types[1], self.types[4])
 
-        # Clip [0, 255]
-        try:
-            self.raw_data = np.rint(self.raw_data).clip(0, 255).astype(np.uint8)
-        except MemoryError:
-            pass
+        if not self.is_streaming:
+            # Random Shuffle
+            order = np.arange(self.raw_data.shape[0])
+            np.random.RandomState(seed).shuffle(order)
+            self.raw_data = self.raw_data[order]
+
+            # Clip [0, 255]
+            if not self.raw_data.dtype == np.uint8:
+                try:
+                    self.raw_data = np.rint(self.raw_data).clip(0, 255).astype(np.uint8)
+                except MemoryError:
+                    pass
 
         self.use_save = use_save
         self.save_file_name = save_file_name
@@ -188,36 +931,85 @@ class DataSetLoader:
             if self.op_dst == self.types[0]:
                 self.convert_to_img()
             elif self.op_dst == self.types[1]:
-                self.tfr_opt = tf.python_io.TFRecordOptions(tf.python_io.TFRecordCompressionType.NONE)
-                self.tfr_writer = tf.python_io.TFRecordWriter(self.save_file_name + ".tfrecords", self.tfr_opt)
                 self.convert_to_tfr()
             elif self.op_dst == self.types[2]:
                 self.convert_to_h5()
             elif self.op_dst == self.types[3]:
                 self.convert_to_npy()
+            elif self.op_dst == self.types[4]:
+                self.convert_to_mmap()
             else:
                 raise NotImplementedError("[-] Not Supported Type :(")
 
+        # use_image_scaling : True (whole DataSet, float), False or 'lazy' (stays uint8, scaled per batch)
         self.use_image_scaling = use_image_scaling
         self.img_scale = image_scale
+        self.image_dtype = image_dtype
 
-        if self.use_image_scaling:
-            self.raw_data = self.img_scaling(self.raw_data, self.img_scale)
+        # tfr is a tf.data.Dataset, which DataIterator can't consume, so it's scaled in its map
+        is_tf_dataset = self.op_src == self.types[1]
+        # scaling the whole streaming source would load it all into RAM as float, so it's always lazy
+        self.use_lazy_scaling = not is_tf_dataset and (
+            self.use_image_scaling == 'lazy' or (self.use_image_scaling and self.is_streaming)
+        )
+        # scale & dtype to pass to DataIterator, the scale is None if there's nothing to scale per batch
+        self.batch_img_scale = self.img_scale if self.use_lazy_scaling else None
+        self.batch_img_dtype = self.image_dtype
+
+        if self.use_image_scaling and is_tf_dataset:
+            self.raw_data = self.raw_data.map(
+                partial(self.img_scaling_tf, scale=self.img_scale, dtype=tf.as_dtype(self.image_dtype)),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE,
+            )
+        elif self.use_image_scaling and not self.use_lazy_scaling:
+            self.raw_data = self.img_scaling(self.raw_data, self.img_scale, self.image_dtype)
 
     def load_img(self):
         self.raw_data = np.zeros((len(self.file_list), self.height * self.width * self.channel), dtype=np.uint8)
 
-        for i, fn in tqdm(enumerate(self.file_names)):
+        start_time = time.time()
+        if self.n_threads <= 1:
+            for i, fn in tqdm(enumerate(self.file_names)):
+                self.raw_data[i] = self.get_img(fn, (self.height, self.width), self.img_save_method).flatten()
+        elif self.img_load_pool == 'thread':
+            self.load_img_threads()
+        elif self.img_load_pool == 'process':
+            self.load_img_processes()
+        else:
+            raise ValueError("[-] Only 'thread' or 'process' pool please - (%s)" % self.img_load_pool)
+        elapsed_time = time.time() - start_time
+
+        print(
+            "[+] Loaded %d images in %.2fs (%.2f images/sec)"
+            % (len(self.file_names), elapsed_time, len(self.file_names) / max(elapsed_time, 1e-8))
+        )
+
+        if self.debug:  # just once
+            print("[*] Image Shape   : ", self.raw_data[0].shape)
+            print("[*] Image Size    : ", self.raw_data[0].size)
+            print("[*] Image MIN/MAX :  (%d, %d)" % (np.min(self.raw_data[0]), np.max(self.raw_data[0])))
+            self.debug = False
+
+    def load_img_threads(self):
+        def to_row(i, fn):
             self.raw_data[i] = self.get_img(fn, (self.height, self.width), self.img_save_method).flatten()
-            if self.debug:  # just once
-                print("[*] Image Shape   : ", self.raw_data[i].shape)
-                print("[*] Image Size    : ", self.raw_data[i].size)
-                print("[*] Image MIN/MAX :  (%d, %d)" % (np.min(self.raw_data[i]), np.max(self.raw_data[i])))
-                self.debug = False
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            futures = [executor.submit(to_row, i, fn) for i, fn in enumerate(self.file_names)]
+            for future in tqdm(futures):
+                future.result()
+
+    def load_img_processes(self):
+        get_img = partial(self.get_img, size=(self.height, self.width), interp=self.img_save_method)
+        chunk_size = max(1, len(self.file_names) // (self.n_threads * 16))
+
+        # spawned, the workers don't fork this (tensorflow-initialized) process
+        with get_context('spawn').Pool(self.n_threads) as pool:
+            for i, img in tqdm(enumerate(pool.imap(get_img, self.file_names, chunksize=chunk_size))):
+                self.raw_data[i] = img.flatten()
 
     def load_tfr(self):
-        self.raw_data = tf.data.TFRecordDataset(self.file_names, compression_type='', buffer_size=self.buffer_size)
-        self.raw_data = self.raw_data.map(self.parse_tfr_tf, num_parallel_calls=self.n_threads)
+        self.raw_data = self.read_tfr(self.file_names, self.tfr_compression, self.buffer_size, self.n_threads)
 
     def load_h5(self, size=0, offset=0):
         init = True
@@ -266,6 +1058,15 @@ class DataSetLoader:
             print("[*] Image MIN/MAX :  (%d, %d)" % (np.min(self.raw_data[0]), np.max(self.raw_data[0])))
             self.debug = False
 
+    def load_mmap(self):
+        self.raw_data = MemmapShardStore(self.path)
+
+        if self.debug:  # just once
+            print("[*] Image Shape   : ", self.raw_data.sample_shape)
+            print("[*] Image Count   : ", len(self.raw_data))
+            print("[*] Shard Count   : ", len(self.raw_data.shards))
+            self.debug = False
+
     def convert_to_img(self):
         def to_img(i):
             cv2.imwrite('imgHQ%05d.png' % i, cv2.COLOR_BGR2RGB)
@@ -286,16 +1087,35 @@ class DataSetLoader:
         print(pool.map(to_img, ii))
 
     def convert_to_tfr(self):
-        for data in self.raw_data:
-            ex = tf.train.Example(
-                features=tf.train.Features(
-                    feature={
-                        'shape': tf.train.Feature(int64_list=tf.train.Int64List(value=data.shape)),
-                        'data': tf.train.Feature(bytes_list=tf.train.BytesList(value=[data.tostring()])),
-                    }
+        n_samples = len(self.raw_data)
+        n_shards = max(1, min(self.tfr_shards, n_samples))
+        sample_shape = (self.height, self.width, self.channel)
+
+        # the workers get (start, stop) ranges & slice a memmap store, the pixels never go through the pool's pipes.
+        # an in-memory source is written into a temporary store next to the output first.
+        save_dir = os.path.dirname(os.path.abspath(self.save_file_name))
+        with tempfile.TemporaryDirectory(dir=save_dir) as tmp_dir:
+            if isinstance(self.raw_data, MemmapShardStore):
+                store_path = self.raw_data.path
+            else:
+                store_path = MemmapShardStore.write(os.path.join(tmp_dir, 'store'), self.raw_data, self.shard_size).path
+
+            tasks = [
+                (
+                    "%s-%05d-of-%05d.tfrecords" % (self.save_file_name, i, n_shards),
+                    store_path,
+                    n_samples * i // n_shards,  # the shard sizes differ by 1 at most, none is empty
+                    n_samples * (i + 1) // n_shards,
+                    sample_shape,
+                    self.tfr_compression,
                 )
-            )
-            self.tfr_writer.write(ex.SerializeToString())
+                for i in range(n_shards)
+            ]
+
+            # spawned, the workers don't fork this (tensorflow-initialized) process
+            with get_context('spawn').Pool(min(self.n_threads, n_shards)) as pool:
+                for file_name in tqdm(pool.imap_unordered(DataSetLoader.write_tfr_shard, tasks), total=n_shards):
+                    print("[+] %s is written" % file_name)
 
     def convert_to_h5(self):
         with h5py.File(self.save_file_name, 'w') as f:
@@ -304,12 +1124,16 @@ class DataSetLoader:
     def convert_to_npy(self):
         np.save(self.save_file_name, self.raw_data)
 
+    def convert_to_mmap(self):
+        MemmapShardStore.write(self.save_file_name, self.raw_data, self.shard_size)
+
 
 class MNISTDataSet:
-    def __init__(self, use_split=False, split_rate=0.15, random_state=42, ds_path=None):
+    def __init__(self, use_split=False, split_rate=0.15, random_state=42, split_type='copy', ds_path=None):
         self.use_split = use_split
         self.split_rate = split_rate
         self.random_state = random_state
+        self.split_type = split_type  # 'copy' or 'index' (lazy views, no copies)
 
         self.ds_path = ds_path
 
@@ -338,8 +1162,8 @@ class MNISTDataSet:
 
         # split training data set into train, valid
         if self.use_split:
-            self.train_images, self.valid_images, self.train_labels, self.valid_labels = train_test_split(
-                self.train_images, self.train_labels, test_size=self.split_rate, random_state=self.random_state
+            self.train_images, self.valid_images, self.train_labels, self.valid_labels = train_valid_split(
+                self.train_images, self.train_labels, self.split_rate, self.random_state, self.split_type
             )
 
 
@@ -362,8 +1186,12 @@ class CiFarDataSet:
         use_split=False,
         split_rate=0.2,
         random_state=42,
+        split_type='copy',
         ds_name="cifar-10",
         ds_path=None,
+        use_cache=True,
+        cache_path=None,
+        use_one_hot=True,
     ):
 
         """
@@ -377,10 +1205,15 @@ class CiFarDataSet:
         :param use_split: training DataSet splitting, default True
         :param split_rate: image split rate (into train & test), default 0.2
         :param random_state: random seed for shuffling, default 42
+        :param split_type: 'copy' or 'index' (lazy views over the original images), default copy
 
         # DataSet Option
         :param ds_name: DataSet's name, default cifar-10
         :param ds_path: DataSet's path, default None
+        :param use_cache: decode the pickles once into NHWC uint8 .npy files & mmap them later, default True
+            - re-decoded when the pickles (mtime, size) change.
+        :param cache_path: where to save the .npy files, default None (a per-ds_path dir in ~/.cache/awesome_gans)
+        :param use_one_hot: one-hot (float) labels, or int labels if False, default True
         """
 
         self.height = height
@@ -390,11 +1223,16 @@ class CiFarDataSet:
         self.use_split = use_split
         self.split_rate = split_rate
         self.random_state = random_state
+        self.split_type = split_type
 
         self.ds_name = ds_name
         self.ds_path = ds_path  # DataSet path
         self.n_classes = 10  # DataSet the number of classes, default 10
 
+        self.use_cache = use_cache
+        self.cache_path = cache_path if cache_path else user_cache_path(ds_name, ds_path)
+        self.use_one_hot = use_one_hot
+
         self.train_images = None
         self.valid_images = None
         self.test_images = None
@@ -415,96 +1253,146 @@ class CiFarDataSet:
         else:
             raise NotImplementedError("[-] Only 'cifar-10' or 'cifar-100'")
 
+    def to_images(self, data):
+        # (N, C * H * W) -> (N, H, W, C), contiguous
+        return np.ascontiguousarray(
+            np.swapaxes(data.reshape([-1, self.height, self.width, self.channel], order='F'), 1, 2)
+        )
+
     def cifar_10(self):
         self.n_classes = 10  # labels
 
-        train_batch_1 = self.unpickle("{0}/data_batch_1".format(self.ds_path))
-        train_batch_2 = self.unpickle("{0}/data_batch_2".format(self.ds_path))
-        train_batch_3 = self.unpickle("{0}/data_batch_3".format(self.ds_path))
-        train_batch_4 = self.unpickle("{0}/data_batch_4".format(self.ds_path))
-        train_batch_5 = self.unpickle("{0}/data_batch_5".format(self.ds_path))
-
-        # training data & label
-        train_data = np.concatenate(
-            [
-                train_batch_1[b'data'],
-                train_batch_2[b'data'],
-                train_batch_3[b'data'],
-                train_batch_4[b'data'],
-                train_batch_5[b'data'],
-            ],
-            axis=0,
-        )
+        def decode():
+            train_batches = [self.unpickle("{0}/data_batch_{1}".format(self.ds_path, i)) for i in range(1, 6)]
 
-        train_labels = np.concatenate(
-            [
-                train_batch_1[b'labels'],
-                train_batch_2[b'labels'],
-                train_batch_3[b'labels'],
-                train_batch_4[b'labels'],
-                train_batch_5[b'labels'],
-            ],
-            axis=0,
-        )
+            # training data & label
+            train_data = np.concatenate([batch[b'data'] for batch in train_batches], axis=0)
+            train_labels = np.concatenate([batch[b'labels'] for batch in train_batches], axis=0)
 
-        # Image size : 32x32x3
-        train_images = np.swapaxes(train_data.reshape([-1, self.height, self.width, self.channel], order='F'), 1, 2)
+            # test data & label
+            test_batch = self.unpickle("{0}/test_batch".format(self.ds_path))
 
-        # test data & label
-        test_batch = self.unpickle("{0}/test_batch".format(self.ds_path))
+            test_data = test_batch[b'data']
+            test_labels = np.array(test_batch[b'labels'])
 
-        test_data = test_batch[b'data']
-        test_labels = np.array(test_batch[b'labels'])
+            # Image size : 32x32x3
+            return self.to_images(train_data), train_labels, self.to_images(test_data), test_labels
 
-        # image size : 32x32x3
-        test_images = np.swapaxes(test_data.reshape([-1, self.height, self.width, self.channel], order='F'), 1, 2)
+        self.load(decode, ["data_batch_%d" % i for i in range(1, 6)] + ["test_batch"])
 
-        # split training data set into train / val
-        if self.use_split:
-            train_images, valid_images, train_labels, valid_labels = train_test_split(
-                train_images, train_labels, test_size=self.split_rate, random_state=self.random_state
-            )
+    def cifar_100(self):
+        self.n_classes = 100  # labels
 
-            self.valid_images = valid_images
-            self.valid_labels = one_hot(valid_labels, self.n_classes)
+        def decode():
+            # training data & label
+            train_batch = self.unpickle("{0}/train".format(self.ds_path))
 
-        self.train_images = train_images
-        self.test_images = test_images
+            train_data = train_batch[b'data']
+            train_labels = np.array(train_batch[b'fine_labels'])
 
-        self.train_labels = one_hot(train_labels, self.n_classes)
-        self.test_labels = one_hot(test_labels, self.n_classes)
+            # test data & label
+            test_batch = self.unpickle("{0}/test".format(self.ds_path))
 
-    def cifar_100(self):
-        self.n_classes = 100  # labels
+            test_data = test_batch[b'data']
+            test_labels = np.array(test_batch[b'fine_labels'])
+
+            # Image size : 32x32x3
+            return self.to_images(train_data), train_labels, self.to_images(test_data), test_labels
+
+        self.load(decode, ["train", "test"])
+
+    def cache_file(self, name):
+        return os.path.join(self.cache_path, "%s-%s.npy" % (self.ds_name, name))
+
+    def source_key(self, sources):
+        """identifies the pickles the cache is decoded from, by their path, size & mtime"""
+        key = []
+        for fn in sources:
+            path = os.path.abspath(os.path.join(self.ds_path, fn))
+            st = os.stat(path)
+            key.append([path, st.st_size, st.st_mtime_ns])
+        return key
+
+    def load_cache(self, names, key):
+        """the cached (train_images, train_labels, test_images, test_labels), None if it's missing or stale"""
+        key_file = os.path.join(self.cache_path, "%s-key.json" % self.ds_name)
+        if not os.path.exists(key_file) or not all(os.path.exists(self.cache_file(name)) for name in names):
+            return None
+
+        with open(key_file, 'r') as f:
+            if json.load(f) != key:
+                return None
+
+        data = [np.load(self.cache_file(name), mmap_mode='r') for name in names]
+        for images, labels in (data[:2], data[2:]):
+            if images.shape[1:] != (self.height, self.width, self.channel) or labels.shape != images.shape[:1]:
+                return None
+        return data
 
-        # training data & label
-        train_batch = self.unpickle("{0}/train".format(self.ds_path))
+    def save_cache(self, names, key, data):
+        key_file = os.path.join(self.cache_path, "%s-key.json" % self.ds_name)
+        try:
+            os.makedirs(self.cache_path, exist_ok=True)
+
+            # the key goes first & comes back last, so a killed run leaves no loadable half-written cache.
+            # every file is written aside & renamed into place.
+            if os.path.exists(key_file):
+                os.remove(key_file)
+            for name, values in zip(names, data):
+                tmp_file = "%s.%d.tmp.npy" % (self.cache_file(name)[: -len('.npy')], os.getpid())
+                np.save(tmp_file, values)
+                os.replace(tmp_file, self.cache_file(name))
+
+            tmp_file = "%s.%d.tmp" % (key_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump(key, f)
+            os.replace(tmp_file, key_file)
+        except OSError:
+            print("[-] Can't cache %s at %s" % (self.ds_name, self.cache_path))
+
+    def load(self, decode, sources):
+        """
+        :param decode: callable which decodes the pickles into (train_images, train_labels, test_images, test_labels)
+        :param sources: file names of the pickles in ds_path
+        """
+        names = ('train-images', 'train-labels', 'test-images', 'test-labels')
+        key = self.source_key(sources) if self.use_cache else None
 
-        train_data = np.concatenate([train_batch[b'data']], axis=0)
-        train_labels = np.concatenate([train_batch[b'fine_labels']], axis=0)
-        train_images = np.swapaxes(train_data.reshape([-1, self.height, self.width, self.channel], order='F'), 1, 2)
+        data = self.load_cache(names, key) if self.use_cache else None
+        if data is not None:
+            train_images, train_labels, test_images, test_labels = data
+            train_labels, test_labels = np.array(train_labels), np.array(test_labels)
+        else:
+            train_images, train_labels, test_images, test_labels = decode()
 
-        # test data & label
-        test_batch = self.unpickle("{0}/test".format(self.ds_path))
+            # only the images are uint8, the labels (up to 100 classes or more) stay int
+            train_images = np.ascontiguousarray(train_images, dtype=np.uint8)
+            test_images = np.ascontiguousarray(test_images, dtype=np.uint8)
+            train_labels = np.asarray(train_labels, dtype=np.int64)
+            test_labels = np.asarray(test_labels, dtype=np.int64)
 
-        test_data = np.concatenate([test_batch[b'data']], axis=0)
-        test_labels = np.concatenate([test_batch[b'fine_labels']], axis=0)
-        test_images = np.swapaxes(test_data.reshape([-1, self.height, self.width, self.channel], order='F'), 1, 2)
+            if self.use_cache:
+                self.save_cache(names, key, (train_images, train_labels, test_images, test_labels))
 
         # split training data set into train / val
         if self.use_split:
-            train_images, valid_images, train_labels, valid_labels = train_test_split(
-                train_images, train_labels, test_size=self.split_rate, random_state=self.random_state
+            train_images, valid_images, train_labels, valid_labels = train_valid_split(
+                train_images, train_labels, self.split_rate, self.random_state, self.split_type
             )
 
             self.valid_images = valid_images
-            self.valid_labels = one_hot(valid_labels, self.n_classes)
+            self.valid_labels = self.to_labels(valid_labels)
 
         self.train_images = train_images
         self.test_images = test_images
 
-        self.train_labels = one_hot(train_labels, self.n_classes)
-        self.test_labels = one_hot(test_labels, self.n_classes)
+        self.train_labels = self.to_labels(train_labels)
+        self.test_labels = self.to_labels(test_labels)
+
+    def to_labels(self, labels):
+        if self.use_one_hot:
+            return one_hot(labels, self.n_classes)
+        return labels.astype(np.int64)
 
 
 class CelebADataSet:
@@ -525,11 +1413,13 @@ class CelebADataSet:
         use_split=False,
         split_rate=0.2,
         random_state=42,
+        split_type='copy',
         ds_image_path=None,
         ds_label_path=None,
         ds_type="CelebA",
         use_img_scale=True,
         img_scale="-1,1",
+        img_dtype=np.float32,
         use_save=False,
         save_type='to_h5',
         save_file_name=None,
@@ -551,17 +1441,22 @@ class CelebADataSet:
         :param use_split: splitting train DataSet into train/val
         :param split_rate: image split rate (into train & val)
         :param random_state: random seed for shuffling, default 42
+        :param split_type: 'copy' or 'index' (lazy views over the original images)
 
         # DataSet Settings
         :param ds_image_path: DataSet's Image Path
         :param ds_label_path: DataSet's Label Path
         :param ds_type: which DataSet is
-        :param use_img_scale: using img scaling?
+        :param use_img_scale: using img scaling? True, False or 'lazy' (stays uint8, scaled per batch)
         :param img_scale: img normalize
+        :param img_dtype: dtype of the scaled images, float32 or float16
         :param use_save: saving into another file format
         :param save_type: file format to save
         :param save_file_name: file name to save
         :param use_concat_data: concatenate images & labels
+        - True        : labels are tiled to (N, H, W, n_attrs) & concatenated onto the images
+        - 'broadcast' : images & (N, n_attrs) labels are kept as they are,
+                        broadcast them per batch in the graph with modules.broadcast_labels
         """
 
         self.height = height
@@ -584,6 +1479,7 @@ class CelebADataSet:
         self.use_split = use_split
         self.split_rate = split_rate
         self.random_state = random_state
+        self.split_type = split_type
 
         self.attr = []  # loaded labels
         self.images = []
@@ -604,6 +1500,7 @@ class CelebADataSet:
 
         self.use_img_scale = use_img_scale
         self.img_scale = img_scale
+        self.img_dtype = img_dtype
 
         try:
             assert self.ds_image_path and self.ds_label_path
@@ -629,6 +1526,7 @@ class CelebADataSet:
         self.save_file_name = save_file_name
 
         self.use_concat_data = use_concat_data
+        self.use_label_broadcast = use_concat_data == 'broadcast'
 
         try:
             if self.use_save:
@@ -636,7 +1534,7 @@ class CelebADataSet:
         except AssertionError:
             raise AssertionError("[-] save-file/folder-name is required!")
 
-        self.images = DataSetLoader(
+        loader = DataSetLoader(
             path=self.ds_image_path,
             size=self.image_shape,
             use_save=self.use_save,
@@ -644,39 +1542,36 @@ class CelebADataSet:
             save_file_name=self.save_file_name,
             use_image_scaling=use_img_scale,
             image_scale=self.img_scale,
-        ).raw_data  # numpy arrays
+            image_dtype=self.img_dtype,
+        )
+        self.images = loader.raw_data  # numpy arrays
+        self.batch_img_scale = loader.batch_img_scale  # pass to DataIterator(scale=..., dtype=...)
+        self.batch_img_dtype = loader.batch_img_dtype
+
+        try:
+            assert not (self.batch_img_scale and self.use_concat_data and not self.use_label_broadcast)
+        except AssertionError:
+            raise AssertionError("[-] lazy image scaling can only be used with use_concat_data='broadcast' :(")
+
         self.labels = self.load_attr(path=self.ds_label_path)
 
-        if self.use_concat_data:
+        if self.use_concat_data and not self.use_label_broadcast:
             self.images = self.concat_data(self.images, self.labels)
 
         # split training data set into train / val
         if self.use_split:
-            self.train_images, self.valid_images, self.train_labels, self.valid_labels = train_test_split(
-                self.images, self.labels, test_size=self.split_rate, random_state=self.random_state
+            self.train_images, self.valid_images, self.train_labels, self.valid_labels = train_valid_split(
+                self.images, self.labels, self.split_rate, self.random_state, self.split_type
             )
 
     def load_attr(self, path):
-        with open(path, 'r') as f:
-            img_attr = []
-
-            self.num_images = int(f.readline().strip())
-            self.attr = (f.readline().strip()).split(' ')
-
-            print("[*] the number of images     : %d" % self.num_images)
-            print("[*] the number of attributes : %d/%d" % (len(self.attr_labels), len(self.attr)))
+        self.num_images, self.attr, table = load_celeba_attr(path)
 
-            for fn in f.readlines():
-                row = fn.strip().split()
-                # img_name = row[0]
-                attr = [int(x) for x in row[1:]]
+        print("[*] the number of images     : %d" % self.num_images)
+        print("[*] the number of attributes : %d/%d" % (len(self.attr_labels), len(self.attr)))
 
-                tmp = [attr[self.attr.index(x)] for x in self.attr_labels]
-                tmp = [1.0 if x == 1 else 0.0 for x in tmp]  # one-hot labeling
-
-                img_attr.append(tmp)
-
-            return np.asarray(img_attr)
+        columns = [self.attr.index(x) for x in self.attr_labels]
+        return (table[:, columns] == 1).astype(np.float32)  # one-hot labeling
 
     def concat_data(self, img, label):
         label = np.tile(np.reshape(label, [-1, 1, 1, len(self.attr_labels)]), [1, self.height, self.width, 1])
@@ -695,6 +1590,8 @@ class Pix2PixDataSet:
         n_threads=8,
         ds_path=None,
         ds_name=None,
+        use_img_scale=True,
+        img_dtype=np.float32,
         use_save=False,
         save_type='to_h5',
         save_file_name=None,
@@ -715,6 +1612,8 @@ class Pix2PixDataSet:
         # DataSet Option
         :param ds_path: DataSet's Path, default None
         :param ds_name: DataSet's Name, default None
+        :param use_img_scale: using img scaling? True, False or 'lazy' (stays uint8, scaled per batch)
+        :param img_dtype: dtype of the scaled images, float32 or float16
         :param use_save: saving into another file format
         :param save_type: file format to save
         :param save_file_name: file name to save
@@ -758,6 +1657,11 @@ class Pix2PixDataSet:
         self.n_dg_images_a = 0
         self.n_dg_images_b = 0
 
+        self.use_img_scale = use_img_scale
+        self.img_dtype = img_dtype
+        self.batch_img_scale = None  # pass to DataIterator(scale=..., dtype=...)
+        self.batch_img_dtype = self.img_dtype
+
         self.use_save = use_save
         self.save_type = save_type
         self.save_file_name = save_file_name
@@ -769,25 +1673,32 @@ class Pix2PixDataSet:
             raise AssertionError("[-] save-file/folder-name is required!")
 
         if self.ds_name in self.ds_single_grid:
-            self.images_a = DataSetLoader(
+            loader_a = DataSetLoader(
                 path=self.ds_path + "/" + self.ds_name + "/trainA/",
                 size=self.image_shape,
                 use_save=self.use_save,
                 name=self.save_type,
                 save_file_name=self.save_file_name,
-                use_image_scaling=True,
+                use_image_scaling=self.use_img_scale,
                 image_scale='0,1',
-            ).raw_data  # numpy arrays
+                image_dtype=self.img_dtype,
+            )
 
-            self.images_b = DataSetLoader(
+            loader_b = DataSetLoader(
                 path=self.ds_path + "/" + self.ds_name + "/trainB/",
                 size=self.image_shape,
                 use_save=self.use_save,
                 name=self.save_type,
                 save_file_name=self.save_file_name,
-                use_image_scaling=True,
+                use_image_scaling=self.use_img_scale,
                 image_scale='0,1',
-            ).raw_data  # numpy arrays
+                image_dtype=self.img_dtype,
+            )
+
+            self.images_a = loader_a.raw_data  # numpy arrays
+            self.images_b = loader_b.raw_data  # numpy arrays
+            self.batch_img_scale = loader_a.batch_img_scale
+            self.batch_img_dtype = loader_a.batch_img_dtype
             self.n_images_a = self.n_sg_images_a
             self.n_images_b = self.n_sg_images_b
         elif self.ds_name in self.ds_double_grid:
@@ -800,25 +1711,271 @@ class Pix2PixDataSet:
 
 
 class ImageNetDataSet:
-    def __init__(self):
-        pass
+    """
+    Streaming ImageNet-style DataSet (class_dir/*.jpg), for class-conditional models like BigGAN.
+        - the file index is built once & cached, then shared by every worker.
+          file names are kept relative to their class folder, packed into one utf-8 blob & decoded on demand.
+        - images are decoded & resized on a thread pool, at most buffer_size batches are decoded ahead.
 
+    Expected ds_path : ImageNet/train/ (sub-folder : n01440764/*.JPEG, n01443537/*.JPEG, ...)
+    """
 
-class Div2KDataSet:
     def __init__(
         self,
-        hr_height=384,
-        hr_width=384,
-        lr_height=96,
-        lr_width=96,
+        ds_path=None,
+        height=128,
+        width=128,
         channel=3,
-        use_split=False,
-        split_rate=0.1,
-        random_state=42,
+        batch_size=64,
+        sampling='balanced',
+        buffer_size=4,
         n_threads=8,
-        ds_path=None,
+        rank=0,
+        world_size=1,
+        index_path=None,
+        random_state=42,
+    ):
+        """
+        # General Settings
+        :param height: image height, default 128
+        :param width: image width, default 128
+        :param channel: image channel, default 3 (RGB)
+        :param batch_size: the number of images per batch, default 64
+
+        # Pre-Processing Option
+        :param sampling: 'balanced' (class first, then an image of it) or 'uniform' (every image once per epoch)
+        :param buffer_size: the number of batches to decode ahead, default 4
+        :param n_threads: the number of threads to decode, default 8
+
+        # Distributed Option
+        :param rank: worker rank, default 0
+        :param world_size: the number of workers, default 1
+        - each worker gets every world_size-th file of the index, starting from its rank.
+
+        # DataSet Option
+        :param ds_path: DataSet's path
+        :param index_path: file index path, default ds_path/index.npz,
+            or a per-ds_path file in ~/.cache/awesome_gans if ds_path isn't writable
+        :param random_state: random seed for sampling, default 42
+        """
+        self.ds_path = ds_path
+
+        try:
+            assert self.ds_path
+        except AssertionError:
+            raise AssertionError("[-] ImageNet DataSet Path is required!")
+
+        try:
+            assert sampling in ('balanced', 'uniform')
+        except AssertionError:
+            raise AssertionError("[-] Only 'balanced' or 'uniform' sampling please - (%s)" % sampling)
+
+        try:
+            assert 0 <= rank < world_size
+        except AssertionError:
+            raise AssertionError("[-] rank (%d) must be in [0, world_size (%d)) :(" % (rank, world_size))
+
+        self.height = height
+        self.width = width
+        self.channel = channel
+        self.batch_size = batch_size
+        self.image_shape = [self.batch_size, self.height, self.width, self.channel]
+
+        self.sampling = sampling
+        self.buffer_size = max(1, buffer_size)
+        self.n_threads = n_threads
+
+        self.rank = rank
+        self.world_size = world_size
+
+        self.index_paths = [index_path] if index_path else [os.path.join(self.ds_path, 'index.npz'), self.cache_path()]
+        self.rng = np.random.RandomState(random_state + rank)
+
+        self.class_names, self.class_offsets, self.names_blob, self.name_offsets = self.load_index()
+        self.n_classes = len(self.class_names)
+
+        # this worker's shard, as indices into the index
+        self.image_ids = np.arange(self.rank, self.name_offsets.size - 1, self.world_size)
+        self.labels = (np.searchsorted(self.class_offsets, self.image_ids, side='right') - 1).astype(np.int32)
+        self.num_images = len(self.image_ids)
+
+        try:
+            assert self.num_images >= self.batch_size
+        except AssertionError:
+            raise AssertionError("[-] Not enough images (%d) in the shard %d :(" % (self.num_images, self.rank))
+
+        # image indices of each class, for balanced sampling
+        order = np.argsort(self.labels, kind='stable')
+        bounds = np.searchsorted(self.labels[order], np.arange(self.n_classes + 1))
+        self.class_indices = [order[bounds[i] : bounds[i + 1]] for i in range(self.n_classes)]
+        self.sample_classes = np.array([i for i in range(self.n_classes) if len(self.class_indices[i])])
+
+        print("[*] the number of classes : %d" % self.n_classes)
+        print("[*] the number of images  : %d (shard %d/%d)" % (self.num_images, self.rank, self.world_size))
+
+    def cache_path(self):
+        return user_cache_path('imagenet-index', self.ds_path) + '.npz'
+
+    def build_index(self):
+        """
+        :return: class names, image offsets of the classes (n_classes + 1,),
+            utf-8 blob of the file names (relative to their class folder) & their offsets (n_images + 1,)
+        """
+        class_names = sorted(d for d in os.listdir(self.ds_path) if os.path.isdir(os.path.join(self.ds_path, d)))
+
+        class_offsets, names = [0], []
+        for class_name in tqdm(class_names):
+            with os.scandir(os.path.join(self.ds_path, class_name)) as it:
+                names.extend(sorted(e.name for e in it if e.name.lower().endswith(('.jpg', '.jpeg', '.png'))))
+            class_offsets.append(len(names))
+
+        encoded = [name.encode('utf-8') for name in names]
+        name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+        names_blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        return np.array(class_names), np.array(class_offsets, dtype=np.int64), names_blob, name_offsets
+
+    def load_index(self):
+        """loads the cached file index, or builds (& caches) it when it's missing or older than the class folders"""
+        with os.scandir(self.ds_path) as it:
+            folders_mtime = max((e.stat().st_mtime_ns for e in it if e.is_dir()), default=0)
+
+        for index_path in self.index_paths:
+            if os.path.exists(index_path) and folders_mtime <= os.stat(index_path).st_mtime_ns:
+                with np.load(index_path) as index:
+                    if 'names_blob' in index.files:  # not the former index of the absolute paths
+                        return index['class_names'], index['class_offsets'], index['names_blob'], index['name_offsets']
+
+        class_names, class_offsets, names_blob, name_offsets = self.build_index()
+
+        try:
+            assert name_offsets.size > 1
+        except AssertionError:
+            raise AssertionError("[-] There's no image in %s :(" % self.ds_path)
+
+        for index_path in self.index_paths:  # the first writable one
+            # written aside & renamed, so the other workers never read a partial index
+            tmp_path = "%s.%d.tmp.npz" % (os.path.splitext(index_path)[0], os.getpid())
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+                np.savez(
+                    tmp_path,
+                    class_names=class_names,
+                    class_offsets=class_offsets,
+                    names_blob=names_blob,
+                    name_offsets=name_offsets,
+                )
+                os.replace(tmp_path, index_path)
+                break
+            except OSError as e:
+                print("[-] Can't write the index to %s : %s" % (index_path, e))
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        return class_names, class_offsets, names_blob, name_offsets
+
+    def get_path(self, idx):
+        """the file path of the idx-th image of this worker's shard"""
+        image_id = self.image_ids[idx]
+        name = self.names_blob[self.name_offsets[image_id] : self.name_offsets[image_id + 1]].tobytes().decode('utf-8')
+        return os.path.join(self.ds_path, self.class_names[self.labels[idx]], name)
+
+    @staticmethod
+    def get_img(path, size=(128, 128)):
+        img = imread_rgb(path)
+
+        # center crop into the aspect ratio of the output, then resize
+        h, w = img.shape[:2]
+        crop_h, crop_w = min(h, w * size[0] // size[1]), min(w, h * size[1] // size[0])
+        top, left = (h - crop_h) // 2, (w - crop_w) // 2
+        img = img[top : top + crop_h, left : left + crop_w]
+
+        interp = cv2.INTER_AREA if crop_h > size[0] else cv2.INTER_CUBIC
+        return cv2.resize(img, (size[1], size[0]), interpolation=interp)
+
+    def get_replacement(self, label, size, max_tries=10):
+        """a readable random image of the class, in place of a corrupt one"""
+        candidates = self.class_indices[label]
+        for _ in range(max_tries):
+            try:
+                return self.get_img(self.get_path(candidates[self.rng.randint(len(candidates))]), size)
+            except IOError as e:
+                print("%s, replaced" % e)
+        raise IOError("[-] Can't read any image of the class %s :(" % self.class_names[label])
+
+    def sample_indices(self):
+        """yields the image indices of each batch, endlessly"""
+        while True:
+            if self.sampling == 'balanced':
+                classes = self.rng.choice(self.sample_classes, self.batch_size)
+                yield np.array([self.class_indices[c][self.rng.randint(len(self.class_indices[c]))] for c in classes])
+            else:
+                order = self.rng.permutation(self.num_images)
+                for start in range(0, self.num_images - self.batch_size + 1, self.batch_size):
+                    yield order[start : start + self.batch_size]
+
+    def iterate(self, n_batches=None, use_one_hot=True):
+        """
+        yields (uint8 images (batch_size, height, width, channel), labels) batches.
+        :param n_batches: the number of batches, None for endless
+        :param use_one_hot: one-hot float32 labels (batch_size, n_classes) or int32 (batch_size,)
+        """
+        size = (self.height, self.width)
+        sampler = self.sample_indices()
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+
+            def submit():
+                indices = next(sampler)
+                futures = [executor.submit(self.get_img, self.get_path(i), size) for i in indices]
+                pending.append((indices, futures))
+
+            try:
+                n = 0
+                while n_batches is None or n < n_batches:
+                    while len(pending) < self.buffer_size:
+                        submit()
+
+                    indices, futures = pending.popleft()
+
+                    batch_x = np.empty(self.image_shape, dtype=np.uint8)
+                    for i, future in enumerate(futures):
+                        try:
+                            batch_x[i] = future.result()
+                        except IOError as e:  # a corrupt file, replaced by another image of its class
+                            print("%s, replaced" % e)
+                            batch_x[i] = self.get_replacement(self.labels[indices[i]], size)
+
+                    batch_y = self.labels[indices]
+                    if use_one_hot:
+                        batch_y = one_hot(batch_y, self.n_classes).astype(np.float32)
+
+                    yield batch_x, batch_y
+                    n += 1
+            finally:  # on an error or an early break too, drops the batches decoded ahead
+                for _, futures in pending:
+                    for future in futures:
+                        future.cancel()
+
+
+class Div2KDataSet:
+    def __init__(
+        self,
+        hr_height=384,
+        hr_width=384,
+        lr_height=96,
+        lr_width=96,
+        channel=3,
+        use_split=False,
+        split_rate=0.1,
+        random_state=42,
+        n_threads=8,
+        ds_path=None,
         ds_name=None,
         use_img_scale=True,
+        img_dtype=np.float32,
         ds_hr_path=None,
         ds_lr_path=None,
         use_save=False,
@@ -843,7 +2000,8 @@ class Div2KDataSet:
         # DataSet Option
         :param ds_path: DataSet's Path, default None
         :param ds_name: DataSet's Name, default None
-        :param use_img_scale: using img scaling?
+        :param use_img_scale: using img scaling? True, False or 'lazy' (stays uint8, scaled per batch)
+        :param img_dtype: dtype of the scaled images, float32 or float16
         :param ds_hr_path: DataSet High Resolution path
         :param ds_lr_path: DataSet Low Resolution path
         :param use_save: saving into another file format
@@ -897,12 +2055,13 @@ class Div2KDataSet:
         self.n_images_val = 100
 
         self.use_img_scaling = use_img_scale
+        self.img_dtype = img_dtype
 
         if self.ds_path:  # like .h5 or .tfr
             self.ds_hr_path = self.ds_path + "/DIV2K_train_HR/"
             self.ds_lr_path = self.ds_hr_path  # self.ds_path + "/DIV2K_train_LR_bicubic/" + self.ds_name + "/"
 
-        self.hr_images = DataSetLoader(
+        hr_loader = DataSetLoader(
             path=self.ds_hr_path,
             size=self.hr_shape,
             use_save=self.use_save,
@@ -911,9 +2070,10 @@ class Div2KDataSet:
             use_image_scaling=self.use_img_scaling,
             image_scale='-1,1',
             img_save_method=cv2.INTER_LINEAR,
-        ).raw_data  # numpy arrays
+            image_dtype=self.img_dtype,
+        )
 
-        self.lr_images = DataSetLoader(
+        lr_loader = DataSetLoader(
             path=self.ds_lr_path,
             size=self.lr_shape,
             use_save=self.use_save,
@@ -922,17 +2082,490 @@ class Div2KDataSet:
             use_image_scaling=self.use_img_scaling,
             image_scale='-1,1',
             img_save_method=cv2.INTER_CUBIC,
-        ).raw_data  # numpy arrays
+            image_dtype=self.img_dtype,
+        )
+
+        self.hr_images = hr_loader.raw_data  # numpy arrays
+        self.lr_images = lr_loader.raw_data  # numpy arrays
+        self.batch_img_scale = hr_loader.batch_img_scale  # pass to DataIterator(scale=..., dtype=...)
+        self.batch_img_dtype = hr_loader.batch_img_dtype
+
+
+class Div2KPatchDataSet:
+    """
+    Random-patch streaming DataSet of DIV2K, for SR models like SRGAN.
+        - full-resolution HR images are kept in a memory-mapped PackedImageStore (built once from the .png files).
+        - LR images are bicubic-downscaled on their first use & cached into another store next to it.
+        - every batch is a set of random, aligned HR/LR crops (with flips & transposes), cropped by a thread pool.
+
+    Expected ds_path : div2k/... (sub-folder : DIV2K_train_HR/*.png)
+    """
+
+    def __init__(
+        self,
+        ds_path=None,
+        ds_hr_path=None,
+        store_path=None,
+        patch_size=96,
+        scale=4,
+        channel=3,
+        batch_size=16,
+        use_augment=True,
+        img_scale=None,
+        img_dtype=np.float32,
+        buffer_size=4,
+        n_threads=8,
+        random_state=42,
+    ):
+        """
+        # General Settings
+        :param patch_size: HR patch size, default 96, must be a multiple of scale
+        :param scale: down-scaling factor, default 4 (x4)
+        :param channel: image channel, default 3 (RGB)
+        :param batch_size: the number of patches per batch, default 16
+
+        # Pre-Processing Option
+        :param use_augment: random horizontal/vertical flips & transposes, default True
+        :param img_scale: None (uint8), '0,1' or '-1,1', scaled per batch
+        :param img_dtype: dtype of the scaled patches, float32 or float16
+        :param buffer_size: the number of batches to crop ahead, default 4
+        :param n_threads: the number of threads to crop, default 8
+        :param random_state: random seed for sampling, default 42
+
+        # DataSet Option
+        :param ds_path: DataSet's path
+        :param ds_hr_path: DataSet High Resolution path, default ds_path/DIV2K_train_HR/
+        :param store_path: HR store path, default ds_path/DIV2K_train_HR.store
+        """
+        self.ds_hr_path = ds_hr_path if ds_hr_path else (os.path.join(ds_path, "DIV2K_train_HR") if ds_path else None)
+        if not store_path and self.ds_hr_path:
+            store_path = self.ds_hr_path.rstrip('/\\') + ".store"
+        self.store_path = store_path
+
+        try:
+            assert self.store_path
+        except AssertionError:
+            raise AssertionError("[-] DataSet's path is required!")
+
+        try:
+            assert patch_size % scale == 0
+        except AssertionError:
+            raise AssertionError("[-] patch_size (%d) must be a multiple of scale (%d) :(" % (patch_size, scale))
+
+        self.patch_size = patch_size
+        self.scale = scale
+        self.lr_patch_size = patch_size // scale
+        self.channel = channel
+        self.batch_size = batch_size
+        self.hr_shape = (self.batch_size, self.patch_size, self.patch_size, self.channel)
+        self.lr_shape = (self.batch_size, self.lr_patch_size, self.lr_patch_size, self.channel)
+
+        self.use_augment = use_augment
+        self.img_scale = img_scale
+        self.img_dtype = img_dtype
+        self.buffer_size = max(1, buffer_size)
+        self.n_threads = n_threads
+        self.rng = np.random.RandomState(random_state)
+
+        if not PackedImageStore.is_store(self.store_path):
+            self.convert_to_store()
+
+        self.hr_store = PackedImageStore(self.store_path)
+
+        # LR cache, aligned to the HR crops : LR pixel (y, x) <=> HR pixels [y * scale, (y + 1) * scale)
+        self.lr_store_path = "%s-lr-x%d" % (self.store_path, self.scale)
+        lr_shapes = [(h // self.scale, w // self.scale, c) for h, w, c in self.hr_store.shapes]
+        if PackedImageStore.is_store(self.lr_store_path):
+            self.lr_store = PackedImageStore(self.lr_store_path, mode='r+')
+        else:
+            self.lr_store = PackedImageStore.create(self.lr_store_path, lr_shapes)
+
+        done_file = os.path.join(self.lr_store_path, 'done.u8')
+        self.lr_done = np.memmap(
+            done_file, dtype=np.uint8, mode='r+' if os.path.exists(done_file) else 'w+', shape=(len(lr_shapes),)
+        )
+        self.lr_locks = [threading.Lock() for _ in range(len(lr_shapes))]
+
+        # images large enough to be cropped
+        lr_hw = self.lr_store.shapes[:, :2]
+        self.indices = np.flatnonzero(np.all(lr_hw >= self.lr_patch_size, axis=1))
+        self.num_images = len(self.indices)
+
+        try:
+            assert self.num_images
+        except AssertionError:
+            raise AssertionError("[-] There's no image larger than the patch size (%d) :(" % self.patch_size)
+
+        print("[*] the number of HR images : %d (LR cached : %d)" % (self.num_images, int(self.lr_done.sum())))
+
+    def convert_to_store(self):
+        files = sorted(glob(os.path.join(self.ds_hr_path, "*.png")))
+
+        try:
+            assert files
+        except AssertionError:
+            raise AssertionError("[-] There's no .png file in %s :(" % self.ds_hr_path)
+
+        def decode(fn):
+            return imread_rgb(fn)
+
+        def images():  # at most n_threads * 2 decoded images in flight
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                pending = deque()
+                for fn in tqdm(files):
+                    pending.append(executor.submit(decode, fn))
+                    if len(pending) >= self.n_threads * 2:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+
+        PackedImageStore.write(self.store_path, images())
+        print("[+] HR store is written at %s" % self.store_path)
+
+    def get_lr(self, idx):
+        if not self.lr_done[idx]:
+            with self.lr_locks[idx]:
+                if not self.lr_done[idx]:
+                    lr_h, lr_w = self.lr_store.shapes[idx][:2]
+                    hr = self.hr_store[idx][: lr_h * self.scale, : lr_w * self.scale]
+                    self.lr_store[idx][...] = cv2.resize(hr, (int(lr_w), int(lr_h)), interpolation=cv2.INTER_CUBIC)
+                    self.lr_done[idx] = 1
+        return self.lr_store[idx]
+
+    def crop(self, idx, ry, rx, aug, hr_out, lr_out):
+        lr = self.get_lr(idx)
+        lr_h, lr_w = lr.shape[:2]
+
+        y, x = int(ry * (lr_h - self.lr_patch_size + 1)), int(rx * (lr_w - self.lr_patch_size + 1))
+        lr = lr[y : y + self.lr_patch_size, x : x + self.lr_patch_size]
+        hr = self.hr_store[idx][
+            y * self.scale : y * self.scale + self.patch_size, x * self.scale : x * self.scale + self.patch_size
+        ]
+
+        if aug & 1:  # horizontal flip
+            hr, lr = hr[:, ::-1], lr[:, ::-1]
+        if aug & 2:  # vertical flip
+            hr, lr = hr[::-1], lr[::-1]
+        if aug & 4:  # transpose
+            hr, lr = hr.transpose(1, 0, 2), lr.transpose(1, 0, 2)
+
+        hr_out[...] = hr
+        lr_out[...] = lr
+
+    def iterate(self, n_batches=None):
+        """
+        yields (HR patches (batch_size, patch_size, patch_size, channel), LR patches) batches.
+        :param n_batches: the number of batches, None for endless
+        """
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+
+            def submit():
+                batch_hr = np.empty(self.hr_shape, dtype=np.uint8)
+                batch_lr = np.empty(self.lr_shape, dtype=np.uint8)
+
+                indices = self.indices[self.rng.randint(self.num_images, size=self.batch_size)]
+                ry, rx = self.rng.random_sample(self.batch_size), self.rng.random_sample(self.batch_size)
+                augs = self.rng.randint(8, size=self.batch_size) if self.use_augment else np.zeros(self.batch_size)
+
+                futures = [
+                    executor.submit(self.crop, idx, ry[i], rx[i], int(augs[i]), batch_hr[i], batch_lr[i])
+                    for i, idx in enumerate(indices)
+                ]
+                pending.append((batch_hr, batch_lr, futures))
+
+            try:
+                n = 0
+                while n_batches is None or n < n_batches:
+                    while len(pending) < self.buffer_size:
+                        submit()
+
+                    batch_hr, batch_lr, futures = pending.popleft()
+                    for future in futures:
+                        future.result()
+
+                    if self.img_scale:
+                        batch_hr = DataSetLoader.img_scaling(batch_hr, self.img_scale, self.img_dtype)
+                        batch_lr = DataSetLoader.img_scaling(batch_lr, self.img_scale, self.img_dtype)
+
+                    yield batch_hr, batch_lr
+                    n += 1
+            finally:  # on an error or an early break too, drops the batches cropped ahead
+                for _, _, futures in pending:
+                    for future in futures:
+                        future.cancel()
 
 
 class UrbanSoundDataSet:
-    def __init__(self):
-        pass
+    """
+    Streaming waveform DataSet (UrbanSound8K or any folder of .wav files), for SEGAN.
+        - .wav files are decoded in chunks, resampled, pre-emphasized & cut into overlapping frames by a worker pool.
+        - memory is bounded by the files in flight (2 * n_threads) & the shuffle buffer, not by the size of the corpus.
+
+    Expected ds_path : UrbanSound8K/audio/ (sub-folder : fold1/*.wav, fold2/*.wav, ...)
+    """
+
+    def __init__(
+        self,
+        ds_path=None,
+        sample_rate=16000,
+        frame_length=16384,
+        frame_stride=8192,
+        pre_emphasis=0.95,
+        batch_size=64,
+        shuffle_buffer=1024,
+        chunk_size=65536,
+        n_threads=8,
+        random_state=42,
+    ):
+        """
+        # DataSet Option
+        :param ds_path: DataSet's path, .wav files are searched recursively
+        :param sample_rate: sample rate to resample into, default 16000
+        :param frame_length: the number of samples per frame, default 16384 (~1s)
+        :param frame_stride: the number of samples between the frames, default 8192 (50% overlapped)
+        :param pre_emphasis: pre-emphasis coefficient, 0 to disable, default 0.95
+
+        # Pre-Processing Option
+        :param batch_size: the number of frames per batch, default 64
+        :param shuffle_buffer: the number of frames to shuffle, default 1024
+        :param chunk_size: the number of samples to decode at once, default 65536
+        :param n_threads: the number of worker processes to decode, default 8
+        :param random_state: random seed for shuffling, default 42
+        """
+        self.ds_path = ds_path
+
+        try:
+            assert self.ds_path
+        except AssertionError:
+            raise AssertionError("[-] UrbanSound DataSet Path is required!")
+
+        self.sample_rate = sample_rate
+        self.frame_length = frame_length
+        self.frame_stride = frame_stride
+        self.pre_emphasis = pre_emphasis
+
+        self.batch_size = batch_size
+        self.shuffle_buffer = max(shuffle_buffer, batch_size)
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads
+        self.rng = np.random.RandomState(random_state)
+
+        self.files = sorted(glob(os.path.join(self.ds_path, '**', '*.wav'), recursive=True))
+
+        try:
+            assert self.files
+        except AssertionError:
+            raise AssertionError("[-] There's no .wav file in %s :(" % self.ds_path)
+
+        print("[*] the number of .wav files : %d" % len(self.files))
+
+    @staticmethod
+    def pcm_to_float(raw, sample_width, n_channels, is_float=False):
+        if is_float:  # IEEE float
+            if sample_width not in (4, 8):
+                raise ValueError("[-] Not supported float sample width (%d) :(" % sample_width)
+            data = np.frombuffer(raw, dtype='<f%d' % sample_width).astype(np.float32)
+        elif sample_width == 1:  # unsigned 8-bit
+            data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+        elif sample_width == 2:
+            data = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+        elif sample_width == 3:  # 24-bit, sign-extended into int32
+            data = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            data = (data[:, 0] | (data[:, 1] << 8) | (data[:, 2] << 16)) << 8 >> 8
+            data = data.astype(np.float32) / 8388608.0
+        elif sample_width == 4:
+            data = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+        else:
+            raise ValueError("[-] Not supported sample width (%d) :(" % sample_width)
+        return data.reshape(-1, n_channels).mean(axis=1)  # to mono
+
+    @staticmethod
+    def read_wav_header(f):
+        """
+        parses the RIFF/WAVE header, PCM, IEEE float & WAVE_FORMAT_EXTENSIBLE (which wave.open rejects).
+        :return: (format tag, n_channels, sample rate, sample width in bytes, data size in bytes),
+            f is left at the start of the samples
+        """
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError("[-] Not a RIFF/WAVE file :(")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("[-] There's no data chunk :(")
+
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError("[-] There's no fmt chunk before the data chunk :(")
+                return fmt + (size,)
+
+            if chunk_id == b'fmt ':
+                body = f.read(size)
+                format_tag, n_channels, sample_rate, _, block_align, _ = struct.unpack('<HHIIHH', body[:16])
+                if format_tag == 0xFFFE and len(body) >= 26:  # extensible, the format is in the sub-format GUID
+                    format_tag = struct.unpack('<H', body[24:26])[0]
+                # the container size, e.g. 24-bit samples in 32-bit containers are left-justified int32
+                fmt = (format_tag, n_channels, sample_rate, block_align // n_channels)
+            else:
+                f.seek(size, os.SEEK_CUR)
+
+            if size % 2:  # chunks are word-aligned
+                f.seek(1, os.SEEK_CUR)
+
+    @staticmethod
+    def read_wav_chunks(path, chunk_size=65536):
+        """yields (sample rate, float32 mono chunk in [-1, 1])"""
+        with open(path, 'rb') as f:
+            format_tag, n_channels, sample_rate, sample_width, data_size = UrbanSoundDataSet.read_wav_header(f)
+            if format_tag not in (1, 3):  # PCM, IEEE float
+                raise ValueError("[-] Not supported wav format (0x%04x) :(" % format_tag)
+
+            block_align = sample_width * n_channels
+            remaining = data_size - data_size % block_align
+            while remaining > 0:
+                raw = f.read(min(chunk_size * block_align, remaining))
+                raw = raw[: len(raw) - len(raw) % block_align]  # truncated file
+                if not raw:
+                    break
+
+                remaining -= len(raw)
+                yield sample_rate, UrbanSoundDataSet.pcm_to_float(raw, sample_width, n_channels, format_tag == 3)
+
+    @staticmethod
+    def decode_frames(path, sample_rate, frame_length, frame_stride, pre_emphasis, chunk_size):
+        """
+        decodes a .wav file in chunks into (N, frame_length) float32 frames.
+        low-pass, resampling & pre-emphasis carry their states across the chunks.
+        """
+        from scipy.signal import firwin, lfilter, lfilter_zi
+
+        frames, tail = [], np.zeros((0,), dtype=np.float32)
+        lp_taps, lp_state, position, last = None, None, 0.0, None
+        emphasis_state = np.zeros((1,), dtype=np.float32)
+
+        for src_rate, chunk in UrbanSoundDataSet.read_wav_chunks(path, chunk_size):
+            if src_rate != sample_rate:
+                if lp_taps is None:
+                    # anti-aliasing low-pass, then linear interpolation
+                    lp_taps = firwin(63, 0.9 * min(src_rate, sample_rate) / 2.0, fs=src_rate)
+                    lp_state = lfilter_zi(lp_taps, [1.0]) * chunk[0]
+                chunk, lp_state = lfilter(lp_taps, [1.0], chunk, zi=lp_state)
+
+                if last is not None:  # position is relative to the last sample of the previous chunk
+                    chunk = np.concatenate([[last], chunk])
+                step = src_rate / sample_rate
+                positions = np.arange(position, len(chunk) - 1, step)
+                last = chunk[-1]
+                if len(positions):
+                    position = positions[-1] + step - (len(chunk) - 1)
+                    chunk = np.interp(positions, np.arange(len(chunk)), chunk)
+                else:
+                    position -= len(chunk) - 1
+                    continue
+
+            if pre_emphasis:
+                chunk, emphasis_state = lfilter([1.0, -pre_emphasis], [1.0], chunk, zi=emphasis_state)
+
+            # overlapping frames, the rest is carried to the next chunk
+            tail = np.concatenate([tail, chunk.astype(np.float32)])
+            if len(tail) >= frame_length:
+                n_frames = (len(tail) - frame_length) // frame_stride + 1
+                frames.append(
+                    np.lib.stride_tricks.as_strided(
+                        tail, shape=(n_frames, frame_length), strides=(frame_stride * 4, 4), writeable=False
+                    ).copy()
+                )
+                tail = tail[n_frames * frame_stride :]
+
+        if not frames:
+            return np.zeros((0, frame_length), dtype=np.float32)
+        return np.concatenate(frames)
+
+    def iterate(self, n_epochs=1):
+        """
+        yields shuffled (batch_size, frame_length) float32 batches.
+        :param n_epochs: the number of passes over the files, None for endless
+        """
+        buffer = np.empty((self.shuffle_buffer, self.frame_length), dtype=np.float32)
+        n_buffered = 0
+
+        def pop_batch():
+            nonlocal n_buffered
+            indices = np.sort(self.rng.choice(n_buffered, self.batch_size, replace=False))[::-1]
+            batch = buffer[indices[::-1]].copy()
+            for idx in indices:  # swap-remove, from the back
+                n_buffered -= 1
+                if idx != n_buffered:
+                    buffer[idx] = buffer[n_buffered]
+            return batch
+
+        epoch = 0
+        with get_context('spawn').Pool(self.n_threads) as pool:  # not forked from the tensorflow-initialized process
+            while n_epochs is None or epoch < n_epochs:
+                start_time, n_frames, n_skipped = time.time(), 0, 0
+
+                files = iter(self.rng.permutation(self.files))
+                pending = deque()
+
+                def submit():
+                    for fn in files:
+                        args = (fn, self.sample_rate, self.frame_length, self.frame_stride, self.pre_emphasis)
+                        pending.append((fn, pool.apply_async(self.decode_frames, args + (self.chunk_size,))))
+                        return
+
+                for _ in range(self.n_threads * 2):
+                    submit()
+
+                while pending:
+                    fn, result = pending.popleft()
+                    submit()
+
+                    try:
+                        frames = result.get()
+                    except Exception as e:  # a broken file never ends the stream
+                        print("[-] failed to decode %s : %s, skipped" % (fn, e))
+                        n_skipped += 1
+                        continue
+
+                    n_frames += len(frames)
+                    while len(frames):
+                        n = min(len(frames), self.shuffle_buffer - n_buffered)
+                        buffer[n_buffered : n_buffered + n] = frames[:n]
+                        n_buffered += n
+                        frames = frames[n:]
+
+                        while n_buffered == self.shuffle_buffer:
+                            yield pop_batch()
+
+                elapsed_time = time.time() - start_time
+                print(
+                    "[+] Epoch %d : %d frames from %d files (%d skipped), %.2f frames/sec"
+                    % (epoch, n_frames, len(self.files) - n_skipped, n_skipped, n_frames / max(elapsed_time, 1e-8))
+                )
+                epoch += 1
+
+        while n_buffered >= self.batch_size:  # flush
+            yield pop_batch()
 
 
 class DataIterator:
-    def __init__(self, x, y, batch_size, label_off=False):
+    def __init__(self, x, y, batch_size, label_off=False, scale=None, dtype=np.float32):
+        """
+        Shuffles only an index array & gathers each batch into a reusable buffer,
+        so the epoch rollover never copies the whole DataSet.
+            - the returned batch is overwritten by the next call, copy it to keep it.
+
+        :param scale: if given ('0,1' or '-1,1'), uint8 x is scaled per batch (lazy scaling)
+        :param dtype: dtype of the scaled batch, float32 or float16
+        """
         self.x = x
+        self.scale = scale
+        self.dtype = dtype
         self.label_off = label_off
         if not self.label_off:
             self.y = y
@@ -943,28 +2576,249 @@ class DataIterator:
 
         assert self.batch_size <= self.num_examples
 
+        self.order = np.arange(self.num_examples)  # the first epoch keeps the DataSet order
+        self.x_buffer = np.empty((self.batch_size,) + tuple(self.x.shape[1:]), dtype=self.x.dtype)
+        if not self.label_off:
+            self.y_buffer = np.empty((self.batch_size,) + tuple(self.y.shape[1:]), dtype=self.y.dtype)
+
+    @staticmethod
+    def gather(data, indices, out):
+        if isinstance(data, (MemmapShardStore, IndexedView)):
+            return data.take(indices, out=out)
+        return np.take(data, indices, axis=0, out=out)
+
     def next_batch(self):
         start = self.pointer
         self.pointer += self.batch_size
 
         if self.pointer > self.num_examples:
-            perm = np.arange(self.num_examples)
-            np.random.shuffle(perm)
-
-            self.x = self.x[perm]
-            if not self.label_off:
-                self.y = self.y[perm]
+            np.random.shuffle(self.order)
 
             start = 0
             self.pointer = self.batch_size
 
         end = self.pointer
 
+        indices = self.order[start:end]
+
+        batch_x = self.gather(self.x, indices, self.x_buffer)
+        if self.scale:
+            batch_x = DataSetLoader.img_scaling(batch_x, self.scale, self.dtype)
+
         if not self.label_off:
-            return self.x[start:end], self.y[start:end]
+            return batch_x, self.gather(self.y, indices, self.y_buffer)
         else:
-            return self.x[start:end]
+            return batch_x
 
     def iterate(self):
         for step in range(self.num_batches):
             yield self.next_batch()
+
+
+class BackgroundPrefetcher:
+    """
+    Base of the iterators which prepare their batches `buffer_size` steps ahead on a worker thread.
+        - subclasses implement prepare(), which returns one ready-to-feed batch.
+        - an exception in prepare() is re-raised on the training thread, by next_batch().
+          after that or close(), next_batch() raises a RuntimeError instead of waiting forever.
+        - n_waits counts how many times the trainer had to wait on the input.
+    """
+
+    def __init__(self, buffer_size=4):
+        """
+        :param buffer_size: the number of batches to prepare ahead, default 4
+        """
+        self.n_batches = 0
+        self.n_waits = 0
+        self.wait_time = 0.0
+
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self.produce, daemon=True)
+        self.worker.start()
+
+    def prepare(self):
+        raise NotImplementedError
+
+    def produce(self):
+        while not self.stop_event.is_set():
+            try:
+                item = self.prepare()
+            except Exception as e:  # re-raised on the training thread
+                item = e
+
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            if isinstance(item, Exception):
+                return
+
+    def get(self):
+        """waits for the next item, as long as the worker is alive"""
+        while True:
+            if self.stop_event.is_set():
+                raise RuntimeError("[-] The prefetcher is closed :(")
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self.worker.is_alive() and self.queue.empty():
+                    raise RuntimeError("[-] The prefetch worker has exited :(")
+
+    def next_batch(self):
+        if self.queue.empty():
+            self.n_waits += 1
+            start_time = time.time()
+            item = self.get()
+            self.wait_time += time.time() - start_time
+        else:
+            item = self.get()
+
+        if isinstance(item, Exception):
+            raise item
+
+        self.n_batches += 1
+        return item
+
+    def iterate(self, num_batches):
+        for step in range(num_batches):
+            yield self.next_batch()
+
+    def stats(self):
+        return "[*] Input waits : %d/%d batches (%.2f%%), %.4fs waited" % (
+            self.n_waits,
+            self.n_batches,
+            100.0 * self.n_waits / max(self.n_batches, 1),
+            self.wait_time,
+        )
+
+    def close(self):
+        self.stop_event.set()
+        self.worker.join()
+
+
+class BatchPrefetcher(BackgroundPrefetcher):
+    """
+    Prepares ready-to-feed float32 batches `buffer_size` steps ahead on a worker thread,
+    so the host-side batch prep (next_batch, reshape, noise sampling) overlaps with s.run.
+        - returns (batch_x, batch_z), or (batch_x, batch_y, batch_z) if next_batch returns labels too.
+
+    Usage
+    prefetcher = BatchPrefetcher(ds_iter.next_batch, z_shape=(batch_size, z_dim))
+    prefetcher = BatchPrefetcher(partial(mnist.train.next_batch, batch_size), z_shape=..., x_shape=(-1, 784))
+    batch_x, batch_z = prefetcher.next_batch()
+    """
+
+    def __init__(
+        self, next_batch, z_shape, x_shape=None, x_transform=None, z_range=(-1.0, 1.0), buffer_size=4, seed=None
+    ):
+        """
+        :param next_batch: callable which returns x or (x, y)
+        :param z_shape: shape of the noise, (batch_size, z_dim)
+        :param x_shape: shape to reshape x into, default None (as it is)
+        :param x_transform: callable applied to x before the reshape, like iu.transform
+        :param z_range: range of the uniform noise, default (-1, 1)
+        :param buffer_size: the number of batches to prepare ahead, default 4
+        :param seed: seed of the noise generator of the worker
+        """
+        self.get_batch = next_batch
+        self.z_shape = z_shape
+        self.x_shape = x_shape
+        self.x_transform = x_transform
+        self.z_range = z_range
+        self.rng = np.random.RandomState(seed)
+
+        super().__init__(buffer_size)
+
+    def prepare(self):
+        batch = self.get_batch()
+        batch_x, batch_y = (batch[0], batch[1]) if isinstance(batch, tuple) else (batch, None)
+
+        if self.x_transform is not None:
+            batch_x = self.x_transform(batch_x)
+        batch_x = np.array(batch_x, dtype=np.float32)  # always a copy, the iterator re-uses its buffer
+        if self.x_shape is not None:
+            batch_x = np.reshape(batch_x, self.x_shape)
+
+        batch_z = self.rng.uniform(self.z_range[0], self.z_range[1], self.z_shape).astype(np.float32)
+
+        if batch_y is None:
+            return batch_x, batch_z
+        return batch_x, np.array(batch_y, dtype=np.float32), batch_z
+
+
+class UnpairedDataIterator(BackgroundPrefetcher):
+    """
+    Unpaired two-domain (A, B) iterator, for CycleGAN/DiscoGAN-like models.
+        - each domain shuffles its own index array, independently, whenever it runs out.
+        - an epoch covers the larger domain, the smaller one just wraps around, so no image is left out.
+        - batches are gathered (& scaled) buffer_size steps ahead on a worker thread.
+
+    Usage
+    ds_iter = UnpairedDataIterator(ds.images_a, ds.images_b, batch_size, x_shape=model.image_shape)
+    for batch_a, batch_b in ds_iter.iterate():
+        ...
+    """
+
+    def __init__(self, x_a, x_b, batch_size, x_shape=None, scale=None, dtype=np.float32, buffer_size=4, seed=None):
+        """
+        :param x_a: domain A images, (N_a, ...) array-like
+        :param x_b: domain B images, (N_b, ...) array-like
+        :param batch_size: the number of images per domain per batch
+        :param x_shape: shape to reshape each batch into, default None (as it is)
+        :param scale: if given ('0,1' or '-1,1'), uint8 images are scaled per batch (lazy scaling)
+        :param dtype: dtype of the scaled batch, float32 or float16
+        :param buffer_size: the number of batches to prepare ahead, default 4
+        :param seed: seed of the shuffling
+        """
+        self.x = (x_a, x_b)
+        self.batch_size = batch_size
+        self.x_shape = x_shape
+        self.scale = scale
+        self.dtype = dtype
+        self.rng = np.random.RandomState(seed)
+
+        self.num_examples = (x_a.shape[0], x_b.shape[0])
+        self.num_batches = max(self.num_examples) // self.batch_size
+
+        try:
+            assert self.batch_size <= min(self.num_examples)
+        except AssertionError:
+            raise AssertionError("[-] batch_size (%d) is larger than a domain %s :(" % (batch_size, self.num_examples))
+
+        self.orders = [self.rng.permutation(n) for n in self.num_examples]
+        self.pointers = [0, 0]
+
+        super().__init__(buffer_size)
+
+    def next_indices(self, domain):
+        start = self.pointers[domain]
+        self.pointers[domain] += self.batch_size
+
+        if self.pointers[domain] > self.num_examples[domain]:
+            self.rng.shuffle(self.orders[domain])
+
+            start = 0
+            self.pointers[domain] = self.batch_size
+
+        return self.orders[domain][start : self.pointers[domain]]
+
+    def prepare(self):
+        batches = []
+        for domain in (0, 1):
+            indices = np.sort(self.next_indices(domain))  # sorted, for the sequential reads of memmap/h5 stores
+            batch = DataIterator.gather(self.x[domain], indices, out=None)
+            if self.scale:
+                batch = DataSetLoader.img_scaling(batch, self.scale, self.dtype)
+            if self.x_shape is not None:
+                batch = np.reshape(batch, self.x_shape)
+            batches.append(batch)
+        return tuple(batches)
+
+    def iterate(self, num_batches=None):
+        """yields (batch_a, batch_b), num_batches times, default an epoch of the larger domain"""
+        for step in range(self.num_batches if num_batches is None else num_batches):
+            yield self.next_batch()
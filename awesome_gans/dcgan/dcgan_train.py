@@ -5,8 +5,10 @@ import tensorflow as tf
 
 import awesome_gans.dcgan.dcgan_model as dcgan
 import awesome_gans.image_utils as iu
+from awesome_gans.datasets import BatchPrefetcher
 from awesome_gans.datasets import CelebADataSet as DataSet
 from awesome_gans.datasets import DataIterator
+from awesome_gans.utils import SampleWriter
 
 results = {'output': './gen_img/', 'model': './model/DCGAN-model.ckpt'}
 
@@ -14,6 +16,8 @@ train_step = {
     'epoch': 25,
     'batch_size': 128,
     'logging_interval': 400,
+    'prefetch_size': 0,  # the number of batches to prepare ahead on a worker thread, 0 to disable
+    'async_sample': False,  # merge & write the samples on a worker thread
 }
 
 
@@ -64,17 +68,47 @@ def main():
         test_images = np.reshape(iu.transform(ds.images[:16], inv_type='127'), (16, 64, 64, 3))
         iu.save_images(test_images, size=[4, 4], image_path=results['output'] + 'sample.png', inv_type='127')
 
-        ds_iter = DataIterator(x=ds.images, y=None, batch_size=train_step['batch_size'], label_off=True)
+        ds_iter = DataIterator(
+            x=ds.images,
+            y=None,
+            batch_size=train_step['batch_size'],
+            label_off=True,
+            scale=ds.batch_img_scale,
+            dtype=ds.batch_img_dtype,
+        )
 
         global_step = saved_global_step
         start_epoch = global_step // (len(ds.train_images) // model.batch_size)  # recover n_epoch
         ds_iter.pointer = saved_global_step % (len(ds.train_images) // model.batch_size)  # recover n_iter
-        for epoch in range(start_epoch, train_step['epoch']):
-            for batch_x in ds_iter.iterate():
-                batch_x = np.reshape(
-                    iu.transform(batch_x, inv_type='127'), (model.batch_size, model.height, model.width, model.channel)
+
+        prefetcher = None
+        if train_step['prefetch_size']:
+            prefetcher = BatchPrefetcher(
+                ds_iter.next_batch,
+                z_shape=(model.batch_size, model.z_dim),
+                x_shape=(model.batch_size, model.height, model.width, model.channel),
+                x_transform=lambda x: iu.transform(x, inv_type='127'),
+                buffer_size=train_step['prefetch_size'],
+            )
+
+        sample_writer = None
+        if train_step['async_sample']:
+            sample_writer = SampleWriter(
+                write_fn=lambda images, fn: iu.save_images(
+                    images, size=[model.sample_size, model.sample_size], image_path=fn, inv_type='127'
                 )
-                batch_z = np.random.uniform(-1.0, 1.0, [model.batch_size, model.z_dim]).astype(np.float32)
+            )
+
+        for epoch in range(start_epoch, train_step['epoch']):
+            for batch in prefetcher.iterate(ds_iter.num_batches) if prefetcher else ds_iter.iterate():
+                if prefetcher:
+                    batch_x, batch_z = batch
+                else:
+                    batch_x = np.reshape(
+                        iu.transform(batch, inv_type='127'),
+                        (model.batch_size, model.height, model.width, model.channel),
+                    )
+                    batch_z = np.random.uniform(-1.0, 1.0, [model.batch_size, model.z_dim]).astype(np.float32)
 
                 # Update D network
                 _, d_loss = s.run([model.d_op, model.d_loss], feed_dict={model.x: batch_x, model.z: batch_z})
@@ -122,15 +156,28 @@ def main():
                     sample_dir = results['output'] + 'train_{0}.png'.format(global_step)
 
                     # Generated image save
-                    iu.save_images(
-                        samples, size=[sample_image_height, sample_image_width], image_path=sample_dir, inv_type='127'
-                    )
+                    if sample_writer:
+                        sample_writer.submit(samples, sample_dir)
+                    else:
+                        iu.save_images(
+                            samples,
+                            size=[sample_image_height, sample_image_width],
+                            image_path=sample_dir,
+                            inv_type='127',
+                        )
 
                     # Model save
                     model.saver.save(s, results['model'], global_step)
 
                 global_step += 1
 
+        if prefetcher:
+            print(prefetcher.stats())
+            prefetcher.close()
+
+        if sample_writer:
+            sample_writer.close()
+
         end_time = time.time() - start_time  # Clocking end
 
         # Elapsed time
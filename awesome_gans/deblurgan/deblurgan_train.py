@@ -64,7 +64,14 @@ def main():
         test_images = np.reshape(iu.transform(ds.images[:16], inv_type='127'), (16, 64, 64, 3))
         iu.save_images(test_images, size=[4, 4], image_path=results['output'] + 'sample.png', inv_type='127')
 
-        ds_iter = DataIterator(x=ds.images, y=None, batch_size=train_step['batch_size'], label_off=True)
+        ds_iter = DataIterator(
+            x=ds.images,
+            y=None,
+            batch_size=train_step['batch_size'],
+            label_off=True,
+            scale=ds.batch_img_scale,
+            dtype=ds.batch_img_dtype,
+        )
 
         global_step = saved_global_step
         start_epoch = global_step // (len(ds.train_images) // model.batch_size)  # recover n_epoch
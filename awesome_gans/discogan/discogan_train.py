@@ -6,6 +6,7 @@ import tensorflow as tf
 import awesome_gans.discogan.discogan_model as discogan
 import awesome_gans.image_utils as iu
 from awesome_gans.datasets import Pix2PixDataSet as DataSets
+from awesome_gans.datasets import UnpairedDataIterator
 
 # import numpy as np
 
@@ -43,16 +44,18 @@ def main():
         # initializing variables
         tf.global_variables_initializer().run()
 
+        # A & B are shuffled independently & prefetched
+        ds_iter = UnpairedDataIterator(
+            dataset.images_a,
+            dataset.images_b,
+            paras['batch_size'],
+            scale=dataset.batch_img_scale,
+            dtype=dataset.batch_img_dtype,
+        )
+
         d_overpowered = False  # G loss > D loss * 2
         for epoch in range(paras['epoch']):
-            for step in range(1000):
-                offset_a = (step * paras['batch_size']) % (dataset.images_a.shape[0] - paras['batch_size'])
-                offset_b = (step * paras['batch_size']) % (dataset.images_b.shape[0] - paras['batch_size'])
-
-                # batch data set
-                batch_a = dataset.images_a[offset_a : (offset_a + paras['batch_size']), :]
-                batch_b = dataset.images_b[offset_b : (offset_b + paras['batch_size']), :]
-
+            for batch_a, batch_b in ds_iter.iterate(1000):
                 # update D network
                 if not d_overpowered:
                     s.run(model.d_op, feed_dict={model.A: batch_a})
@@ -95,6 +98,9 @@ def main():
                     # model save
                     model.saver.save(s, results['model'], global_step=global_step)
 
+        print(ds_iter.stats())
+        ds_iter.close()
+
         end_time = time.time() - start_time
 
         # elapsed time
@@ -41,7 +41,14 @@ def main():
     test_images = np.reshape(iu.transform(ds.images[:16], inv_type='127'), (16, 64, 64, 3))
     iu.save_images(test_images, size=[4, 4], image_path=results['output'] + 'sample.png', inv_type='127')
 
-    ds_iter = DataIterator(x=ds.images, y=None, batch_size=train_step['batch_size'], label_off=True)
+    ds_iter = DataIterator(
+        x=ds.images,
+        y=None,
+        batch_size=train_step['batch_size'],
+        label_off=True,
+        scale=ds.batch_img_scale,
+        dtype=ds.batch_img_dtype,
+    )
 
     # GPU configure
     config = tf.ConfigProto()
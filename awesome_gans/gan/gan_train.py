@@ -1,17 +1,22 @@
 import time
+from functools import partial
 
 import numpy as np
 import tensorflow as tf
 
 import awesome_gans.gan.gan_model as gan
 import awesome_gans.image_utils as iu
+from awesome_gans.datasets import BatchPrefetcher
 from awesome_gans.datasets import MNISTDataSet as DataSet
+from awesome_gans.utils import SampleWriter
 
 results = {'output': './gen_img/', 'model': './model/GAN-model.ckpt'}
 
 train_step = {
     'global_step': 200001,
     'logging_interval': 1000,
+    'prefetch_size': 0,  # the number of batches to prepare ahead on a worker thread, 0 to disable
+    'async_sample': False,  # merge & write the samples on a worker thread
 }
 
 
@@ -43,12 +48,32 @@ def main():
         else:
             print('[-] No checkpoint file found')
 
+        prefetcher = None
+        if train_step['prefetch_size']:
+            prefetcher = BatchPrefetcher(
+                partial(mnist.train.next_batch, model.batch_size),
+                z_shape=(model.batch_size, model.z_dim),
+                x_shape=(-1, model.n_input),
+                buffer_size=train_step['prefetch_size'],
+            )
+
+        sample_writer = None
+        if train_step['async_sample']:
+            sample_writer = SampleWriter(
+                write_fn=lambda images, fn: iu.save_images(
+                    images, size=[model.sample_size, model.sample_size], image_path=fn
+                )
+            )
+
         d_loss = 0.0
         d_overpowered = False
         for global_step in range(saved_global_step, train_step['global_step']):
-            batch_x, _ = mnist.train.next_batch(model.batch_size)
-            batch_x = batch_x.reshape(-1, model.n_input)
-            batch_z = np.random.uniform(-1.0, 1.0, size=[model.batch_size, model.z_dim]).astype(np.float32)
+            if prefetcher:
+                batch_x, _, batch_z = prefetcher.next_batch()
+            else:
+                batch_x, _ = mnist.train.next_batch(model.batch_size)
+                batch_x = batch_x.reshape(-1, model.n_input)
+                batch_z = np.random.uniform(-1.0, 1.0, size=[model.batch_size, model.z_dim]).astype(np.float32)
 
             # Update D network
             if not d_overpowered:
@@ -112,11 +137,21 @@ def main():
                 sample_dir = results['output'] + 'train_{:08d}.png'.format(global_step)
 
                 # Generated image save
-                iu.save_images(samples, size=[sample_image_height, sample_image_width], image_path=sample_dir)
+                if sample_writer:
+                    sample_writer.submit(samples, sample_dir)
+                else:
+                    iu.save_images(samples, size=[sample_image_height, sample_image_width], image_path=sample_dir)
 
                 # Model save
                 model.saver.save(s, results['model'], global_step)
 
+        if prefetcher:
+            print(prefetcher.stats())
+            prefetcher.close()
+
+        if sample_writer:
+            sample_writer.close()
+
     end_time = time.time() - start_time  # Clocking end
 
     # Elapsed time
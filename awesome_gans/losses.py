@@ -11,6 +11,19 @@ def generator_wgan_loss(fake: tf.Tensor):
     return -tf.reduce_mean(fake)
 
 
+def scale_replica_loss(loss: tf.Tensor) -> tf.Tensor:
+    """the per-replica mean loss over the number of replicas in sync.
+    the gradients are summed across the replicas, so the scaled ones add up to the gradients of the global batch mean,
+    and summing the scaled losses (strategy.reduce(SUM, ...)) gives the global batch loss.
+    a no-op (/ 1) without a strategy.
+    """
+    context = tf.distribute.get_replica_context()  # None in the cross-replica context
+    if context is None:  # assigned without an annotation, autograph can't convert the annotated ones
+        context = tf.distribute.get_strategy()
+    n_replicas: int = context.num_replicas_in_sync
+    return loss / tf.cast(n_replicas, loss.dtype)
+
+
 @tf.function
 def discriminator_loss(loss_func: str, real: tf.Tensor, fake: tf.Tensor, use_ra: bool = False):
     real_loss: float = 0.0
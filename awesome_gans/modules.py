@@ -41,6 +41,14 @@ def lerp_clip(a, b, t):
         return a + (b - a) * tf.clip_by_value(t, 0.0, 1.0)
 
 
+def broadcast_labels(x, y):
+    """concatenates (N, n_attrs) labels onto (N, H, W, C) images, broadcasting them per batch in the graph"""
+    with tf.name_scope("broadcast_labels"):
+        y = tf.reshape(tf.cast(y, x.dtype), [-1, 1, 1, int(y.get_shape()[-1])])
+        y = y * tf.ones_like(x[:, :, :, :1])  # (N, H, W, n_attrs)
+        return tf.concat([x, y], axis=3)
+
+
 def gaussian_noise(x, std=5e-2):
     noise = tf.random_normal(x.get_shape(), mean=0.0, stddev=std, dtype=tf.float32)
     return x + noise
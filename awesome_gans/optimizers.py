@@ -1,3 +1,4 @@
+import tensorflow as tf
 from tensorflow.keras.optimizers import SGD, Adam, RMSprop
 
 
@@ -14,3 +15,15 @@ def build_optimizer(config, optimizer_name: str = 'adam'):
         return SGD(learning_rate=config.d_lr)
     else:
         raise NotImplementedError()
+
+
+def build_loss_scale_optimizer(optimizer, policy='float32'):
+    """dynamic loss scaling for every policy which computes in fp16,
+    bf16 has the exponent range of fp32 & doesn't need it.
+    :param policy: keras mixed-precision policy (or its name) of the model the optimizer trains.
+    """
+    if isinstance(policy, str):
+        policy = tf.keras.mixed_precision.Policy(policy)
+    if policy.compute_dtype == 'float16':
+        return tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    return optimizer
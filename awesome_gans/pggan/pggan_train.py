@@ -1,18 +1,23 @@
+import os
 import random
 import time
 
 import numpy as np
 import tensorflow as tf
-from scipy.ndimage import zoom
-from skimage.transform import resize
 
 import awesome_gans.image_utils as iu
 import awesome_gans.pggan.pggan_model as pggan
 from awesome_gans.datasets import CelebADataSet as DataSet
-from awesome_gans.datasets import DataIterator
+from awesome_gans.datasets import DataSetLoader, MemmapShardStore, PyramidDataSet
 
 results = {'output': './gen_img/', 'checkpoint': './model/checkpoint-', 'model': './model/PGGAN-model-'}
 
+ds_path = "/home/zero/hdd/DataSet/CelebA-HQ"
+# uint8 MemmapShardStore of the decrypted 1024x1024 images (DataSetLoader's 'to_mmap'), opened in O(1)
+ds_image_path = os.path.join(ds_path, "CelebA-HQ-1024-mmap")
+ds_label_path = "/home/zero/hdd/DataSet/CelebA/Anno/list_attr_celeba.txt"
+pyramid_path = os.path.join(ds_path, "pyramid")  # 4x4 ~ 1024x1024 levels, built at the first run
+
 train_step = {
     'epoch': 10000,
     'batch_size': 16,
@@ -26,30 +31,32 @@ r_pg = [1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6]
 assert len(r_pg) == 11
 
 
-def image_resize(x, s=128):
-    imgs = []
-    for i in range(x.shape[0]):
-        imgs.append(resize(x[i, :, :, :], output_shape=(s, s), preserve_range=True))
-    return np.asarray(imgs)
-
-
 def main():
     start_time = time.time()  # Clocking start
 
-    # Celeb-A DataSet images
-    ds = DataSet(
-        input_height=1024,
-        input_width=1024,
-        input_channel=3,
-        ds_type="CelebA-HQ",
-        ds_path="/home/zero/hdd/DataSet/CelebA-HQ",
-    ).images
-    n_ds = 30000
-    dataset_iter = DataIterator(ds, None, train_step['batch_size'], label_off=True)
-
-    rnd = random.randint(0, n_ds)
-    sample_x = ds[rnd]
-    sample_x = np.reshape(sample_x, [-1, 1024, 1024, 3])
+    # Celeb-A DataSet images, every level of detail is pre-computed once, from uint8 (nothing is scaled up front)
+    if not os.path.exists(pyramid_path):
+        images = DataSet(
+            height=1024,
+            width=1024,
+            channel=3,
+            ds_image_path=ds_image_path,
+            ds_label_path=ds_label_path,
+            ds_type="CelebA-HQ",
+            use_img_scale=False,
+        ).images
+        if isinstance(images, MemmapShardStore):  # (N, H * W * C) shards, viewed as (N, H, W, C)
+            images = MemmapShardStore(images.path, sample_shape=(1024, 1024, 3))
+        else:
+            images = np.reshape(images, [-1, 1024, 1024, 3])
+        PyramidDataSet.write(pyramid_path, images)
+        del images
+
+    ds = PyramidDataSet(pyramid_path, batch_size=train_step['batch_size'])
+    n_ds = ds.num_examples
+
+    rnd = random.randint(0, n_ds - 1)
+    sample_x = DataSetLoader.img_scaling(ds.levels[1024][rnd : rnd + 1], '-1,1', np.float32)
 
     # Export real image
     valid_image_height = 1
@@ -87,19 +94,12 @@ def main():
             global_step = 0
             for epoch in range(train_step['epoch']):
                 # Later, adding n_critic for optimizing D net
-                for batch_images in dataset_iter.iterate():
-                    batch_x = np.reshape(batch_images, (-1, 128, 128, 3))
-                    batch_x = (batch_x + 1.0) * 127.5  # re-scaling to (0, 255)
-                    batch_x = image_resize(batch_x, s=model.output_size)
-                    batch_x = (batch_x / 127.5) - 1.0  # re-scaling to (-1, 1)
+                for _ in range(n_ds // train_step['batch_size']):
+                    # fading in from the lower level, the same schedule as alpha_trans
+                    alpha = min(global_step / 32000.0, 1.0) if pg_t else None
+                    batch_x = ds.next_batch(model.output_size, alpha=alpha)
                     batch_z = np.random.uniform(-1.0, 1.0, [model.batch_size, model.z_dim]).astype(np.float32)
 
-                    if pg_t and not pg == 0:
-                        alpha = global_step / 32000.0
-                        low_batch_x = zoom(batch_x, zoom=[1.0, 0.5, 0.5, 1.0])
-                        low_batch_x = zoom(low_batch_x, zoom=[1.0, 2.0, 2.0, 1.0])
-                        batch_x = alpha * batch_x + (1.0 - alpha) * low_batch_x
-
                     # Update D network
                     _, d_loss = s.run(
                         [model.d_op, model.d_loss],
@@ -5,22 +5,20 @@ import tensorflow as tf
 
 import awesome_gans.image_utils as iu
 import awesome_gans.segan.segan_model as segan
-from awesome_gans.datasets import MNISTDataSet
+from awesome_gans.datasets import UrbanSoundDataSet
 
 results = {'output': './gen_img/', 'checkpoint': './model/checkpoint', 'model': './model/SEGAN-model.ckpt'}
 
 train_step = {
     'global_step': 150001,
     'logging_interval': 1500,
+    'ds_path': 'D:/DataSet/UrbanSound8K/audio/',
 }
 
 
 def main():
     start_time = time.time()  # Clocking start
 
-    # UrbanSound8K Dataset load
-    mnist = MNISTDataSet().data
-
     # GPU configure
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True
@@ -32,22 +30,24 @@ def main():
         # Initializing
         s.run(tf.global_variables_initializer())
 
-        sample_x, _ = mnist.test.next_batch(model.sample_num)
-        sample_y = np.zeros(shape=[model.sample_num, model.n_classes])
-        for i in range(10):
-            sample_y[10 * i : 10 * (i + 1), i] = 1
+        # UrbanSound8K Dataset load, streamed as 50% overlapped frames of the model's input size
+        ds = UrbanSoundDataSet(
+            ds_path=train_step['ds_path'],
+            frame_length=model.n_input,
+            frame_stride=model.n_input // 2,
+            batch_size=model.batch_size,
+        )
+        ds_iter = ds.iterate(n_epochs=None)
 
         for step in range(train_step['global_step']):
-            batch_x, batch_y = mnist.train.next_batch(model.batch_size)
-            batch_x = np.reshape(batch_x, model.image_shape)
+            batch_x = np.reshape(next(ds_iter), model.image_shape)
             batch_z = np.random.uniform(-1.0, 1.0, [model.batch_size, model.z_dim]).astype(np.float32)
 
             # Update D network
             _, d_loss = s.run(
                 [model.d_op, model.d_loss],
                 feed_dict={
-                    model.x_1: batch_x,
-                    model.x_2: batch_x,
+                    model.x: batch_x,
                     # model.y: batch_y,
                     model.z: batch_z,
                 },
@@ -57,23 +57,20 @@ def main():
             _, g_loss = s.run(
                 [model.g_op, model.g_loss],
                 feed_dict={
-                    model.x_1: batch_x,
-                    model.x_2: batch_x,
+                    model.x: batch_x,
                     # model.y: batch_y,
                     model.z: batch_z,
                 },
             )
 
             if step % train_step['logging_interval'] == 0:
-                batch_x, batch_y = mnist.train.next_batch(model.batch_size)
-                batch_x = np.reshape(batch_x, model.image_shape)
+                batch_x = np.reshape(next(ds_iter), model.image_shape)
                 batch_z = np.random.uniform(-1.0, 1.0, [model.batch_size, model.z_dim]).astype(np.float32)
 
                 d_loss, g_loss, summary = s.run(
                     [model.d_loss, model.g_loss, model.merged],
                     feed_dict={
-                        model.x_1: batch_x,
-                        model.x_2: batch_x,
+                        model.x: batch_x,
                         # model.y: batch_y,
                         model.z: batch_z,
                     },
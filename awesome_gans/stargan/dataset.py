@@ -6,6 +6,8 @@ import numpy as np
 from scipy.misc import imread, imresize
 from tqdm import tqdm
 
+from awesome_gans.datasets import load_celeba_attr
+
 '''
 This dataset is for Celeb-A
 
@@ -183,26 +185,13 @@ class CelebADataSet:
         return faces / 255.0
 
     def load_attr(self):
-        with open(DataSets['celeb-a-attr'], 'r') as f:
-            img_attr = []
-
-            self.num_images = int(f.readline().strip())
-            self.attr = (f.readline().strip()).split(' ')
-
-            print("[*] the number of images     : %d" % self.num_images)
-            print("[*] the number of attributes : %d/%d" % (len(self.attr_labels), len(self.attr)))
-
-            for fn in f.readlines():
-                row = fn.strip().split()
-                # img_name = row[0]
-                attr = [int(x) for x in row[1:]]
-
-                tmp = [attr[self.attr.index(x)] for x in self.attr_labels]
-                tmp = [1.0 if x == 1 else 0.0 for x in tmp]  # one-hot labeling
+        self.num_images, self.attr, table = load_celeba_attr(DataSets['celeb-a-attr'])
 
-                img_attr.append(tmp)
+        print("[*] the number of images     : %d" % self.num_images)
+        print("[*] the number of attributes : %d/%d" % (len(self.attr_labels), len(self.attr)))
 
-            return np.asarray(img_attr)
+        columns = [self.attr.index(x) for x in self.attr_labels]
+        return (table[:, columns] == 1).astype(np.float32)  # one-hot labeling
 
     def concat_data(self, img, label):
         label = np.tile(
@@ -225,27 +214,33 @@ class DataIterator:
 
         assert self.batch_size <= self.num_examples
 
+        # shuffling only the indices, each batch is gathered into a reusable buffer
+        self.order = np.arange(self.num_examples)
+        self.x_buffer = np.empty((self.batch_size,) + tuple(self.x.shape[1:]), dtype=self.x.dtype)
+        if not self.label_off:
+            self.y_buffer = np.empty((self.batch_size,) + tuple(self.y.shape[1:]), dtype=self.y.dtype)
+
     def next_batch(self):
         start = self.pointer
         self.pointer += self.batch_size
 
         if self.pointer > self.num_examples:
-            perm = np.arange(self.num_examples)
-            np.random.shuffle(perm)
-
-            self.x = self.x[perm]
-            if not self.label_off:
-                self.y = self.y[perm]
+            np.random.shuffle(self.order)
 
             start = 0
             self.pointer = self.batch_size
 
         end = self.pointer
 
+        indices = self.order[start:end]
+
         if not self.label_off:
-            return self.x[start:end], self.y[start:end]
+            return (
+                np.take(self.x, indices, axis=0, out=self.x_buffer),
+                np.take(self.y, indices, axis=0, out=self.y_buffer),
+            )
         else:
-            return self.x[start:end]
+            return np.take(self.x, indices, axis=0, out=self.x_buffer)
 
     def iterate(self):
         for step in range(self.num_batches):
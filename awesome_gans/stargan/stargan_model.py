@@ -34,6 +34,7 @@ class StarGAN:
         gf_dim=64,
         g_lr=1e-4,
         d_lr=1e-4,
+        use_label_broadcast=False,
     ):
 
         """
@@ -58,6 +59,8 @@ class StarGAN:
         # Training Option
         :param g_lr: generator learning rate, default 1e-4
         :param d_lr: discriminator learning rate, default 1e-4
+        :param use_label_broadcast: feed images & (N, n_attrs) labels (y_A, y_B) separately,
+            labels are broadcast onto the images in the graph instead of being tiled by the DataSet
         """
 
         self.s = s
@@ -80,6 +83,7 @@ class StarGAN:
 
         self.d_lr = d_lr
         self.g_lr = g_lr
+        self.use_label_broadcast = use_label_broadcast
 
         self.lambda_cls = 1.0  #
         self.lambda_rec = 10.0  #
@@ -95,12 +99,17 @@ class StarGAN:
         self.d_loss = 0.0
 
         # Placeholders
-        self.x_A = tf.placeholder(
-            tf.float32, shape=[None, self.height, self.width, self.channel + self.n_classes], name='x-image-A'
-        )  # input image
-        self.x_B = tf.placeholder(
-            tf.float32, shape=[None, self.height, self.width, self.channel + self.n_classes], name='x-image-B'
-        )  # target image
+        if self.use_label_broadcast:
+            self.x_A = tf.placeholder(tf.float32, shape=self.image_shape, name='x-image-A')  # input image
+            self.y_A = tf.placeholder(tf.float32, shape=[None, self.n_classes], name='y-label-A')
+            self.x_B = tf.placeholder(tf.float32, shape=self.image_shape, name='x-image-B')  # target image
+        else:
+            self.x_A = tf.placeholder(
+                tf.float32, shape=[None, self.height, self.width, self.channel + self.n_classes], name='x-image-A'
+            )  # input image
+            self.x_B = tf.placeholder(
+                tf.float32, shape=[None, self.height, self.width, self.channel + self.n_classes], name='x-image-B'
+            )  # target image
         self.fake_x_B = tf.placeholder(tf.float32, shape=self.image_shape, name='x-image-fake-B')
         self.y_B = tf.placeholder(tf.float32, shape=[None, self.n_classes], name='y-label-B')
 
@@ -194,13 +203,17 @@ class StarGAN:
             gradient_penalty = tf.reduce_mean(tf.square(slopes - 1.0))
             return gradient_penalty
 
-        x_img_a = self.x_A[:, :, :, : self.channel]
-        x_attr_a = self.x_A[:, :, :, self.channel :]
-        x_img_b = self.x_B[:, :, :, : self.channel]
-        # x_attr_b = self.x_B[:, :, :, self.channel:]
+        # images & labels, (N, H, W, C + n_classes)
+        x_a = t.broadcast_labels(self.x_A, self.y_A) if self.use_label_broadcast else self.x_A
+        x_b = t.broadcast_labels(self.x_B, self.y_B) if self.use_label_broadcast else self.x_B
+
+        x_img_a = x_a[:, :, :, : self.channel]
+        x_attr_a = x_a[:, :, :, self.channel :]
+        x_img_b = x_b[:, :, :, : self.channel]
+        # x_attr_b = x_b[:, :, :, self.channel:]
 
         # Generator
-        self.fake_B = self.generator(self.x_A)
+        self.fake_B = self.generator(x_a)
         gen_in = tf.concat([self.fake_B, x_attr_a], axis=3)
         self.fake_A = self.generator(gen_in, reuse=True)
 
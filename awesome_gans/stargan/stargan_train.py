@@ -13,6 +13,7 @@ train_step = {
     'epoch': 100,
     'batch_size': 32,
     'logging_step': 500,
+    'use_label_broadcast': True,  # broadcast labels in the graph, instead of tiling them per batch
 }
 
 
@@ -39,7 +40,9 @@ def main():
         ]
 
         # StarGAN Model
-        model = stargan.StarGAN(s, attr_labels=attr_labels)  # StarGAN
+        model = stargan.StarGAN(
+            s, attr_labels=attr_labels, use_label_broadcast=train_step['use_label_broadcast']
+        )  # StarGAN
 
         # Initializing
         s.run(tf.global_variables_initializer())
@@ -110,19 +113,23 @@ def main():
                 x_a = iu.transform(x_a, inv_type='127')
                 x_b = iu.transform(x_b, inv_type='127')
 
-                batch_a = ds.concat_data(x_a, y_a)
-                batch_b = ds.concat_data(x_b, y_b)
+                if train_step['use_label_broadcast']:
+                    feed_a = {model.x_A: x_a, model.y_A: y_a}
+                    feed_b = {model.x_B: x_b}
+                else:
+                    feed_a = {model.x_A: ds.concat_data(x_a, y_a)}
+                    feed_b = {model.x_B: ds.concat_data(x_b, y_b)}
                 eps = np.random.rand(train_step['batch_size'], 1, 1, 1)
 
                 # Generate fake_B
-                fake_b = s.run(model.fake_B, feed_dict={model.x_A: batch_a})
+                fake_b = s.run(model.fake_B, feed_dict=feed_a)
 
                 # Update D network - 5 times
                 for _ in range(5):
                     _, d_loss = s.run(
                         [model.d_op, model.d_loss],
                         feed_dict={
-                            model.x_B: batch_b,
+                            **feed_b,
                             model.y_B: y_b,
                             model.fake_x_B: fake_b,
                             model.lr_decay: lr_decay,
@@ -134,8 +141,8 @@ def main():
                 _, g_loss = s.run(
                     [model.g_op, model.g_loss],
                     feed_dict={
-                        model.x_A: batch_a,
-                        model.x_B: batch_b,
+                        **feed_a,
+                        **feed_b,
                         model.y_B: y_b,
                         model.lr_decay: lr_decay,
                         model.epsilon: eps,
@@ -149,8 +156,8 @@ def main():
                     samples, d_loss, g_loss, summary = s.run(
                         [model.fake_A, model.d_loss, model.g_loss, model.merged],
                         feed_dict={
-                            model.x_A: batch_a,
-                            model.x_B: batch_b,
+                            **feed_a,
+                            **feed_b,
                             model.y_B: y_b,
                             model.fake_x_B: fake_b,
                             model.lr_decay: lr_decay,
@@ -1,6 +1,8 @@
 import os
+import queue
 import random
-from typing import Optional, Union
+import threading
+from typing import Callable, Optional, Union
 
 import cv2
 import numpy as np
@@ -26,6 +28,67 @@ def set_seed(seed: int):
     tf.random.set_seed(seed)
 
 
+def build_function(fn: Callable, jit_compile: bool = False) -> Callable:
+    """tf.function of fn, XLA-compiled (fused into clusters) if jit_compile.
+    jit_compile is an argument of tf.function since tf 2.5, experimental_compile before.
+    """
+    if not jit_compile:
+        return tf.function(fn)
+
+    try:
+        return tf.function(fn, jit_compile=True)
+    except TypeError:
+        return tf.function(fn, experimental_compile=True)
+
+
+def build_strategy(strategy: str = 'none', n_cpu_devices: int = 1) -> tf.distribute.Strategy:
+    """data-parallel strategy, call it at first (before any other tf op).
+    - none         : the default (single device) strategy
+    - mirrored     : synchronous replicas on the local GPUs, or on n_cpu_devices logical CPUs if there's no GPU
+    - multi_worker : synchronous replicas across the processes listed in TF_CONFIG, e.g. on localhost
+        TF_CONFIG='{"cluster": {"worker": ["localhost:12345", "localhost:12346"]}, "task": {"type": "worker", "index": 0}}'
+    :param strategy: type of the strategy.
+    :param n_cpu_devices: number of logical CPU devices the CPU is split into.
+    """
+    if n_cpu_devices > 1:
+        cpus = tf.config.list_physical_devices('CPU')
+        tf.config.set_logical_device_configuration(
+            cpus[0], [tf.config.LogicalDeviceConfiguration() for _ in range(n_cpu_devices)]
+        )
+
+    if strategy == 'none':
+        return tf.distribute.get_strategy()
+    elif strategy == 'mirrored':
+        if tf.config.list_physical_devices('GPU'):
+            return tf.distribute.MirroredStrategy()
+
+        # no NCCL on CPU, the gradients are all-reduced on one device
+        devices = [device.name for device in tf.config.list_logical_devices('CPU')]
+        return tf.distribute.MirroredStrategy(devices, cross_device_ops=tf.distribute.ReductionToOneDevice())
+    elif strategy == 'multi_worker':
+        try:
+            return tf.distribute.MultiWorkerMirroredStrategy()
+        except AttributeError:  # tf < 2.4
+            return tf.distribute.experimental.MultiWorkerMirroredStrategy()
+    else:
+        raise ValueError(f'[-] unknown strategy {strategy}')
+
+
+def is_chief(strategy: tf.distribute.Strategy) -> bool:
+    """the worker which writes the checkpoints, samples & logs (the only one, without multi_worker)."""
+    cluster_resolver = getattr(strategy, 'cluster_resolver', None)
+    if cluster_resolver is None or not cluster_resolver.task_type:
+        return True
+
+    if cluster_resolver.task_type == 'chief':
+        return True
+    return (
+        cluster_resolver.task_type == 'worker'
+        and cluster_resolver.task_id == 0
+        and 'chief' not in cluster_resolver.cluster_spec().as_dict()
+    )
+
+
 def normalize_image(images):
     return (images / 127.5) - 1.0
 
@@ -96,3 +159,84 @@ def save_image(image: Union[np.ndarray, tf.Tensor], fn: str, is_rgb: bool = True
         save_numpy_image(image, fn, is_rgb)
     else:
         raise NotImplementedError()
+
+
+class SampleWriter:
+    """Writes the generated samples on a worker thread, off the training loop.
+    host transfer, grid merge, encoding & disk write happen on the worker, the trainer only enqueues.
+     - at most max_pending samples wait in the queue. when it's full, the oldest pending one is dropped,
+       so the latest samples are kept & the optimizer never stalls on the disk.
+
+    Usage
+    writer = SampleWriter(n_rows=10)
+    writer.submit(self.generate_samples(z_samples), os.path.join(output_path, f'{epoch}.png'))
+    writer.close()  # flushes the pending samples
+    """
+
+    def __init__(self, n_rows: Optional[int] = None, max_pending: int = 2, write_fn: Optional[Callable] = None):
+        """
+        :param n_rows: number of image per row of the grid, squared if None.
+        :param max_pending: number of samples to keep in the queue.
+        :param write_fn: callable (images, fn) which writes the samples,
+            default merges [-1, 1] images into a grid & saves it.
+        """
+        self.n_rows = n_rows
+        self.write_fn = write_fn if write_fn is not None else self.write_grid
+
+        self.n_written: int = 0
+        self.n_dropped: int = 0
+        self.closed: bool = False
+
+        self.queue = queue.Queue(maxsize=max(max_pending, 1))
+        self.worker = threading.Thread(target=self.consume, daemon=True)
+        self.worker.start()
+
+    def write_grid(self, images: Union[np.ndarray, tf.Tensor], fn: str):
+        save_numpy_image(merge_images(images, n_rows=self.n_rows), fn, is_rgb=True)
+
+    def consume(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            images, fn = item
+            try:
+                self.write_fn(images, fn)
+                self.n_written += 1
+            except Exception as e:  # never kills the worker
+                print(f'[-] failed to write {fn} : {e}')
+
+    def submit(self, images: Union[np.ndarray, tf.Tensor], fn: str) -> bool:
+        """enqueues the samples without blocking.
+        :return: False if an older pending sample is dropped to make room.
+        """
+        if self.closed:  # nothing would consume them
+            raise RuntimeError(f'[-] the sample writer is closed, {fn} is not written')
+
+        dropped: bool = False
+        while True:
+            try:
+                self.queue.put_nowait((images, fn))
+                return not dropped
+            except queue.Full:
+                try:
+                    stale = self.queue.get_nowait()
+                    if stale is None:  # closed, keeps the sentinel
+                        self.queue.put_nowait(stale)
+                        return False
+                    self.n_dropped += 1
+                    dropped = True
+                except queue.Empty:  # the worker just took it
+                    pass
+
+    def close(self):
+        """writes the pending samples & stops the worker."""
+        if self.closed:
+            return
+        self.closed = True
+
+        self.queue.put(None)
+        self.worker.join()
+
+        print(f'[*] samples written : {self.n_written}, dropped : {self.n_dropped}')
@@ -1,7 +1,7 @@
 import tensorflow as tf
 
 from awesome_gans.data import TFDatasets
-from awesome_gans.utils import initialize, set_seed
+from awesome_gans.utils import build_strategy, initialize, set_seed
 from awesome_gans.wgan.config import get_config
 from awesome_gans.wgan.model import WGAN
 
@@ -9,18 +9,27 @@ from awesome_gans.wgan.model import WGAN
 def main():
     config = get_config()
 
+    # data-parallel strategy, before any other tf op
+    strategy: tf.distribute.Strategy = build_strategy(config.strategy, config.n_cpu_devices)
+
     # initial tf settings
     initialize()
 
     # reproducibility
     set_seed(config.seed)
 
-    # load the data
-    dataset: tf.data.Dataset = TFDatasets(config).load_dataset(use_label=False)
+    # load the data, split for the replicas & counted in global steps per epoch
+    datasets = TFDatasets(config)
+    if config.strategy == 'none':
+        dataset = datasets.load_dataset(use_label=False)
+        steps_per_epoch = None
+    else:
+        dataset = datasets.load_distributed_dataset(strategy, use_label=False)
+        steps_per_epoch = datasets.get_steps_per_epoch()
 
     if config.mode == 'train':
-        model = WGAN(config)
-        model.train(dataset)
+        model = WGAN(config, strategy)
+        model.train(dataset, steps_per_epoch)
     elif config.mode == 'inference':
         pass
     else:
@@ -1,7 +1,7 @@
-from awesome_gans.config import parse_args
+from awesome_gans.config import parse_args, str2bool
 
 
-def get_config():
+def build_parser():
     parser = parse_args()
 
     # Model
@@ -22,9 +22,45 @@ def get_config():
     parser.add_argument('--d_loss', default='wgan', type=str)
     parser.add_argument('--g_loss', default='wgan', type=str)
     parser.add_argument('--grad_clip', default=1e-2, type=float)
+    parser.add_argument(
+        '--clip_mode',
+        default='constraint',
+        type=str,
+        choices=['constraint', 'loop'],
+        help='constraint: clipped within the optimizer update, loop: clipped variable by variable after it',
+    )
     parser.add_argument(
         '--n_critics', default=5, type=int, help='number of times to train critic(discriminator) per 1-iter generator'
     )
     parser.add_argument('--z_dims', default=128, type=int, help='batch size')
+    parser.add_argument(
+        '--fused_step', type=str2bool, default=False, help='run the critic & generator updates in one graph call'
+    )
+    parser.add_argument(
+        '--fresh_critic_batches',
+        type=str2bool,
+        default=False,
+        help='with fused_step, a new real batch for every critic update (n_critics batches per step)',
+    )
+    parser.add_argument(
+        '--precision',
+        default='fp32',
+        type=str,
+        choices=['fp32', 'bf16', 'mixed_bf16', 'mixed_fp16'],
+        help='precision of the networks, the losses & weight clipping stay in fp32 (tf >= 2.4)',
+    )
 
-    return parser.parse_args()
+    # Checkpoint
+    parser.add_argument('--max_to_keep', default=5, type=int, help='number of the latest checkpoints to keep')
+    parser.add_argument(
+        '--keep_every_n_hours', default=0.0, type=float, help='also keep a checkpoint every n hours, 0 to disable'
+    )
+    parser.add_argument(
+        '--async_checkpoint', type=str2bool, default=True, help='write the checkpoints on a background thread'
+    )
+
+    return parser
+
+
+def get_config():
+    return build_parser().parse_args()
@@ -1,14 +1,19 @@
 import os
+import shutil
+import tempfile
+import time
+from typing import Optional
 
 import tensorflow as tf
+from tensorflow.keras.constraints import Constraint
 from tensorflow.keras.layers import (
+    Activation,
     BatchNormalization,
     Conv2D,
     Conv2DTranspose,
     Dense,
     Flatten,
     Input,
-    Layer,
     LeakyReLU,
     ReLU,
     Reshape,
@@ -16,14 +21,51 @@ from tensorflow.keras.layers import (
 from tensorflow.keras.models import Model
 from tqdm import tqdm
 
-from awesome_gans.losses import discriminator_loss, generator_loss, discriminator_wgan_loss, generator_wgan_loss
-from awesome_gans.optimizers import build_optimizer
-from awesome_gans.utils import merge_images, save_image
+from awesome_gans.data import TFDatasets
+from awesome_gans.losses import (
+    discriminator_loss,
+    generator_loss,
+    discriminator_wgan_loss,
+    generator_wgan_loss,
+    scale_replica_loss,
+)
+from awesome_gans.optimizers import build_loss_scale_optimizer, build_optimizer
+from awesome_gans.utils import SampleWriter, build_function, is_chief
+
+
+class WeightClip(Constraint):
+    """clips the weights into [-clip_value, clip_value].
+    the optimizer applies it right after each variable's update, so no separate clipping pass is needed.
+    """
+
+    def __init__(self, clip_value: float = 1e-2):
+        self.clip_value = clip_value
+
+    def __call__(self, w: tf.Tensor) -> tf.Tensor:
+        if w.dtype == tf.float32:
+            return tf.clip_by_value(w, -self.clip_value, self.clip_value)
+        # low-precision (bf16) weights are clipped in fp32, then cast back
+        return tf.cast(tf.clip_by_value(tf.cast(w, tf.float32), -self.clip_value, self.clip_value), w.dtype)
+
+    def get_config(self) -> dict:
+        return {'clip_value': self.clip_value}
 
 
 class WGAN:
-    def __init__(self, config):
+    precision_policies = {
+        'fp32': 'float32',
+        'bf16': 'bfloat16',  # bf16 variables too
+        'mixed_bf16': 'mixed_bfloat16',  # fp32 variables, bf16 compute
+        'mixed_fp16': 'mixed_float16',  # fp32 variables, fp16 compute, loss scaling
+    }
+
+    def __init__(self, config, strategy: Optional[tf.distribute.Strategy] = None):
+        """
+        :param config: wgan config.
+        :param strategy: data-parallel strategy (utils.build_strategy), the default (single device) one if None.
+        """
         self.config = config
+        self.strategy: tf.distribute.Strategy = strategy if strategy is not None else tf.distribute.get_strategy()
 
         self.bs: int = self.config.bs
         self.n_samples: int = self.config.n_samples
@@ -37,125 +79,344 @@ class WGAN:
         self.z_dims: int = self.config.z_dims
         self.n_critics: int = self.config.n_critics
         self.grad_clip: float = self.config.grad_clip
+        self.clip_mode: str = self.config.clip_mode
+        self.fused_step: bool = self.config.fused_step
+        self.fresh_critic_batches: bool = self.config.fresh_critic_batches
+        self.precision: str = self.config.precision
+        # passed to every layer, the global policy is left as it is
+        self.policy = tf.keras.mixed_precision.Policy(self.precision_policies[self.precision])
+        self.jit_compile: bool = self.config.jit_compile
 
         self.model_path: str = self.config.model_path
         self.output_path: str = self.config.output_path
+        self.max_to_keep: int = self.config.max_to_keep
+        self.keep_every_n_hours: float = self.config.keep_every_n_hours
+        self.async_checkpoint: bool = self.config.async_checkpoint
+        self.seed: int = self.config.seed
         self.verbose: bool = self.config.verbose
 
-        self.discriminator: tf.keras.Model = self.build_discriminator()
-        self.generator: tf.keras.Model = self.build_generator()
-
-        self.d_opt: tf.keras.optimizers = build_optimizer(config, config.d_opt)
-        self.g_opt: tf.keras.optimizers = build_optimizer(config, config.g_opt)
-
-        self.checkpoint = tf.train.Checkpoint(
-            discriminator=self.discriminator,
-            discriminator_optimzer=self.d_opt,
-            generator=self.generator,
-            generator_optimizer=self.g_opt,
+        # every replica takes bs / n_replicas of a step's real & fake images
+        self.n_replicas: int = self.strategy.num_replicas_in_sync
+        if self.bs % self.n_replicas != 0:
+            raise ValueError(f'[-] batch size {self.bs} is not divisible by {self.n_replicas} replicas :(')
+        if self.n_replicas > 1 and self.clip_mode == 'loop':
+            raise ValueError('[-] clip_mode loop assigns the mirrored variables per replica, use constraint :(')
+        if self.n_replicas > 1 and self.jit_compile:
+            raise ValueError('[-] jit_compile does not support the cross-replica all-reduce, disable it :(')
+        self.replica_bs: int = self.bs // self.n_replicas
+        self.is_chief: bool = is_chief(self.strategy)
+
+        # the variables (models, optimizer slots, training state & rng) are mirrored on every replica
+        with self.strategy.scope():
+            # the layers compute in the policy, the logits, outputs & losses stay in fp32
+            self.discriminator: tf.keras.Model = self.build_discriminator()
+            self.generator: tf.keras.Model = self.build_generator()
+
+            self.d_opt: tf.keras.optimizers = build_loss_scale_optimizer(
+                build_optimizer(config, config.d_opt), self.policy
+            )
+            self.g_opt: tf.keras.optimizers = build_loss_scale_optimizer(
+                build_optimizer(config, config.g_opt), self.policy
+            )
+
+            # training state, saved & restored along with the models
+            self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False, name='epoch')  # the next epoch to train
+            self.global_step = tf.Variable(0, dtype=tf.int64, trainable=False, name='global_step')
+            self.rng = tf.random.Generator.from_seed(self.seed)
+
+            self.checkpoint = tf.train.Checkpoint(
+                discriminator=self.discriminator,
+                discriminator_optimzer=self.d_opt,
+                generator=self.generator,
+                generator_optimizer=self.g_opt,
+                epoch=self.epoch,
+                global_step=self.global_step,
+                rng=self.rng,
+            )
+
+        # every worker saves (the variables may be all-reduced), only the chief's checkpoints are kept.
+        # the others write into a temp dir of their own, which is deleted after every save.
+        self.checkpoint_dir: str = (
+            self.model_path if self.is_chief else tempfile.mkdtemp(prefix=f'wgan-worker-{self.get_task_id()}-')
+        )
+        self.checkpoint_manager = tf.train.CheckpointManager(
+            self.checkpoint,
+            directory=self.checkpoint_dir,
+            max_to_keep=self.max_to_keep,
+            keep_checkpoint_every_n_hours=self.keep_every_n_hours if self.keep_every_n_hours > 0 else None,
+        )
+        self.checkpoint_options: Optional[tf.train.CheckpointOptions] = (
+            self.build_checkpoint_options() if self.is_chief else None
         )
 
+        # graph functions, XLA-compiled with jit_compile.
+        # train_step_fresh pulls from a tf.data iterator, which XLA can't compile, so it's never jit-compiled.
+        for name in ('train_discriminator', 'train_generator', 'train_step', 'generate_samples'):
+            setattr(self, name, build_function(getattr(self, name), jit_compile=self.jit_compile))
+
         if self.verbose:
             self.discriminator.summary()
             self.generator.summary()
 
     def build_discriminator(self) -> tf.keras.Model:
+        # weight clipping, fused into the optimizer update of every trainable variable
+        clip = WeightClip(self.grad_clip) if self.clip_mode == 'constraint' else None
+
         inputs = Input((self.width, self.height, self.n_channels))
 
-        x = Conv2D(self.n_feats, kernel_size=5, strides=2, padding='same')(inputs)
-        x = LeakyReLU(alpha=0.2)(x)
+        x = Conv2D(
+            self.n_feats,
+            kernel_size=5,
+            strides=2,
+            padding='same',
+            kernel_constraint=clip,
+            bias_constraint=clip,
+            dtype=self.policy,
+        )(inputs)
+        x = LeakyReLU(alpha=0.2, dtype=self.policy)(x)
 
         for i in range(3):
-            x = Conv2D(self.n_feats * (2 ** (i + 1)), kernel_size=5, strides=2, padding='same')(x)
-            x = BatchNormalization()(x)
-            x = LeakyReLU(alpha=0.2)(x)
-
-        x = Flatten()(x)
-
-        x = Dense(1)(x)
+            x = Conv2D(
+                self.n_feats * (2 ** (i + 1)),
+                kernel_size=5,
+                strides=2,
+                padding='same',
+                kernel_constraint=clip,
+                bias_constraint=clip,
+                dtype=self.policy,
+            )(x)
+            x = BatchNormalization(beta_constraint=clip, gamma_constraint=clip, dtype=self.policy)(x)
+            x = LeakyReLU(alpha=0.2, dtype=self.policy)(x)
+
+        x = Flatten(dtype=self.policy)(x)
+
+        x = Dense(1, kernel_constraint=clip, bias_constraint=clip, dtype='float32')(x)  # fp32 logits
 
         return Model(inputs, x, name='discriminator')
 
     def build_generator(self) -> tf.keras.Model:
         inputs = Input((self.z_dims,))
 
-        x = Dense(4 * 4 * 4 * self.z_dims)(inputs)
-        x = BatchNormalization()(x)
-        x = ReLU()(x)
+        x = Dense(4 * 4 * 4 * self.z_dims, dtype=self.policy)(inputs)
+        x = BatchNormalization(dtype=self.policy)(x)
+        x = ReLU(dtype=self.policy)(x)
 
-        x = Reshape((4, 4, 4 * self.z_dims))(x)
+        x = Reshape((4, 4, 4 * self.z_dims), dtype=self.policy)(x)
 
         for i in range(3):
-            x = Conv2DTranspose(self.z_dims * 4 // (2 ** i), kernel_size=5, strides=2, padding='same')(x)
-            x = BatchNormalization()(x)
-            x = ReLU()(x)
+            x = Conv2DTranspose(
+                self.z_dims * 4 // (2 ** i), kernel_size=5, strides=2, padding='same', dtype=self.policy
+            )(x)
+            x = BatchNormalization(dtype=self.policy)(x)
+            x = ReLU(dtype=self.policy)(x)
 
-        x = Conv2DTranspose(self.n_channels, kernel_size=5, strides=1, padding='same')(x)
-        x = Layer('tanh')(x)
+        x = Conv2DTranspose(self.n_channels, kernel_size=5, strides=1, padding='same', dtype=self.policy)(x)
+        x = Activation('tanh', dtype='float32')(x)  # fp32 outputs
 
         return Model(inputs, x, name='generator')
 
-    @tf.function
-    def train_discriminator(self, x: tf.Tensor):
-        z = tf.random.uniform((self.bs, self.z_dims))
+    @staticmethod
+    def scale_loss(optimizer: tf.keras.optimizers.Optimizer, loss: tf.Tensor) -> tf.Tensor:
+        if isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+            return optimizer.get_scaled_loss(loss)
+        return loss
+
+    @staticmethod
+    def unscale_gradients(optimizer: tf.keras.optimizers.Optimizer, gradients: list) -> list:
+        if isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+            return optimizer.get_unscaled_gradients(gradients)
+        return gradients
+
+    def update_discriminator(self, x: tf.Tensor) -> tf.Tensor:
+        if x.dtype == tf.uint8:  # batch-first pipeline
+            x = TFDatasets.normalize_batch(x)
+
+        z = self.rng.uniform((self.replica_bs, self.z_dims))
         with tf.GradientTape() as gt:
             x_fake = self.generator(z, training=True)
             d_fake = self.discriminator(x_fake, training=True)
             d_real = self.discriminator(x, training=True)
 
-            d_loss = discriminator_wgan_loss(d_real, d_fake)
+            d_loss = scale_replica_loss(
+                discriminator_wgan_loss(tf.cast(d_real, tf.float32), tf.cast(d_fake, tf.float32))
+            )
+            scaled_loss = self.scale_loss(self.d_opt, d_loss)
 
-            gradients = gt.gradient(d_loss, self.discriminator.trainable_variables)
+            gradients = self.unscale_gradients(
+                self.d_opt, gt.gradient(scaled_loss, self.discriminator.trainable_variables)
+            )
             self.d_opt.apply_gradients(zip(gradients, self.discriminator.trainable_variables))
 
-            for var in self.discriminator.trainable_variables:
-                var.assign(tf.clip_by_value(var, -self.grad_clip, self.grad_clip))
+            if self.clip_mode == 'loop':
+                for var in self.discriminator.trainable_variables:
+                    var.assign(WeightClip(self.grad_clip)(var))
 
             return d_loss
 
-    @tf.function
-    def train_generator(self):
-        z = tf.random.uniform((self.bs, self.z_dims))
+    def update_generator(self) -> tf.Tensor:
+        z = self.rng.uniform((self.replica_bs, self.z_dims))
         with tf.GradientTape() as gt:
             x_fake = self.generator(z, training=True)
             d_fake = self.discriminator(x_fake, training=True)
 
-            g_loss = generator_wgan_loss(d_fake)
+            g_loss = scale_replica_loss(generator_wgan_loss(tf.cast(d_fake, tf.float32)))
+            scaled_loss = self.scale_loss(self.g_opt, g_loss)
 
-            gradients = gt.gradient(g_loss, self.generator.trainable_variables)
+            gradients = self.unscale_gradients(self.g_opt, gt.gradient(scaled_loss, self.generator.trainable_variables))
             self.g_opt.apply_gradients(zip(gradients, self.generator.trainable_variables))
 
             return g_loss
 
-    def load(self) -> int:
-        return 0
+    def update_step(self, x: tf.Tensor):
+        d_loss = tf.constant(0.0)
+        for _ in range(self.n_critics):
+            d_loss = self.update_discriminator(x)
+        g_loss = self.update_generator()
+        return d_loss, g_loss
 
-    def train(self, dataset: tf.data.Dataset):
-        start_epoch: int = self.load()
+    def reduce_loss(self, loss):
+        """sum of the scaled per-replica losses, the global batch loss."""
+        return self.strategy.reduce(tf.distribute.ReduceOp.SUM, loss, axis=None)
 
-        z_samples = tf.random.uniform((self.n_samples, self.z_dims))
-
-        for epoch in range(start_epoch, self.epochs):
-            loader = tqdm(dataset, desc=f'[*] Epoch {epoch} / {self.epochs}')
-            for n_iter, batch in enumerate(loader):
-                for _ in range(self.n_critics):
-                    d_loss = self.train_discriminator(batch)
+    def train_discriminator(self, x: tf.Tensor):
+        return self.reduce_loss(self.strategy.run(self.update_discriminator, args=(x,)))
 
-                g_loss = self.train_generator()
+    def train_generator(self):
+        return self.reduce_loss(self.strategy.run(self.update_generator))
 
-                loader.set_postfix(
-                    d_loss=f'{d_loss:.5f}',
-                    g_loss=f'{g_loss:.5f}',
-                )
+    def train_step(self, x: tf.Tensor):
+        """n_critics critic updates on the same real batch & a generator update, in one graph call.
+        the critic loop is unrolled at trace time (n_critics is fixed), so there's no per-update dispatch.
+        """
+        d_loss, g_loss = self.strategy.run(self.update_step, args=(x,))
+        return self.reduce_loss(d_loss), self.reduce_loss(g_loss)
 
-            # saving the generated samples
-            samples = self.generate_samples(z_samples)
-            samples = merge_images(samples, n_rows=int(self.n_samples ** 0.5))
-            save_image(samples, os.path.join(self.output_path, f'{epoch}.png'))
+    @tf.function
+    def train_step_fresh(self, iterator):
+        """same as train_step, but every critic update takes a fresh real batch from the iterator, in the graph."""
+        d_loss = tf.constant(0.0)
+        for _ in range(self.n_critics):
+            d_loss = self.strategy.run(self.update_discriminator, args=(next(iterator),))
+        g_loss = self.strategy.run(self.update_generator)
+        return self.reduce_loss(d_loss), self.reduce_loss(g_loss)
+
+    def get_task_id(self) -> int:
+        cluster_resolver = getattr(self.strategy, 'cluster_resolver', None)
+        if cluster_resolver is None or cluster_resolver.task_id is None:
+            return 0
+        return int(cluster_resolver.task_id)
+
+    def build_checkpoint_options(self) -> Optional[tf.train.CheckpointOptions]:
+        """the variables are snapshotted into host memory & written on a background thread (tf >= 2.9)."""
+        if not self.async_checkpoint:
+            return None
+
+        try:
+            return tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)
+        except TypeError:
+            print('[-] async checkpoint needs tf >= 2.9, saving synchronously')
+            return None
 
-            # saving the models & optimizers
-            self.checkpoint.save(file_prefix=os.path.join(self.model_path, f'{epoch}'))
+    def load(self) -> int:
+        """restores the latest checkpoint (models, optimizers, epoch/step counters & rng state).
+        :return: the epoch to start from.
+        """
+        latest_checkpoint: Optional[str] = tf.train.latest_checkpoint(self.model_path)  # the chief's, on every worker
+        if not latest_checkpoint:
+            print('[-] No checkpoint file found')
+            return 0
+
+        self.checkpoint.restore(latest_checkpoint).expect_partial()
+        print(f'[+] {latest_checkpoint} is restored, epoch {int(self.epoch)}, global step {int(self.global_step)}')
+        return int(self.epoch)
+
+    def save(self, epoch: int, global_step: int) -> float:
+        """saves a checkpoint after the epoch, keeping max_to_keep of them.
+        :return: how long training stalled on the save, in seconds.
+        """
+        self.epoch.assign(epoch + 1)
+        self.global_step.assign(global_step)
+
+        start_time = time.time()
+        if self.checkpoint_options is None:
+            path: str = self.checkpoint_manager.save(checkpoint_number=epoch)
+        else:
+            path: str = self.checkpoint_manager.save(checkpoint_number=epoch, options=self.checkpoint_options)
+        stall_time: float = time.time() - start_time
+
+        if not self.is_chief:  # written (synchronously) for the collectives only
+            try:
+                shutil.rmtree(self.checkpoint_dir)
+            except OSError as e:
+                print(f'[-] failed to remove the worker checkpoint {self.checkpoint_dir} : {e}')
+            return stall_time
+
+        print(f'[*] {path} is saved, training stalled {stall_time:.3f}s')
+        return stall_time
+
+    def train(self, dataset, steps_per_epoch: Optional[int] = None):
+        """
+        :param dataset: tf.data.Dataset of bs batches, or TFDatasets.load_distributed_dataset with a strategy.
+        :param steps_per_epoch: number of batches per epoch of a repeated dataset, read by one iterator across the
+            epochs (TFDatasets.get_steps_per_epoch). None to pass over the (finite) dataset every epoch.
+        """
+        start_epoch: int = self.load()
+        global_step: int = int(self.global_step)
+
+        # the same samples across the runs
+        z_samples = tf.random.stateless_uniform((self.n_samples, self.z_dims), seed=(self.seed, 0))
+        sample_writer = SampleWriter(n_rows=int(self.n_samples ** 0.5))
+
+        if steps_per_epoch is not None:
+            iterator = iter(dataset)
+            n_batches: int = steps_per_epoch
+        elif self.fused_step and self.fresh_critic_batches:
+            n_batches: int = int(tf.data.experimental.cardinality(dataset))
+            if n_batches < 0:  # unknown, counted once
+                n_batches = int(dataset.reduce(0, lambda n, _: n + 1))
+
+        try:
+            for epoch in range(start_epoch, self.epochs):
+                desc: str = f'[*] Epoch {epoch} / {self.epochs}'
+                if self.fused_step and self.fresh_critic_batches:  # n_critics batches per step
+                    if steps_per_epoch is None:
+                        iterator = iter(dataset)
+                    loader = tqdm(range(n_batches // self.n_critics), desc=desc)
+                elif steps_per_epoch is not None:
+                    loader = tqdm((next(iterator) for _ in range(steps_per_epoch)), total=steps_per_epoch, desc=desc)
+                else:
+                    loader = tqdm(dataset, desc=desc)
+
+                for n_iter, batch in enumerate(loader):
+                    if not self.fused_step:
+                        for _ in range(self.n_critics):
+                            d_loss = self.train_discriminator(batch)
+
+                        g_loss = self.train_generator()
+                    elif self.fresh_critic_batches:
+                        d_loss, g_loss = self.train_step_fresh(iterator)
+                    else:
+                        d_loss, g_loss = self.train_step(batch)
+                    global_step += 1
+
+                    loader.set_postfix(
+                        d_loss=f'{d_loss:.5f}',
+                        g_loss=f'{g_loss:.5f}',
+                    )
+
+                # saving the generated samples, merged & written on the worker thread
+                if self.is_chief:
+                    sample_writer.submit(
+                        self.generate_samples(z_samples), os.path.join(self.output_path, f'{epoch}.png')
+                    )
+
+                # saving the models, optimizers & training state
+                self.save(epoch, global_step)
+        finally:  # the pending samples are written, even if training fails
+            sample_writer.close()
+
+        if self.checkpoint_options is not None and hasattr(self.checkpoint, 'sync'):
+            self.checkpoint.sync()  # waits for the pending write
 
-    @tf.function
     def generate_samples(self, z: tf.Tensor):
         return self.generator(z, training=False)
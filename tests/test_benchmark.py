@@ -0,0 +1,44 @@
+import multiprocessing as mp
+import sys
+import time
+
+import pytest
+
+from awesome_gans.benchmark import get_result
+
+
+def start(ctx, target, *args):
+    process = ctx.Process(target=target, args=args)
+    process.start()
+    return process
+
+
+def test_get_result():
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    process = start(ctx, result_queue.put, {'frames/sec': 1.0})
+    assert get_result(result_queue, [process], timeout=0.1) == {'frames/sec': 1.0}
+    process.join()
+
+
+def test_get_result_exited_cleanly():
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    process = start(ctx, sys.exit, 0)
+    with pytest.raises(RuntimeError):  # instead of waiting on the queue forever
+        get_result(result_queue, [process], timeout=0.1)
+    process.join()
+
+
+def test_get_result_crashed():
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    processes = [start(ctx, sys.exit, 3), start(ctx, time.sleep, 60)]
+
+    start_time = time.time()
+    with pytest.raises(RuntimeError):
+        get_result(result_queue, processes, timeout=0.1)
+    assert time.time() - start_time < 30  # the one left waiting is terminated
+    for process in processes:
+        process.join()
+    assert processes[0].exitcode == 3 and processes[1].exitcode != 0
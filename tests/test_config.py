@@ -0,0 +1,37 @@
+import pytest
+
+from awesome_gans.config import parse_args
+from awesome_gans.wgan.config import build_parser
+
+
+@pytest.mark.parametrize(
+    'value, expected', [('True', True), ('true', True), ('1', True), ('False', False), ('no', False)]
+)
+def test_deterministic_flag(value, expected):
+    assert parse_args().parse_args(['--deterministic', value]).deterministic is expected
+
+
+def test_deterministic_default():
+    assert parse_args().parse_args([]).deterministic is True
+
+
+def test_invalid_bool_flag():
+    with pytest.raises(SystemExit):
+        parse_args().parse_args(['--deterministic', 'maybe'])
+
+
+@pytest.mark.parametrize('flag', ['--fused_step', '--fresh_critic_batches', '--jit_compile', '--async_checkpoint'])
+@pytest.mark.parametrize('value, expected', [('True', True), ('False', False)])
+def test_wgan_bool_flags(flag, value, expected):
+    config = build_parser().parse_args([flag, value])
+    assert getattr(config, flag[2:]) is expected
+
+
+def test_wgan_bool_flags_default():
+    config = build_parser().parse_args([])
+    assert (config.fused_step, config.fresh_critic_batches, config.jit_compile, config.async_checkpoint) == (
+        False,
+        False,
+        False,
+        True,
+    )
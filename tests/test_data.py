@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+tfds = pytest.importorskip('tensorflow_datasets')
+
+from awesome_gans.data import TFDatasets  # noqa: E402
+from awesome_gans.wgan.config import build_parser  # noqa: E402
+
+N_IMAGES = 20
+
+
+def get_config(*args):
+    return build_parser().parse_args(['--bs', '4', '--width', '8', '--height', '8'] + list(args))
+
+
+@pytest.fixture
+def fake_tfds(monkeypatch):
+    """tfds.load of N_IMAGES 16x16 images, the i-th one filled with 10 * i, recording the requested splits"""
+    images = np.repeat(np.arange(0, 10 * N_IMAGES, 10, dtype=np.uint8), 16 * 16 * 3).reshape(N_IMAGES, 16, 16, 3)
+    splits = []
+
+    def load(name, split, as_supervised, shuffle_files):
+        splits.append(split)
+        start, stop = 0, N_IMAGES
+        if '[' in split:
+            start, stop = map(int, split[split.index('[') + 1 : -1].split(':'))
+        return tf.data.Dataset.from_tensor_slices({'image': images[start:stop]})
+
+    monkeypatch.setattr(tfds, 'load', load)
+    monkeypatch.setattr(TFDatasets, 'get_num_examples', lambda self: N_IMAGES)
+    return splits
+
+
+def image_ids(batch):
+    values = batch.numpy()[:, 0, 0, 0].astype(np.float32)
+    if batch.dtype == tf.float32:  # [-1, 1]
+        values = (values + 1.0) * 127.5
+    return [int(v) for v in np.rint(values / 10.0)]
+
+
+def epoch_values(ds):
+    return sorted(i for batch in ds for i in image_ids(batch))
+
+
+def test_load_dataset_options(tmp_path, fake_tfds):
+    config = get_config('--cache_dir', str(tmp_path), '--deterministic', 'false', '--num_parallel_calls', '2')
+    loader = TFDatasets(config)
+    assert loader.shuffle_buffer == 4 * 16 and loader.num_parallel_calls == 2 and loader.deterministic is False
+
+    ds = loader.load_dataset()
+    first = epoch_values(ds)
+    assert len(first) == N_IMAGES and len(set(first)) == N_IMAGES  # every image, once per epoch
+    assert epoch_values(ds) == first  # the next epochs come from the file-backed cache
+    assert any(fn.startswith('cifar10-8x8-crop0-element') for fn in os.listdir(str(tmp_path)))
+
+    batch = next(iter(ds))
+    assert batch.shape == (4, 8, 8, 3) and batch.dtype == tf.float32
+
+
+def test_load_dataset_shuffle_buffer(fake_tfds):
+    loader = TFDatasets(get_config('--shuffle_buffer', '7'))
+    assert loader.shuffle_buffer == 7 and loader.cache_dir == ''
+    assert loader.get_cache_filename() == ''  # in-memory cache
+
+    orders = {tuple(i for batch in loader.load_dataset() for i in image_ids(batch)) for _ in range(5)}
+    assert len(orders) > 1  # reshuffled
+
+
+def test_get_split(fake_tfds):
+    loader = TFDatasets(get_config())
+    assert loader.get_split() == 'train'
+    assert [loader.get_split(3, i) for i in range(3)] == ['train[0:6]', 'train[6:13]', 'train[13:20]']
+
+
+def test_load_dataset_shards(tmp_path, fake_tfds):
+    loader = TFDatasets(get_config('--cache_dir', str(tmp_path)))
+    shards = [epoch_values(loader.load_dataset(batch_size=1, num_shards=3, shard_index=i)) for i in range(3)]
+
+    assert sorted(i for shard in shards for i in shard) == list(range(N_IMAGES))  # disjoint, every image
+    assert [len(shard) for shard in shards] == [6, 7, 7]
+    assert fake_tfds == ['train[0:6]', 'train[6:13]', 'train[13:20]']  # each reads its own records only
+    assert len([fn for fn in os.listdir(str(tmp_path)) if fn.endswith('.index')]) == 3  # a cache per shard
+
+
+def test_load_distributed_dataset(fake_tfds):
+    strategy = tf.distribute.get_strategy()
+    ds = TFDatasets(get_config()).load_distributed_dataset(strategy)
+    iterator = iter(ds)
+    batches = [next(iterator) for _ in range(N_IMAGES // 4 + 1)]  # repeated, past the first epoch
+    assert all(batch.shape == (4, 8, 8, 3) for batch in batches)
+
+    class Replicas:
+        num_replicas_in_sync = 3
+
+    with pytest.raises(ValueError):  # bs 4 over 3 replicas
+        TFDatasets(get_config()).load_distributed_dataset(Replicas())
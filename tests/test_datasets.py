@@ -0,0 +1,546 @@
+import os
+import pickle
+import struct
+import time
+import wave
+
+import numpy as np
+import pytest
+
+for module in ('cv2', 'h5py', 'scipy', 'tensorflow', 'tqdm'):
+    pytest.importorskip(module)
+
+import cv2  # noqa: E402
+import tensorflow as tf  # noqa: E402
+
+from awesome_gans.datasets import (  # noqa: E402
+    BatchPrefetcher,
+    CiFarDataSet,
+    DataIterator,
+    DataSetLoader,
+    Div2KPatchDataSet,
+    IndexedView,
+    ImageNetDataSet,
+    MemmapShardStore,
+    PyramidDataSet,
+    TFRecordNumpyReader,
+    UnpairedDataIterator,
+    UrbanSoundDataSet,
+    load_celeba_attr,
+    train_valid_split,
+)
+
+SAMPLE_RATE = 22050
+
+
+def sine(n_samples, n_channels=2):
+    t = np.arange(n_samples) / SAMPLE_RATE
+    return np.stack([0.5 * np.sin(2 * np.pi * 440.0 * (c + 1) * t) for c in range(n_channels)], axis=1)
+
+
+def write_pcm16(path, data):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(data.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(np.round(data * 32767).astype('<i2').tobytes())
+
+
+def write_riff(path, format_tag, sample_width, n_channels, payload, extensible=False, valid_bits=None):
+    block_align = sample_width * n_channels
+    fmt = struct.pack(
+        '<HHIIHH',
+        0xFFFE if extensible else format_tag,
+        n_channels,
+        SAMPLE_RATE,
+        SAMPLE_RATE * block_align,
+        block_align,
+        8 * sample_width,
+    )
+    if extensible:
+        guid = struct.pack('<H', format_tag) + b'\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+        fmt += struct.pack('<HHI', 22, valid_bits or 8 * sample_width, 0b11) + guid
+
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+    chunks += b'LIST' + struct.pack('<I', 3) + b'abc\x00'  # odd-sized, padded chunk to skip
+    chunks += b'data' + struct.pack('<I', len(payload)) + payload
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', 4 + len(chunks)) + b'WAVE' + chunks)
+
+
+def write_pcm24_extensible(path, data):
+    samples = np.round(data * 8388607).astype('<i4').reshape(-1, 1).view(np.uint8).reshape(-1, 4)[:, :3]
+    write_riff(path, 1, 3, data.shape[1], samples.tobytes(), extensible=True, valid_bits=24)
+
+
+def write_float32(path, data):
+    write_riff(path, 3, 4, data.shape[1], data.astype('<f4').tobytes())
+
+
+@pytest.mark.parametrize('writer, atol', [(write_pcm16, 1e-4), (write_pcm24_extensible, 1e-6), (write_float32, 1e-7)])
+def test_read_wav_chunks(tmp_path, writer, atol):
+    data = sine(10000)
+    path = os.path.join(str(tmp_path), 'sample.wav')
+    writer(path, data)
+
+    chunks = list(UrbanSoundDataSet.read_wav_chunks(path, chunk_size=4096))
+    assert [len(chunk) for _, chunk in chunks] == [4096, 4096, 1808]
+    assert all(sample_rate == SAMPLE_RATE for sample_rate, _ in chunks)
+    np.testing.assert_allclose(np.concatenate([chunk for _, chunk in chunks]), data.mean(axis=1), atol=atol)
+
+
+@pytest.mark.parametrize('writer', [write_pcm16, write_pcm24_extensible, write_float32])
+@pytest.mark.parametrize('sample_rate', [SAMPLE_RATE, 16000])
+def test_decode_frames_chunked(tmp_path, writer, sample_rate):
+    path = os.path.join(str(tmp_path), 'sample.wav')
+    writer(path, sine(50000))
+
+    args = (path, sample_rate, 4096, 2048, 0.95)
+    chunked = UrbanSoundDataSet.decode_frames(*args, 1000)
+    one_shot = UrbanSoundDataSet.decode_frames(*args, 1 << 20)
+
+    assert chunked.shape == one_shot.shape and len(one_shot) > 0
+    np.testing.assert_allclose(chunked, one_shot, atol=1e-5)
+
+
+def test_iterate_skips_broken_files(tmp_path):
+    for i in range(3):
+        write_pcm16(os.path.join(str(tmp_path), '%d.wav' % i), sine(20000))
+    with open(os.path.join(str(tmp_path), 'broken.wav'), 'wb') as f:
+        f.write(b'RIFF\x00\x00\x00\x00WAVEjunk')
+
+    ds = UrbanSoundDataSet(
+        ds_path=str(tmp_path), sample_rate=SAMPLE_RATE, frame_length=4096, frame_stride=4096, batch_size=4, n_threads=2
+    )
+    batches = list(ds.iterate(n_epochs=1))
+
+    assert sum(len(batch) for batch in batches) == 3 * (20000 // 4096)
+    assert all(batch.shape == (4, 4096) and batch.dtype == np.float32 for batch in batches)
+
+
+def test_load_img_pools(tmp_path):
+    images = np.random.RandomState(0).randint(0, 256, size=(6, 8, 8, 3)).astype(np.uint8)
+    for i, img in enumerate(images):
+        cv2.imwrite(os.path.join(str(tmp_path), '%d.png' % i), img[..., ::-1])
+
+    def sort_rows(rows):  # the loaded images are shuffled
+        return rows[np.lexsort(rows.T[::-1])]
+
+    for pool in ('thread', 'process'):  # process : spawned workers
+        ds = DataSetLoader(
+            str(tmp_path), size=(8, 8, 3), name='img_npy', n_threads=2, use_image_scaling=False, img_load_pool=pool
+        )
+        np.testing.assert_array_equal(sort_rows(ds.raw_data), sort_rows(images.reshape(6, -1)))
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float16])
+@pytest.mark.parametrize('scale, low, high', [('0,1', 0.0, 1.0), ('-1,1', -1.0, 1.0)])
+def test_img_scaling_dtype(dtype, scale, low, high):
+    images = np.array([[0, 255], [51, 102]], dtype=np.uint8)
+
+    scaled = DataSetLoader.img_scaling(images, scale, dtype)
+    assert scaled.dtype == dtype
+    assert scaled.min() == low and scaled.max() == high
+    assert images.dtype == np.uint8  # the source stays as it is
+
+
+def test_data_iterator_batch_dtype():
+    images = np.arange(8 * 4, dtype=np.uint8).reshape(8, 4)
+
+    ds_iter = DataIterator(images, None, 4, label_off=True, scale='-1,1', dtype=np.float16)
+    batch = ds_iter.next_batch()
+    assert batch.dtype == np.float16
+    np.testing.assert_allclose(batch, images[:4] / 127.5 - 1.0, atol=1e-2)
+
+
+def test_data_iterator_epochs():
+    x = np.arange(10 * 3, dtype=np.uint8).reshape(10, 3)
+    y = np.arange(10)
+    ds_iter = DataIterator(x, y, 4)
+
+    np.random.seed(0)
+    for _ in range(3):
+        seen = []
+        for batch_x, batch_y in ds_iter.iterate():
+            np.testing.assert_array_equal(batch_x, x[batch_y])  # x & y stay paired
+            seen.extend(batch_y)
+        assert len(set(seen)) == len(seen) == 8  # no repeat within an epoch
+
+    assert ds_iter.x is x  # shuffled by index, not copied
+    np.testing.assert_array_equal(x, np.arange(10 * 3).reshape(10, 3))
+
+
+def test_batch_prefetcher():
+    ds_iter = DataIterator(np.arange(8 * 4, dtype=np.uint8).reshape(8, 4), np.arange(8), 4)
+    prefetcher = BatchPrefetcher(ds_iter.next_batch, z_shape=(4, 2), x_shape=(-1, 2, 2), seed=0)
+
+    batches = list(prefetcher.iterate(3))
+    prefetcher.close()
+
+    assert [len(batch) for batch in batches] == [3, 3, 3]  # (x, y, z)
+    x, y, z = batches[0]
+    assert x.shape == (4, 2, 2) and x.dtype == np.float32 and z.shape == (4, 2)
+    assert prefetcher.n_batches == 3
+
+
+def test_prefetcher_reraises():
+    def broken():
+        raise IOError('broken')
+
+    prefetcher = BatchPrefetcher(broken, z_shape=(1, 1))
+    with pytest.raises(IOError):
+        prefetcher.next_batch()
+    with pytest.raises(RuntimeError):  # the worker has exited, nothing more to wait for
+        prefetcher.next_batch()
+    prefetcher.close()
+
+
+def test_prefetcher_closed():
+    ds_iter = DataIterator(np.arange(8 * 4, dtype=np.uint8).reshape(8, 4), None, 4, label_off=True)
+    prefetcher = BatchPrefetcher(ds_iter.next_batch, z_shape=(4, 2))
+    prefetcher.next_batch()
+    prefetcher.close()
+
+    with pytest.raises(RuntimeError):
+        prefetcher.next_batch()
+
+
+def test_unpaired_data_iterator():
+    x_a = np.arange(10, dtype=np.uint8).reshape(10, 1)
+    x_b = np.arange(100, 104, dtype=np.uint8).reshape(4, 1)
+
+    ds_iter = UnpairedDataIterator(x_a, x_b, 2, scale='0,1', dtype=np.float16, seed=0)
+    batches = list(ds_iter.iterate())
+    ds_iter.close()
+
+    assert len(batches) == 5  # an epoch of the larger domain
+    seen_a = np.concatenate([batch_a for batch_a, _ in batches]).ravel()
+    np.testing.assert_allclose(np.sort(seen_a * 255.0), np.arange(10), atol=0.1)
+    assert all(batch_b.dtype == np.float16 and batch_b.shape == (2, 1) for _, batch_b in batches)
+
+
+def test_pyramid_from_flat_memmap_store(tmp_path):
+    images = np.random.RandomState(0).randint(0, 256, size=(5, 16 * 16 * 3)).astype(np.uint8)
+    store = MemmapShardStore.write(os.path.join(str(tmp_path), 'store'), images, shard_size=2)
+
+    view = MemmapShardStore(store.path, sample_shape=(16, 16, 3))
+    assert view.shape == (5, 16, 16, 3)
+    np.testing.assert_array_equal(view[3], images[3].reshape(16, 16, 3))
+
+    ds = PyramidDataSet.write(os.path.join(str(tmp_path), 'pyramid'), view, shard_size=2)
+    assert ds.resolutions == [4, 8, 16]
+    np.testing.assert_array_equal(np.asarray(ds.levels[16]), images.reshape(-1, 16, 16, 3))
+
+    with pytest.raises(AssertionError):
+        MemmapShardStore(store.path, sample_shape=(16, 16, 4))
+
+
+def make_imagenet_tree(root, n_classes=3, n_images=4):
+    for c in range(n_classes):
+        os.makedirs(os.path.join(root, 'n%08d' % c))
+        for i in range(n_images):
+            open(os.path.join(root, 'n%08d' % c, 'img_%d.JPEG' % i), 'wb').close()
+
+
+def test_imagenet_index(tmp_path):
+    ds_path = str(tmp_path)
+    make_imagenet_tree(ds_path)
+
+    ds = ImageNetDataSet(ds_path=ds_path, batch_size=2, rank=1, world_size=2)
+    assert os.path.exists(os.path.join(ds_path, 'index.npz'))
+    assert ds.num_images == 6 and ds.n_classes == 3
+    np.testing.assert_array_equal(ds.labels, [0, 0, 1, 1, 2, 2])
+    assert ds.get_path(3) == os.path.join(ds_path, 'n00000001', 'img_3.JPEG')
+
+    cached = ImageNetDataSet(ds_path=ds_path, batch_size=2, rank=1, world_size=2)
+    assert [cached.get_path(i) for i in range(6)] == [ds.get_path(i) for i in range(6)]
+
+
+def test_imagenet_index_read_only_ds_path(tmp_path, monkeypatch):
+    ds_path, cache_dir = str(tmp_path / 'train'), str(tmp_path / 'cache')
+    make_imagenet_tree(ds_path)
+    monkeypatch.setenv('XDG_CACHE_HOME', cache_dir)
+
+    savez = np.savez
+
+    def read_only_savez(path, **kwargs):
+        if path.startswith(ds_path):
+            raise PermissionError('read-only')
+        savez(path, **kwargs)
+
+    monkeypatch.setattr(np, 'savez', read_only_savez)
+
+    ds = ImageNetDataSet(ds_path=ds_path, batch_size=2)
+    assert not os.path.exists(os.path.join(ds_path, 'index.npz'))
+    assert sorted(os.listdir(ds_path)) == ['n00000000', 'n00000001', 'n00000002']  # no tmp file left
+    assert os.path.exists(ds.cache_path()) and ds.cache_path().startswith(cache_dir)
+
+
+def test_imagenet_corrupt_images(tmp_path):
+    make_imagenet_tree(str(tmp_path), n_classes=2, n_images=3)
+    for c in range(2):
+        for i in range(1, 3):  # img_0 stays empty (unreadable), the rest are 8x8 images filled with the class
+            cv2.imwrite(
+                os.path.join(str(tmp_path), 'n%08d' % c, 'img_%d.JPEG' % i), np.full((8, 8, 3), 100 * c, np.uint8)
+            )
+
+    with pytest.raises(IOError, match='img_0.JPEG'):
+        DataSetLoader.get_img(os.path.join(str(tmp_path), 'n00000000', 'img_0.JPEG'))
+
+    ds = ImageNetDataSet(ds_path=str(tmp_path), height=4, width=4, batch_size=3, sampling='uniform', n_threads=2)
+    for batch_x, batch_y in ds.iterate(n_batches=4, use_one_hot=False):
+        np.testing.assert_allclose(batch_x.mean(axis=(1, 2, 3)), 100 * batch_y, atol=2)  # replaced within the class
+
+
+def test_imagenet_iterate_early_break(tmp_path, monkeypatch):
+    make_imagenet_tree(str(tmp_path), n_images=8)
+    n_calls = []
+
+    def get_img(path, size):
+        n_calls.append(path)
+        time.sleep(0.02)
+        return np.zeros(size + (3,), dtype=np.uint8)
+
+    monkeypatch.setattr(ImageNetDataSet, 'get_img', staticmethod(get_img))
+
+    ds = ImageNetDataSet(ds_path=str(tmp_path), height=4, width=4, batch_size=2, buffer_size=8, n_threads=1)
+    for batch_x, batch_y in ds.iterate(use_one_hot=False):
+        assert batch_x.shape == (2, 4, 4, 3) and batch_y.shape == (2,)
+        break
+
+    assert len(n_calls) < 8 * 2  # the batches decoded ahead are dropped, not waited for
+
+
+def test_memmap_store_write_float_and_overwrite(tmp_path):
+    path = os.path.join(str(tmp_path), 'store')
+    MemmapShardStore.write(path, np.zeros((5, 2), dtype=np.uint8), shard_size=1)
+
+    data = np.array([[-3.0, 0.6], [254.5, 255.4], [300.0, 127.49]], dtype=np.float32)
+    store = MemmapShardStore.write(path, data, shard_size=2)
+
+    np.testing.assert_array_equal(store[:], [[0, 1], [254, 255], [255, 127]])
+    assert sorted(f for f in os.listdir(path) if f.endswith('.u8')) == ['shard-00000.u8', 'shard-00001.u8']
+
+
+def write_celeba_attr(path, table):
+    with open(path, 'w') as f:
+        f.write('%d\nSmiling Young\n' % len(table))
+        for i, row in enumerate(table):
+            f.write('%06d.jpg %s\n' % (i + 1, ' '.join('%2d' % v for v in row)))
+
+
+def test_load_celeba_attr_cache(tmp_path):
+    path = os.path.join(str(tmp_path), 'list_attr_celeba.txt')
+    write_celeba_attr(path, [[1, -1], [-1, 1], [1, 1]])
+
+    num_images, attr_names, table = load_celeba_attr(path)
+    assert num_images == 3 and attr_names == ['Smiling', 'Young']
+    np.testing.assert_array_equal(table, [[1, -1], [-1, 1], [1, 1]])
+    assert table.dtype == np.int8
+
+    np.testing.assert_array_equal(load_celeba_attr(path)[2], table)  # from the cache
+
+    write_celeba_attr(path, [[-1, -1], [1, -1]])
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + int(1e9)))
+    np.testing.assert_array_equal(load_celeba_attr(path)[2], [[-1, -1], [1, -1]])
+    assert sorted(os.listdir(str(tmp_path))) == ['list_attr_celeba.txt', 'list_attr_celeba.txt.npz']
+
+
+def write_cifar_10(ds_path, seed=0):
+    rng = np.random.RandomState(seed)
+    batches = {}
+    for fn in ['data_batch_%d' % i for i in range(1, 6)] + ['test_batch']:
+        batches[fn] = {b'data': rng.randint(0, 256, size=(2, 3 * 32 * 32)).astype(np.uint8), b'labels': [1, 9]}
+        with open(os.path.join(ds_path, fn), 'wb') as f:
+            pickle.dump(batches[fn], f)
+    return batches
+
+
+def test_cifar_cache(tmp_path, monkeypatch):
+    ds_path = str(tmp_path / 'cifar-10')
+    os.makedirs(ds_path)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+    batches = write_cifar_10(ds_path)
+    decoded = CiFarDataSet(ds_path=ds_path, use_one_hot=False)
+    assert sorted(os.listdir(ds_path)) == sorted(batches)  # nothing is written into ds_path
+
+    cached = CiFarDataSet(ds_path=ds_path, use_one_hot=False)
+    assert isinstance(cached.train_images, np.memmap)
+    np.testing.assert_array_equal(cached.train_images, decoded.train_images)
+    np.testing.assert_array_equal(cached.test_images[1, :, :, 0].ravel(), batches['test_batch'][b'data'][1, :1024])
+    assert cached.train_labels.dtype == np.int64 and list(cached.test_labels) == [1, 9]
+
+    # the pickles changed, decoded again
+    batches = write_cifar_10(ds_path, seed=1)
+    os.utime(os.path.join(ds_path, 'test_batch'), ns=(0, 0))
+    reloaded = CiFarDataSet(ds_path=ds_path, use_one_hot=False)
+    np.testing.assert_array_equal(reloaded.test_images[0, :, :, 0].ravel(), batches['test_batch'][b'data'][0, :1024])
+
+    # a run killed in the middle of writing (no key) is never loaded
+    os.remove(os.path.join(reloaded.cache_path, 'cifar-10-key.json'))
+    with open(reloaded.cache_file('train-images'), 'wb') as f:
+        f.write(b'truncated')
+    np.testing.assert_array_equal(CiFarDataSet(ds_path=ds_path, use_one_hot=False).train_images, reloaded.train_images)
+
+
+@pytest.mark.parametrize('compression', ['', 'GZIP'])
+def test_tfr_round_trip(tmp_path, compression):
+    images = np.random.RandomState(0).randint(0, 256, size=(10, 4 * 4 * 3)).astype(np.uint8)
+    store_path = MemmapShardStore.write(os.path.join(str(tmp_path), 'store'), images, shard_size=4).path
+    os.makedirs(os.path.join(str(tmp_path), 'tfr'))
+
+    DataSetLoader(
+        store_path,
+        size=(4, 4, 3),
+        name='mmap_tfr',
+        use_save=True,
+        save_file_name=os.path.join(str(tmp_path), 'tfr', 'images'),
+        n_threads=2,
+        use_image_scaling=False,
+        tfr_shards=3,
+        tfr_compression=compression,
+    )
+
+    # the index ranges : [0, 3), [3, 6), [6, 10), written into their own files
+    file_names = sorted(os.listdir(os.path.join(str(tmp_path), 'tfr')))
+    assert file_names == ['images-%05d-of-00003.tfrecords' % i for i in range(3)]
+    shards = [
+        [
+            DataSetLoader.parse_tfr_np(record.numpy())
+            for record in tf.data.TFRecordDataset(os.path.join(str(tmp_path), 'tfr', fn), compression_type=compression)
+        ]
+        for fn in file_names
+    ]
+    assert [len(shard) for shard in shards] == [3, 3, 4]
+    np.testing.assert_array_equal(np.concatenate(shards), images.reshape(10, 4, 4, 3))
+
+    ds = DataSetLoader(
+        os.path.join(str(tmp_path), 'tfr'),
+        size=(4, 4, 3),
+        name='tfr_npy',
+        use_image_scaling=False,
+        tfr_compression=compression,
+    )
+    read = np.stack([img.numpy() for img in ds.raw_data])  # interleaved, in any order
+    assert read.dtype == np.uint8 and read.shape == (10, 4, 4, 3)
+    np.testing.assert_array_equal(np.sort(read.reshape(10, -1), axis=0), np.sort(images, axis=0))
+
+    # scaled in the tf.data map
+    ds = DataSetLoader(
+        os.path.join(str(tmp_path), 'tfr'),
+        size=(4, 4, 3),
+        name='tfr_npy',
+        image_scale='-1,1',
+        tfr_compression=compression,
+    )
+    scaled = np.stack([img.numpy() for img in ds.raw_data])
+    assert scaled.dtype == np.float32 and ds.batch_img_scale is None
+    np.testing.assert_allclose(
+        np.sort(scaled.reshape(10, -1), axis=0), np.sort(images, axis=0) / 127.5 - 1.0, atol=1e-6
+    )
+
+
+def write_tfr(path, images, compression=''):
+    with tf.io.TFRecordWriter(path, tf.io.TFRecordOptions(compression_type=compression)) as writer:
+        for img in images:
+            writer.write(DataSetLoader.serialize_tfr(img))
+
+
+def test_tfr_numpy_reader(tmp_path):
+    images = np.random.RandomState(0).randint(0, 256, size=(7, 4, 5, 3)).astype(np.uint8)
+    file_names = [os.path.join(str(tmp_path), 'images-%d.tfrecords' % i) for i in range(2)]
+    write_tfr(file_names[0], images[:4])
+    write_tfr(file_names[1], images[4:])
+
+    reader = TFRecordNumpyReader(file_names[::-1])  # sorted by the file name
+    assert len(reader) == 7
+
+    for i, img in enumerate(images):
+        assert reader[i].shape == (4, 5, 3) and reader[i].base is not None  # a view of the mapped file
+        np.testing.assert_array_equal(reader[i], img)
+
+    indices = np.array([6, 0, 3, 4, 0])
+    np.testing.assert_array_equal(reader.batch(indices), images[indices])
+
+    out = np.empty((len(indices), 4, 5, 3), dtype=np.uint8)
+    assert reader.batch(indices, out=out).base is out
+
+
+def test_tfr_numpy_reader_compressed(tmp_path):
+    path = os.path.join(str(tmp_path), 'images.tfrecords')
+    write_tfr(path, np.zeros((3, 4, 4, 3), dtype=np.uint8), compression='GZIP')
+
+    with pytest.raises(ValueError):
+        TFRecordNumpyReader([path])
+
+
+def test_index_split_matches_copy_split():
+    images = np.arange(20 * 6, dtype=np.uint8).reshape(20, 2, 3)
+    labels = np.arange(20) % 4
+
+    copied = train_valid_split(images, labels, 0.25, random_state=1, split_type='copy')
+    indexed = train_valid_split(images, labels, 0.25, random_state=1, split_type='index')
+
+    assert isinstance(indexed[0], IndexedView) and indexed[0].data is images  # no copy of the images
+    for c, i in zip(copied, indexed):
+        np.testing.assert_array_equal(np.asarray(i), c)
+
+    # views work with DataIterator & slicing
+    train_x, _, train_y, _ = indexed
+    batch_x, batch_y = DataIterator(train_x, train_y, 5).next_batch()
+    np.testing.assert_array_equal(batch_x, np.asarray(train_x)[:5])
+    np.testing.assert_array_equal(train_x[1:3, 0], np.asarray(train_x)[1:3, 0])
+
+    with pytest.raises(ValueError):
+        train_valid_split(images, labels, split_type='view')
+
+
+def test_index_split_over_memmap_store(tmp_path):
+    images = np.arange(10 * 4, dtype=np.uint8).reshape(10, 4)
+    store = MemmapShardStore.write(os.path.join(str(tmp_path), 'store'), images, shard_size=3)
+
+    train_x, valid_x, _, _ = train_valid_split(store, np.zeros(10), 0.3, split_type='index')
+    assert len(train_x) == 7 and len(valid_x) == 3
+    np.testing.assert_array_equal(np.sort(np.concatenate([np.asarray(train_x), np.asarray(valid_x)]), axis=0), images)
+
+
+def make_div2k(ds_path, scale=4):
+    """HR images of random scale x scale blocks, their bicubic downscale is exactly one pixel per block"""
+    hr_path = os.path.join(ds_path, 'DIV2K_train_HR')
+    os.makedirs(hr_path)
+    rng = np.random.RandomState(0)
+    for i, (h, w) in enumerate([(12, 16), (10, 9), (4, 4)]):  # the last one is smaller than a patch
+        blocks = rng.randint(0, 256, size=(h, w, 3)).astype(np.uint8)
+        hr = np.repeat(np.repeat(blocks, scale, axis=0), scale, axis=1)
+        cv2.imwrite(os.path.join(hr_path, '%04d.png' % i), hr[..., ::-1])
+
+
+def test_div2k_patches_aligned(tmp_path):
+    make_div2k(str(tmp_path))
+    ds = Div2KPatchDataSet(ds_path=str(tmp_path), patch_size=24, scale=4, batch_size=8, n_threads=2)
+    assert ds.num_images == 2
+
+    for batch_hr, batch_lr in ds.iterate(n_batches=5):
+        assert batch_hr.shape == (8, 24, 24, 3) and batch_lr.shape == (8, 6, 6, 3)
+        np.testing.assert_array_equal(batch_hr[:, ::4, ::4], batch_lr)  # flipped & transposed together
+        np.testing.assert_array_equal(batch_hr[:, 3::4, 3::4], batch_lr)  # on the block grid
+
+
+def test_div2k_iterate_early_break(tmp_path, monkeypatch):
+    make_div2k(str(tmp_path))
+    ds = Div2KPatchDataSet(ds_path=str(tmp_path), patch_size=8, batch_size=2, buffer_size=8, n_threads=1)
+
+    n_calls = []
+    crop = ds.crop
+
+    def slow_crop(*args):
+        n_calls.append(args[0])
+        time.sleep(0.02)
+        crop(*args)
+
+    monkeypatch.setattr(ds, 'crop', slow_crop)
+    for _ in ds.iterate():
+        break
+
+    assert len(n_calls) < 8 * 2  # the batches cropped ahead are dropped, not waited for
@@ -0,0 +1,149 @@
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+for module in ('cv2', 'tensorflow'):
+    pytest.importorskip(module)
+
+import tensorflow as tf  # noqa: E402
+
+from awesome_gans.losses import scale_replica_loss  # noqa: E402
+from awesome_gans.utils import SampleWriter, build_function, build_strategy, is_chief  # noqa: E402
+
+
+def test_sample_writer_flushes_on_close():
+    written = []
+    writer = SampleWriter(max_pending=8, write_fn=lambda images, fn: written.append((fn, images.sum())))
+
+    for i in range(5):
+        assert writer.submit(np.full((2, 2), i), '%d.png' % i)
+    writer.close()
+
+    assert written == [('%d.png' % i, 4 * i) for i in range(5)]  # every pending sample, in order
+    assert writer.n_written == 5 and writer.n_dropped == 0
+
+    writer.close()  # no-op
+    with pytest.raises(RuntimeError):  # nothing would write it
+        writer.submit(np.zeros((2, 2)), 'late.png')
+
+
+def test_sample_writer_drops_the_oldest():
+    started, release = threading.Event(), threading.Event()
+    written = []
+
+    def write_fn(images, fn):
+        started.set()
+        release.wait()
+        written.append(fn)
+
+    writer = SampleWriter(max_pending=2, write_fn=write_fn)
+    writer.submit(None, 'busy.png')
+    started.wait()  # the worker is stuck on it
+
+    assert writer.submit(None, '0.png') and writer.submit(None, '1.png')
+    assert not writer.submit(None, '2.png')  # 0.png is dropped, the optimizer never waits
+
+    release.set()
+    writer.close()
+    assert written == ['busy.png', '1.png', '2.png'] and writer.n_dropped == 1
+
+
+def test_sample_writer_survives_write_errors():
+    def write_fn(images, fn):
+        if fn == 'broken.png':
+            raise IOError('disk full')
+
+    writer = SampleWriter(write_fn=write_fn)
+    writer.submit(None, 'broken.png')
+    writer.submit(None, 'ok.png')
+    writer.close()
+    assert writer.n_written == 1
+
+
+@pytest.mark.parametrize('jit_compile', [False, True])
+def test_build_function(jit_compile):
+    def fn(x):
+        return tf.nn.relu(tf.matmul(x, x, transpose_b=True)) + 1.0
+
+    x = tf.random.stateless_normal((4, 8), seed=(0, 0))
+    compiled = build_function(fn, jit_compile=jit_compile)
+    np.testing.assert_allclose(compiled(x).numpy(), fn(x).numpy(), rtol=1e-5, atol=1e-5)
+    assert compiled.experimental_get_tracing_count() == 1
+
+    compiled(tf.random.stateless_normal((4, 8), seed=(1, 0)))
+    assert compiled.experimental_get_tracing_count() == 1  # the same signature, no re-tracing
+
+
+def test_build_strategy():
+    assert build_strategy('none') is tf.distribute.get_strategy()
+    with pytest.raises(ValueError):
+        build_strategy('parameter_server')
+
+
+def test_scale_replica_loss_without_a_strategy():
+    assert float(scale_replica_loss(tf.constant(3.0))) == 3.0
+    assert float(tf.function(scale_replica_loss)(tf.constant(3.0))) == 3.0
+
+
+# the logical CPUs are set before tensorflow initializes, so it runs in a fresh interpreter
+MIRRORED_SCRIPT = """
+from awesome_gans.utils import build_strategy
+
+strategy = build_strategy('mirrored', n_cpu_devices=2)
+
+import tensorflow as tf
+
+from awesome_gans.losses import scale_replica_loss
+
+assert strategy.num_replicas_in_sync == 2
+per_replica = strategy.run(tf.function(lambda: scale_replica_loss(tf.constant(4.0))))
+assert float(strategy.reduce(tf.distribute.ReduceOp.SUM, per_replica, axis=None)) == 4.0  # the global loss
+with strategy.scope():
+    assert float(scale_replica_loss(tf.constant(4.0))) == 2.0  # the cross-replica context
+"""
+
+
+def test_mirrored_strategy_scales_the_loss():
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='3', CUDA_VISIBLE_DEVICES='')
+    process = subprocess.run(
+        [sys.executable, '-c', MIRRORED_SCRIPT],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=300,
+    )
+    assert process.returncode == 0, process.stderr[-2000:]
+
+
+class ClusterResolver:
+    def __init__(self, task_type, task_id, cluster):
+        self.task_type, self.task_id = task_type, task_id
+        self.cluster = cluster
+
+    def cluster_spec(self):
+        return tf.train.ClusterSpec(self.cluster)
+
+
+class Strategy:
+    def __init__(self, cluster_resolver):
+        self.cluster_resolver = cluster_resolver
+
+
+@pytest.mark.parametrize(
+    'task_type, task_id, cluster, chief',
+    [
+        ('worker', 0, {'worker': ['localhost:1', 'localhost:2']}, True),
+        ('worker', 1, {'worker': ['localhost:1', 'localhost:2']}, False),
+        ('chief', 0, {'chief': ['localhost:1'], 'worker': ['localhost:2']}, True),
+        ('worker', 0, {'chief': ['localhost:1'], 'worker': ['localhost:2']}, False),
+        (None, None, {}, True),  # no TF_CONFIG
+    ],
+)
+def test_is_chief(task_type, task_id, cluster, chief):
+    assert is_chief(tf.distribute.get_strategy())
+    assert is_chief(Strategy(ClusterResolver(task_type, task_id, cluster))) == chief
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+pytest.importorskip('tqdm')
+
+if int(getattr(tf.keras, '__version__', '2').split('.')[0]) >= 3:
+    pytest.skip('the TF2 trainers are written against tf.keras 2 (TF_USE_LEGACY_KERAS=1)', allow_module_level=True)
+
+import awesome_gans.wgan.model as wgan_model  # noqa: E402
+from awesome_gans.optimizers import build_loss_scale_optimizer  # noqa: E402
+from awesome_gans.wgan.config import build_parser  # noqa: E402
+from awesome_gans.wgan.model import WGAN, WeightClip  # noqa: E402
+
+
+def get_config(tmp_path, *args):
+    return build_parser().parse_args(
+        ['--bs', '4', '--z_dims', '8', '--n_feats', '4', '--n_critics', '2', '--verbose', '']
+        + ['--model_path', str(tmp_path / 'model'), '--output_path', str(tmp_path / 'outputs')]
+        + list(args)
+    )
+
+
+def build_wgan(tmp_path, *args, **kwargs):
+    tf.keras.utils.set_random_seed(0)  # the same initial weights
+    return WGAN(get_config(tmp_path, *args), **kwargs)
+
+
+def real_batch(seed=0):
+    return tf.random.stateless_uniform((4, 32, 32, 3), seed=(seed, 0), minval=-1.0, maxval=1.0)
+
+
+def get_weights(model):
+    return [w.numpy() for w in model.discriminator.weights + model.generator.weights]
+
+
+def test_fused_train_step(tmp_path):
+    x = real_batch()
+
+    per_update = build_wgan(tmp_path)
+    for _ in range(per_update.n_critics):
+        d_loss = per_update.train_discriminator(x)
+    g_loss = per_update.train_generator()
+
+    fused = build_wgan(tmp_path, '--fused_step', 'true')
+    fused_d_loss, fused_g_loss = fused.train_step(x)
+
+    np.testing.assert_allclose(fused_d_loss, d_loss, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(fused_g_loss, g_loss, rtol=1e-4, atol=1e-6)
+    for w, fused_w in zip(get_weights(per_update), get_weights(fused)):
+        np.testing.assert_allclose(fused_w, w, rtol=1e-4, atol=1e-6)
+
+
+def test_fused_train_step_fresh_batches(tmp_path):
+    batches = [real_batch(seed) for seed in range(2)]
+
+    per_update = build_wgan(tmp_path)
+    for x in batches:
+        per_update.train_discriminator(x)
+    per_update.train_generator()
+
+    fused = build_wgan(tmp_path, '--fused_step', 'true', '--fresh_critic_batches', 'true')
+    fused.train_step_fresh(iter(tf.data.Dataset.from_tensor_slices(tf.stack(batches))))
+
+    for w, fused_w in zip(get_weights(per_update), get_weights(fused)):
+        np.testing.assert_allclose(fused_w, w, rtol=1e-4, atol=1e-6)
+
+
+def test_jit_compiled_train_step(tmp_path):
+    z = tf.random.stateless_uniform((4, 8), seed=(1, 0))  # XLA draws another rng stream, so the noise is given
+    models = {jit_compile: build_wgan(tmp_path, '--jit_compile', jit_compile) for jit_compile in ('false', 'true')}
+
+    samples = {jit_compile: model.generate_samples(z).numpy() for jit_compile, model in models.items()}
+    np.testing.assert_allclose(samples['true'], samples['false'], rtol=1e-4, atol=1e-5)
+
+    model = models['true']
+    model.train_discriminator(real_batch())
+    model.train_generator()
+    steps = (model.train_discriminator, model.train_generator)
+    n_traces = [step.experimental_get_tracing_count() for step in steps]
+    for seed in range(1, 3):
+        d_loss = model.train_discriminator(real_batch(seed))
+        g_loss = model.train_generator()
+    assert np.isfinite(d_loss.numpy()) and np.isfinite(g_loss.numpy())
+    # compiled at the first call only, the cached cluster after
+    assert [step.experimental_get_tracing_count() for step in steps] == n_traces
+
+
+def test_weight_clip_constraint_matches_loop(tmp_path):
+    x = real_batch()
+    models = {}
+    for clip_mode in ('constraint', 'loop'):
+        models[clip_mode] = build_wgan(tmp_path, '--clip_mode', clip_mode, '--d_lr', '0.1', '--grad_clip', '0.01')
+        for _ in range(3):
+            models[clip_mode].train_discriminator(x)
+
+    for clip_mode, model in models.items():
+        for var in model.discriminator.trainable_variables:
+            assert np.abs(var.numpy()).max() <= 0.01 + 1e-7, (clip_mode, var.name)
+
+    for w, loop_w in zip(models['constraint'].discriminator.weights, models['loop'].discriminator.weights):
+        np.testing.assert_allclose(w.numpy(), loop_w.numpy(), rtol=1e-5, atol=1e-7)
+
+
+def test_weight_clip_low_precision():
+    clip = WeightClip(0.5)
+    w = tf.constant([-2.0, -0.25, 0.75], dtype=tf.bfloat16)
+    clipped = clip(w)
+    assert clipped.dtype == tf.bfloat16
+    np.testing.assert_array_equal(clipped.numpy().astype(np.float32), [-0.5, -0.25, 0.5])
+    assert WeightClip(**clip.get_config()).clip_value == 0.5
+
+
+@pytest.mark.parametrize('async_checkpoint', ['false', 'true'])
+def test_checkpoint_resume(tmp_path, async_checkpoint):
+    model = build_wgan(tmp_path, '--async_checkpoint', async_checkpoint)
+    model.train_discriminator(real_batch())
+    model.save(epoch=2, global_step=30)
+    if model.checkpoint_options is not None and hasattr(model.checkpoint, 'sync'):
+        model.checkpoint.sync()
+
+    resumed = build_wgan(tmp_path, '--async_checkpoint', async_checkpoint)
+    assert resumed.load() == 3 and int(resumed.global_step) == 30
+    for w, resumed_w in zip(get_weights(model), get_weights(resumed)):
+        np.testing.assert_array_equal(resumed_w, w)
+    np.testing.assert_array_equal(resumed.rng.state.numpy(), model.rng.state.numpy())
+
+
+def test_non_chief_checkpoint_dir(tmp_path, monkeypatch):
+    chief = build_wgan(tmp_path, '--async_checkpoint', 'false')
+    chief.save(epoch=0, global_step=1)
+    chief_files = sorted(os.listdir(chief.model_path))
+
+    monkeypatch.setattr(wgan_model, 'is_chief', lambda strategy: False)
+    worker = build_wgan(tmp_path, '--async_checkpoint', 'false')
+    assert not worker.is_chief and worker.checkpoint_dir != worker.model_path
+    assert os.path.basename(worker.checkpoint_dir).startswith('wgan-worker-0-')
+
+    worker.save(epoch=1, global_step=2)
+    assert not os.path.exists(worker.checkpoint_dir)  # only its own temp dir is removed
+    assert sorted(os.listdir(chief.model_path)) == chief_files
+
+
+def test_train_writes_samples_and_checkpoints(tmp_path):
+    model = build_wgan(tmp_path, '--epochs', '2', '--n_samples', '4', '--async_checkpoint', 'false')
+    os.makedirs(model.output_path)
+
+    dataset = tf.data.Dataset.from_tensor_slices(tf.concat([real_batch(0), real_batch(1)], axis=0)).batch(4)
+    model.train(dataset)
+
+    assert sorted(os.listdir(model.output_path)) == ['0.png', '1.png']  # flushed before train returns
+    assert int(model.epoch) == 2 and int(model.global_step) == 4
+
+
+@pytest.fixture
+def global_policy():
+    policy = tf.keras.mixed_precision.global_policy()
+    yield
+    tf.keras.mixed_precision.set_global_policy(policy)
+
+
+@pytest.mark.parametrize('precision, compute_dtype', [('bf16', 'bfloat16'), ('mixed_bf16', 'bfloat16')])
+def test_precision_policy(tmp_path, global_policy, precision, compute_dtype):
+    tf.keras.mixed_precision.set_global_policy('float64')  # the caller's, kept as it is
+    model = build_wgan(tmp_path, '--precision', precision)
+    assert tf.keras.mixed_precision.global_policy().name == 'float64'
+
+    assert model.discriminator.layers[1].compute_dtype == compute_dtype
+    assert model.discriminator.output.dtype == tf.float32 and model.generator.output.dtype == tf.float32
+
+    d_loss = model.train_discriminator(real_batch())
+    assert d_loss.dtype == tf.float32 and np.isfinite(d_loss.numpy())
+    assert not isinstance(model.d_opt, tf.keras.mixed_precision.LossScaleOptimizer)
+
+
+def test_mixed_fp16_loss_scaling(tmp_path, global_policy):
+    model = build_wgan(tmp_path, '--precision', 'mixed_fp16')
+    assert tf.keras.mixed_precision.global_policy().name == 'float32'
+    assert isinstance(model.d_opt, tf.keras.mixed_precision.LossScaleOptimizer)
+    assert isinstance(model.g_opt, tf.keras.mixed_precision.LossScaleOptimizer)
+    assert np.isfinite(model.train_discriminator(real_batch()).numpy())
+
+
+@pytest.mark.parametrize(
+    'policy, scaled',
+    [('float32', False), ('mixed_bfloat16', False), ('bfloat16', False), ('mixed_float16', True), ('float16', True)],
+)
+def test_build_loss_scale_optimizer(policy, scaled):
+    for p in (policy, tf.keras.mixed_precision.Policy(policy)):
+        optimizer = build_loss_scale_optimizer(tf.keras.optimizers.SGD(), p)
+        assert isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer) == scaled